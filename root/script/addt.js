@@ -97,7 +97,7 @@ function addt_click_save()
 async function addt_ui_init(dt)
 {
     diagnostics_add_message("Contacting server...");
-    let data = await retrieve_data(dt)
+    let data = await retrieve_data(dt, ["name", "keywords"])
     if (!data)
     {
         // show an error message
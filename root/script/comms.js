@@ -34,15 +34,19 @@ async function send_request(endpoint, method, jdata)
     return JSON.parse(text);
 }
 
-// Used to retrieve all budget data from the server.
-async function retrieve_data(dt)
+// Used to retrieve all budget data from the server. Optionally takes in a list
+// of the class fields to retrieve (such as only the class metadata, without
+// each class's history).
+async function retrieve_data(dt, fields)
 {
     // choose the current date by default
     if (!dt)
     { dt = new Date(); }
 
-    data = await send_request("/get/all", "POST",
-                              {"datetime": dt.getTime() / 1000.0});
+    let jdata = {"datetime": dt.getTime() / 1000.0};
+    if (fields)
+    { jdata.fields = fields; }
+    data = await send_request("/get/all", "POST", jdata);
     if (!data.success)
     {
         let message = "failed to retrieve content (" + data.message + ")."
@@ -51,6 +55,28 @@ async function retrieve_data(dt)
     return data;
 }
 
+// Used to retrieve one page of a budget class's transaction history. Takes in
+// the cursor returned with the previous page (or null for the first page) and
+// the maximum number of transactions to retrieve.
+async function retrieve_history(dt, class_id, cursor, limit)
+{
+    // choose the current date by default
+    if (!dt)
+    { dt = new Date(); }
+
+    let jdata = {"datetime": dt.getTime() / 1000.0, "class_id": class_id,
+                 "limit": limit};
+    if (cursor)
+    { jdata.cursor = cursor; }
+    data = await send_request("/get/history", "POST", jdata);
+    if (!data.success)
+    {
+        let message = "failed to retrieve history (" + data.message + ")."
+        console.log(message);
+    }
+    return data;
+}
+
 // Special-use function for downloading a spreadsheet of the budget through the
 // /get/spreadsheet endpoint.
 function retrieve_spreadsheet(dt)
@@ -15,8 +15,12 @@ const datetime_container = document.getElementById("datetime");
 
 // Other globals
 let budget_total_income = 0.0;
+let budget_summary = null;          // budget summary retrieved from the server
+let budget_class_summaries = {};    // class ID --> class summary
 let budget_rdates = null;
 let budget_datetime = null;
+const bclass_fields = ["name", "type", "description", "keywords", "target"];
+const history_page_size = 250;      // transactions per history request
 
 // ============================== Interaction =============================== //
 // Invoked when a transaction row is clicked in a budget class table.
@@ -136,8 +140,9 @@ function make_bclass_menu(bclass)
     if (bclass.target)
     {
         let tp = document.createElement("p");
-        tval = btarget_value(bclass.target, budget_total_income);
-        tdiff = bclass_sum(bclass) - tval;
+        let cs = budget_class_summaries[bclass.id];
+        tval = cs ? cs.target : btarget_value(bclass.target, budget_total_income);
+        tdiff = (cs ? cs.total : 0.0) - tval;
 
         // now, come up with an appropriate message
         tp.innerHTML = "This class is ";
@@ -284,6 +289,49 @@ function make_bclass_history(bclass)
     return tdiv;
 }
 
+// Retrieves a budget class's transaction history from the server, one page at
+// a time, and stores it in the class's 'history' field. Returns true on
+// success.
+async function bclass_history_load(bclass)
+{
+    let history = [];
+    let cursor = null;
+    do
+    {
+        let data = await retrieve_history(budget_datetime, bclass.id,
+                                          cursor, history_page_size);
+        if (!data || !data.success)
+        { return false; }
+        history = history.concat(data.payload.history);
+        cursor = data.payload.cursor;
+    } while (cursor);
+    bclass.history = history;
+    return true;
+}
+
+// Invoked when a budget class's collapsible is opened. The first time, this
+// retrieves the class's history and fills the given div with the transaction
+// table and charts.
+async function bclass_history_show(bclass, div)
+{
+    if (bclass.history_requested)
+    { return; }
+    bclass.history_requested = true;
+    div.innerHTML = "<p><i>Loading transactions...</i></p>";
+
+    // retrieve the history; on failure, allow another attempt
+    let success = await bclass_history_load(bclass);
+    div.innerHTML = "";
+    if (!success)
+    {
+        bclass.history_requested = false;
+        div.innerHTML = make_error_message("Failed to retrieve transactions from the server.");
+        return;
+    }
+    div.appendChild(make_bclass_history(bclass));
+    div.appendChild(make_bclass_charts(bclass));
+}
+
 // Builds and returns one or more charts (with Chart.js) for a given class.
 function make_bclass_charts(bclass)
 {
@@ -488,25 +536,13 @@ function make_savings_table(savings_categories)
 
 // =============================== UI Updates =============================== //
 // Used to refresh the summary written at the top of the page.
-async function summary_refresh(bclasses)
+async function summary_refresh(summary)
 {
     summary_container.innerHTML = "";
-    // we'll compute some statistics
-    let total_expense = 0.0;    // total expense costs
-    let total_income = 0.0;     // total income gain
-    let total = 0.0;            // net gain/loss total
- 
-    // iterate through every budget class
-    for (let i = 0; i < bclasses.length; i++)
-    {
-        // increment the sums for all categories
-        let sum = bclass_sum(bclasses[i]);
-        if (bclass_is_expense(bclasses[i]))
-        { total_expense += sum; }
-        else if (bclass_is_income(bclasses[i]))
-        { total_income += sum; }
-    }
-    total = total_income - total_expense;
+    // the server has already computed the statistics
+    let total_expense = summary.expenses;   // total expense costs
+    let total_income = summary.income;      // total income gain
+    let total = summary.surplus;            // net gain/loss total
     
     let elem = document.createElement("p");
 
@@ -550,33 +586,13 @@ async function summary_refresh(bclasses)
 }
 
 // Used to refresh the savings menu.
-async function savings_refresh(bclasses, savings_categories)
+async function savings_refresh(summary, savings_categories)
 {
-    // first, compute the income and expense sums
-    let esum = 0.0;
-    let isum = 0.0;
-    for (let i = 0; i < bclasses.length; i++)
-    {
-        let sum = bclass_sum(bclasses[i]);
-        if (bclass_is_expense(bclasses[i]))
-        { esum += sum; }
-        else if (bclass_is_income(bclasses[i]))
-        { isum += sum; }
-    }
-    sumdiff = isum - esum;
-    
-    // compute an array of the savings amounts for each category
+    // the server computes each category's amount; add them up
+    sumdiff = summary.surplus;
     savings_sum = 0.0;
     for (let i = 0; i < savings_categories.length; i++)
-    {
-        let save_amount = 0.0;
-        if (sumdiff > 0.0)
-        { save_amount = savings_categories[i].percent * sumdiff; }
-        // set the field in each category, and add to our savings sum
-        savings_categories[i].amount = save_amount;
-        savings_sum += save_amount;
-
-    }
+    { savings_sum += savings_categories[i].amount; }
  
     // create the collapsible button and content
     savings_btn = make_collapsible_button("savings_btn", "Savings",
@@ -660,12 +676,14 @@ async function budget_class_refresh(bclass)
         // create the button and add it to the div (making the right-hand text
         // the total dollar value of the class, factoring in the target, if
         // one exists for this class)
-        let bcsum = bclass_sum(bclass);
+        let cs = budget_class_summaries[bclass.id];
+        let bcsum = cs ? cs.total : 0.0;
         let sumstr = float_to_dollar_string(bcsum);
         let tstr = "";
         if (bclass.target)
         {
-            tstr += " / " + float_to_dollar_string(btarget_value(bclass.target, budget_total_income));
+            let tval = cs ? cs.target : btarget_value(bclass.target, budget_total_income);
+            tstr += " / " + float_to_dollar_string(tval);
             tstr = "<span class=\"color-text2\">" + tstr + "</span>";
         }
         bclass_btn = make_collapsible_button(btn_id, bclass.name, sumstr + tstr,
@@ -683,12 +701,16 @@ async function budget_class_refresh(bclass)
         bclass_div.appendChild(bclass_content);
         collapsible_init(bclass_btn);
         
-        // add a menu to the bclass's content section, then add a listing of
-        // the class's transaction history
+        // add a menu to the bclass's content section, then add a div for the
+        // listing of the class's transaction history. The history isn't
+        // retrieved until the collapsible is opened
+        const history_div = document.createElement("div");
         bclass_content.appendChild(make_bclass_menu(bclass));
-        bclass_content.appendChild(make_bclass_history(bclass));
-        bclass_content.appendChild(make_bclass_charts(bclass));
+        bclass_content.appendChild(history_div);
         bclass_content.appendChild(make_bclass_bottom_menu(bclass));
+        bclass_btn.addEventListener("click", function() {
+            bclass_history_show(bclass, history_div);
+        });
     }
 }
 
@@ -726,7 +748,7 @@ function budget_datetime_init(dt, reset_dates)
 async function ui_init(dt)
 {
     diagnostics_add_message("Contacting server...");
-    let data = await retrieve_data(dt);
+    let data = await retrieve_data(dt, bclass_fields);
     if (!data)
     {
         // show an error message
@@ -744,12 +766,12 @@ async function ui_init(dt)
     }
     budget_rdates = rdates.payload;
     
-    // also, look up the savings categories
-    let scs = await send_request("/get/savings", "POST", {"datetime": dt.getTime() / 1000.0});
-    if (!scs)
+    // also, retrieve the budget summary (totals, targets, and savings)
+    let summary = await send_request("/get/summary", "POST", {"datetime": dt.getTime() / 1000.0});
+    if (!summary || !summary.success)
     {
         diagnostics_clear();
-        diagnostics_add_error("Failed to retrieve savings categories from the server.");
+        diagnostics_add_error("Failed to retrieve the budget summary from the server.");
         return;
     }
     diagnostics_clear();
@@ -762,23 +784,22 @@ async function ui_init(dt)
     let reset_dates = rdates.payload;
     reset_dates.sort(function(rd1, rd2) { return rd1 - rd2; });
     
+    // extract the summary, and map each class's summary by its ID
+    budget_summary = summary.payload;
+    budget_total_income = budget_summary.income;
+    budget_class_summaries = {};
+    for (let i = 0; i < budget_summary.classes.length; i++)
+    { budget_class_summaries[budget_summary.classes[i].id] = budget_summary.classes[i]; }
+
     // extract the savings categories and sort by name
-    let savings_categories = scs.payload;
+    let savings_categories = budget_summary.savings;
     savings_categories.sort(function(sc1, sc2) { return sc1.category.localeCompare(sc2.category); });
 
-    // compute total income
-    budget_total_income = 0.0;
-    for (let i = 0; i < bclasses.length; i++)
-    {
-        if (bclass_is_income(bclasses[i]))
-        { budget_total_income += bclass_sum(bclasses[i]); }
-    }
-
     // pass the budget classes to refresh functions
-    summary_refresh(bclasses);
+    summary_refresh(budget_summary);
     menu_refresh(bclasses);
     budget_datetime_init(dt, reset_dates);
-    savings_refresh(bclasses, savings_categories);
+    savings_refresh(budget_summary, savings_categories);
     budget_classes_refresh(bclasses);
 }
 
@@ -18,3 +18,8 @@ ${pip} install --user -U PyJWT
 echo -e "${C_ACC}Installing openpyxl...${C_NONE}"
 ${pip} install --user -U openpyxl
 
+echo -e "${C_ACC}Installing waitress and gunicorn (optional production servers)...${C_NONE}"
+${pip} install --user -U waitress gunicorn
+
+echo -e "${C_ACC}Installing orjson (optional faster JSON encoding)...${C_NONE}"
+${pip} install --user -U orjson
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# Benchmark for the JSON codec used by class files (see lib/codec.py). Builds
+# a budget class with a growing number of transactions, then measures how
+# many transactions per second can be saved to and loaded from a class file,
+# in both the compact and the pretty (indented) encodings. The size of each
+# file is reported as well.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import random
+import shutil
+import tempfile
+import argparse
+import time
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.bclass import BudgetClass, BudgetClassType
+from lib.transaction import Transaction
+from lib.fileio import get_writer
+from lib.codec import CODEC_BACKEND
+
+
+# ================================= Helpers ================================== #
+# Takes in a number of transactions and returns a budget class holding that
+# many. The same seed produces the same class.
+def make_class(transaction_count, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now().timestamp()
+    bc = BudgetClass("Benchmark", BudgetClassType.EXPENSE, "Benchmark class",
+                     keywords=["bench"], history=[])
+    bc.history.extend([Transaction(float(rng.randint(1, 10000)) / 100.0,
+                                   vendor="vendor %d" % rng.randint(0, 200),
+                                   description="transaction %d" % i,
+                                   timestamp=datetime.fromtimestamp(now - rng.randint(0, 86400 * 25)))
+                       for i in range(transaction_count)])
+    return bc
+
+# Invokes the given function the given number of times and returns the
+# average number of seconds each call took.
+def time_calls(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count
+
+
+# ================================ Benchmark ================================= #
+# Takes in a number of transactions, whether or not to use the pretty
+# encoding, and the number of saves and loads to time. Returns a dictionary of
+# results.
+def bench_codec(size, pretty, count):
+    d = tempfile.mkdtemp(prefix="sb_bench_")
+    try:
+        fpath = os.path.join(d, "benchmark.json")
+        writer = get_writer("batched")
+        bc = make_class(size)
+        save_s = time_calls(lambda i: bc.save(fpath, writer=writer, pretty=pretty), count)
+        load_s = time_calls(lambda i: BudgetClass.load(fpath), count)
+        return {
+            "transactions": size,
+            "encoding": "pretty" if pretty else "compact",
+            "bytes": os.path.getsize(fpath),
+            "save_tps": size / save_s,
+            "load_tps": size / load_s
+        }
+    finally:
+        shutil.rmtree(d)
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark class file encoding and decoding.")
+    p.add_argument("--sizes", metavar="N", type=int, nargs="+",
+                   default=[1000, 10000, 100000],
+                   help="Transaction counts to benchmark.")
+    p.add_argument("--count", metavar="N", type=int, default=5,
+                   help="Number of saves and loads to time at each size.")
+    args = p.parse_args()
+
+    print("JSON backend: %s" % CODEC_BACKEND)
+    results = []
+    for size in args.sizes:
+        for pretty in [False, True]:
+            results.append(bench_codec(size, pretty, args.count))
+            r = results[-1]
+            print("%8d transactions (%7s): %10d bytes, save %10.0f t/s, load %10.0f t/s" %
+                  (size, r["encoding"], r["bytes"], r["save_tps"], r["load_tps"]))
+    return results
+
+# Runner code
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# Synthetic budget generator. Writes a realistic save tree for benchmarks: a
+# config file, plus a number of reset periods (ending with the current one,
+# and laid out by the config's reset dates), each holding the same budget
+# classes with their own transactions. The same seed (on the same day) always
+# produces the same budget, in either storage backend.
+#
+# Usage: generate.py DIRECTORY [--periods N] [--classes M] [--transactions K]
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.bclass import BudgetClass, BudgetClassType
+from lib.btarget import BudgetTarget
+from lib.transaction import Transaction
+from lib.storage import make_storage, STORAGE_BACKENDS
+
+# Globals
+GENERATE_RESET_DATES = ["%d-1" % m for m in range(1, 13)]
+# Templates for the generated classes: [name, vendors, lowest price, highest
+# price]. Classes past the end of the list reuse these with a number added.
+GENERATE_EXPENSES = [
+    ["Groceries", ["Kroger", "Food Lion", "Aldi", "Trader Joe's", "Costco"], 5.0, 180.0],
+    ["Dining", ["Chipotle", "Panera Bread", "Starbucks", "Local Diner"], 4.0, 60.0],
+    ["Gas", ["Shell", "Exxon", "Sheetz", "BP"], 20.0, 70.0],
+    ["Utilities", ["Power Company", "Water Authority", "Internet Provider"], 30.0, 150.0],
+    ["Shopping", ["Amazon", "Target", "Walmart", "Best Buy"], 3.0, 400.0],
+    ["Entertainment", ["Movie Theater", "Steam", "Concert Venue"], 8.0, 90.0],
+    ["Health", ["Pharmacy", "Urgent Care", "Dentist"], 10.0, 250.0],
+    ["Travel", ["Airline", "Hotel", "Rental Car"], 50.0, 900.0]
+]
+GENERATE_INCOMES = [
+    ["Paycheck", ["Employer"], 1500.0, 3000.0],
+    ["Side Work", ["Client"], 50.0, 500.0]
+]
+
+
+# ================================= Helpers ================================== #
+# Takes in a directory, a storage backend, and (optionally) extra config
+# fields, and writes a config file (with an empty save and backup location)
+# into the directory. Returns the config file's path.
+def make_config(dpath, backend="json", fields={}):
+    for d in ["save", "backup"]:
+        if not os.path.isdir(os.path.join(dpath, d)):
+            os.makedirs(os.path.join(dpath, d))
+    jdata = {
+        "name": "Synthetic Budget",
+        "save_location": os.path.join(dpath, "save"),
+        "backup_location": os.path.join(dpath, "backup"),
+        "reset_dates": GENERATE_RESET_DATES,
+        "surplus_savings": [{"category": "Savings", "percent": 0.1}],
+        "storage": backend
+    }
+    jdata.update(fields)
+    cpath = os.path.join(dpath, "config.json")
+    fp = open(cpath, "w")
+    fp.write(json.dumps(jdata, indent=4))
+    fp.close()
+    return cpath
+
+# Takes in a Config object, a datetime, and a number of periods, and returns a
+# list of that many reset periods, oldest first, ending with the datetime's.
+def generate_periods(conf, dt, count):
+    periods = [conf.periods.period(dt)]
+    while len(periods) < count:
+        periods.insert(0, conf.periods.period(periods[0].start - timedelta(days=1)))
+    return periods
+
+# Takes in a number of classes and a random number generator and returns a
+# list of [budget class, template] pairs. Roughly one in five classes is an
+# income class.
+def generate_classes(count, rng):
+    classes = []
+    for i in range(count):
+        income = i % 5 == 4
+        templates = GENERATE_INCOMES if income else GENERATE_EXPENSES
+        idx = (i // 5) if income else (i - i // 5)
+        tmp = templates[idx % len(templates)]
+        name = tmp[0] if idx < len(templates) else "%s %d" % (tmp[0], idx // len(templates) + 1)
+        ctype = BudgetClassType.INCOME if income else BudgetClassType.EXPENSE
+        target = None
+        if not income and rng.random() < 0.5:
+            target = BudgetTarget(float(rng.randint(2, 20) * 50))
+        bc = BudgetClass(name, ctype, "Synthetic %s class" % name.lower(),
+                         keywords=[name.lower()] + [v.lower() for v in tmp[1]], history=[],
+                         target=target, bcid="%064x" % rng.getrandbits(256))
+        classes.append([bc, tmp])
+    return classes
+
+
+# ================================= Generator ================================ #
+# Takes in a Config object, the number of periods, classes, and transactions
+# per class to generate, a seed, and the datetime of the newest period (now,
+# by default). Every period's classes are written to the config's storage.
+# Transactions are spread across each period, up to the end of the datetime's
+# day. Returns a summary of what was generated.
+def generate(conf, periods, classes, transactions, seed=0, dt=None):
+    dt = datetime.now() if dt == None else dt
+    rng = random.Random(seed)
+    storage = make_storage(conf)
+    templates = generate_classes(classes, rng)
+    plist = generate_periods(conf, dt, periods)
+    last = datetime(dt.year, dt.month, dt.day) + timedelta(days=1)
+    for p in plist:
+        span = (min(p.end, last) - p.start).total_seconds()
+        for (base, tmp) in templates:
+            bc = BudgetClass(base.name, base.ctype, base.desc, keywords=base.keywords,
+                             history=[], target=base.target, bcid=base.bcid)
+            ts = []
+            for i in range(transactions):
+                vendor = rng.choice(tmp[1])
+                ts.append(Transaction(round(rng.uniform(tmp[2], tmp[3]), 2), vendor=vendor,
+                                      description="%s purchase %d" % (vendor, i),
+                                      timestamp=p.start + timedelta(seconds=rng.uniform(0, span)),
+                                      recur=rng.random() < 0.02))
+            ts.sort(key=lambda t: t.timestamp)
+            bc.history.extend(ts)
+            storage.save_class(p.name, bc)
+    return {
+        "backend": conf.storage,
+        "periods": [p.name for p in plist],
+        "classes": classes,
+        "transactions": periods * classes * transactions,
+        "seed": seed
+    }
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Generate a synthetic budget.")
+    p.add_argument("directory", metavar="DIRECTORY",
+                   help="Directory to write the config and save tree into.")
+    p.add_argument("--backend", default="json", choices=STORAGE_BACKENDS,
+                   help="Storage backend to write to.")
+    p.add_argument("--periods", metavar="N", type=int, default=12,
+                   help="Number of reset periods to generate.")
+    p.add_argument("--classes", metavar="M", type=int, default=10,
+                   help="Number of classes in each period.")
+    p.add_argument("--transactions", metavar="K", type=int, default=100,
+                   help="Number of transactions in each class.")
+    p.add_argument("--seed", metavar="N", type=int, default=0,
+                   help="Random seed.")
+    args = p.parse_args()
+
+    cpath = make_config(args.directory, backend=args.backend)
+    summary = generate(Config(cpath), args.periods, args.classes, args.transactions,
+                       seed=args.seed)
+    summary["config"] = cpath
+    print(json.dumps(summary, indent=4))
+
+# Runner code
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Micro-benchmark for Budget.get_class and Budget.get_transaction. Builds a
+# throwaway budget with a growing number of transactions and measures how long
+# ID lookups take at each size. Lookups are served by the budget's ID indexes,
+# so their latency should stay flat as the history grows.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import time
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.budget import Budget
+from lib.bclass import BudgetClass, BudgetClassType
+from lib.transaction import Transaction
+
+
+# ================================= Helpers ================================== #
+# Creates a temporary directory containing a config file and an empty save and
+# backup location. Returns the directory path and the config file path.
+def make_budget_dir():
+    d = tempfile.mkdtemp(prefix="sb_bench_")
+    os.mkdir(os.path.join(d, "save"))
+    os.mkdir(os.path.join(d, "backup"))
+    jdata = {
+        "name": "Benchmark Budget",
+        "save_location": os.path.join(d, "save"),
+        "backup_location": os.path.join(d, "backup"),
+        "reset_dates": ["%d-1" % m for m in range(1, 13)],
+        "surplus_savings": [{"category": "Savings", "percent": 0.1}]
+    }
+    cpath = os.path.join(d, "config.json")
+    fp = open(cpath, "w")
+    fp.write(json.dumps(jdata))
+    fp.close()
+    return d, cpath
+
+# Takes in a Budget, a number of classes, and a total number of transactions,
+# and writes that many classes and transactions into the budget's storage
+# (directly, without going through the budget).
+def populate(budget, class_count, transaction_count):
+    now = budget.datetime.timestamp()
+    for i in range(class_count):
+        bc = BudgetClass("Class %d" % i, BudgetClassType.EXPENSE,
+                         "Benchmark class %d" % i, keywords=["class%d" % i],
+                         history=[])
+        for j in range(transaction_count // class_count):
+            ts = datetime.fromtimestamp(now - random.randint(0, 86400 * 25))
+            bc.add(Transaction(float(random.randint(1, 10000)) / 100.0,
+                               vendor="vendor %d" % j,
+                               description="transaction %d-%d" % (i, j),
+                               timestamp=ts))
+        budget.storage.save_class(budget.period.name, bc)
+
+# Invokes the given function the given number of times and returns the average
+# latency, in microseconds.
+def time_calls(func, args, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(args[i % len(args)])
+    return (time.perf_counter() - start) * 1000000.0 / count
+
+
+# ================================ Benchmark ================================= #
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark budget ID lookups.")
+    p.add_argument("--sizes", metavar="N", type=int, nargs="+",
+                   default=[1000, 10000, 100000],
+                   help="Total transaction counts to benchmark.")
+    p.add_argument("--classes", metavar="N", type=int, default=20,
+                   help="Number of budget classes to spread transactions across.")
+    p.add_argument("--lookups", metavar="N", type=int, default=10000,
+                   help="Number of lookups to time at each size.")
+    args = p.parse_args()
+    random.seed(0)
+
+    results = []
+    for size in args.sizes:
+        d, cpath = make_budget_dir()
+        try:
+            dt = datetime.now()
+            populate(Budget(Config(cpath, dt=dt), dt=dt), args.classes, size)
+            b = Budget(Config(cpath, dt=dt), dt=dt)
+
+            # pick out random IDs to look up
+            cids = [bc.bcid for bc in b.classes]
+            tids = list(b.transaction_index.keys())
+            random.shuffle(tids)
+
+            results.append({
+                "transactions": size,
+                "get_class_us": time_calls(b.get_class, cids, args.lookups),
+                "get_transaction_us": time_calls(b.get_transaction, tids, args.lookups)
+            })
+            r = results[-1]
+            print("%8d transactions: get_class %.2fus, get_transaction %.2fus" %
+                  (size, r["get_class_us"], r["get_transaction_us"]))
+        finally:
+            shutil.rmtree(d)
+    return results
+
+# Runner code
+if __name__ == "__main__":
+    main()
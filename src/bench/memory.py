@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# Memory benchmark for transaction history storage. Builds histories of
+# increasing size in both containers (a TransactionHistory of Transaction
+# objects, and a columnar TransactionTable) and reports how much memory each
+# one holds on to, as measured by tracemalloc.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import gc
+import random
+import argparse
+import tracemalloc
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.transaction import Transaction
+from lib.thistory import TransactionHistory
+from lib.ttable import TransactionTable
+
+
+# ================================= Helpers ================================== #
+# Generator that yields the given number of random transactions. A small pool
+# of vendors is used, like a real budget would have.
+def make_transactions(count, seed=0):
+    rng = random.Random(seed)
+    vendors = ["vendor %d" % i for i in range(200)]
+    start = datetime(2020, 1, 1).timestamp()
+    for i in range(count):
+        yield Transaction(float(rng.randint(1, 100000)) / 100.0,
+                          vendor=rng.choice(vendors),
+                          description="transaction %d" % i,
+                          timestamp=datetime.fromtimestamp(start + rng.randint(0, 86400 * 365 * 3)))
+
+# Builds a history container of the given type and size, and returns the
+# number of bytes it holds (and the peak number of bytes allocated while
+# building it).
+def measure(history_type, count):
+    gc.collect()
+    tracemalloc.start()
+    history = history_type(make_transactions(count))
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(history) == count
+    return current, peak
+
+
+# ================================ Benchmark ================================= #
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark transaction history memory usage.")
+    p.add_argument("--sizes", metavar="N", type=int, nargs="+",
+                   default=[10000, 100000, 1000000],
+                   help="Transaction counts to benchmark.")
+    args = p.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for name, htype in [["list", TransactionHistory], ["columnar", TransactionTable]]:
+            current, peak = measure(htype, size)
+            results.append({"store": name, "transactions": size,
+                            "bytes": current, "peak_bytes": peak})
+            print("%8d transactions, %-8s: %8.2f MiB held (%7.1f bytes each), %8.2f MiB peak" %
+                  (size, name, current / 1048576.0, float(current) / size,
+                   peak / 1048576.0))
+    return results
+
+# Runner code
+if __name__ == "__main__":
+    main()
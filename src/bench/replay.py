@@ -0,0 +1,487 @@
+#!/usr/bin/python3
+# HTTP load driver for the server. Runs a number of concurrent clients against
+# a running server. Each client logs in through '/auth/login', then sends a
+# mix of requests: either a synthetic mix of '/get/all', '/search/*',
+# '/create/transaction', and '/edit/*' calls, or a recording of requests (JSON
+# Lines: one {"client": ..., "endpoint": ..., "body": ...} object per line)
+# made by an earlier run. Recorded creations also hold the ID of the
+# transaction they created, so that edits to it can be pointed at the
+# transaction the replayed creation makes instead. Latency percentiles and error rates are reported per endpoint, as JSON.
+#
+# In fixture mode, no server is needed: a synthetic budget is generated (see
+# generate.py), a server is started on it (in a separate process), and the
+# server's notification webhook is pointed at a local stub, so nothing is
+# sent over the network.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+import random
+import shutil
+import socket
+import tempfile
+import argparse
+import threading
+import subprocess
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from generate import make_config, generate, GENERATE_EXPENSES, GENERATE_INCOMES
+
+# Globals
+REPLAY_MIX = [                      # [operation, weight] of the synthetic mix
+    ["get_all", 15],
+    ["search_class", 10],
+    ["search_transaction", 20],
+    ["create_transaction", 30],
+    ["edit_class", 5],
+    ["edit_transaction", 20]
+]
+REPLAY_PASSWORD = "replay"          # auth key of the fixture server
+REPLAY_USERNAME = "replay"          # user of the fixture server
+
+
+# ================================= Helpers ================================== #
+# Takes in a sorted list of latencies (in milliseconds) and a percentile (from
+# 0 to 100), and returns the latency at that percentile.
+def percentile(lats, pct):
+    if len(lats) == 0:
+        return 0.0
+    return lats[min(len(lats) - 1, int(len(lats) * pct / 100.0))]
+
+# Returns an unused TCP port on the local machine.
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+# ================================ Statistics ================================ #
+# Collects the latency and outcome of every request, per endpoint. Shared by
+# every client.
+class ReplayStats:
+    # Constructor.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lats = {}              # endpoint --> list of latencies (ms)
+        self.errors = {}            # endpoint --> number of failed requests
+
+    # Takes in an endpoint, the request's latency, and whether or not it
+    # succeeded, and records it.
+    def add(self, endpoint, ms, success):
+        with self.lock:
+            self.lats.setdefault(endpoint, []).append(ms)
+            self.errors.setdefault(endpoint, 0)
+            if not success:
+                self.errors[endpoint] += 1
+
+    # Returns a JSON object summarizing each endpoint's requests.
+    def to_json(self):
+        with self.lock:
+            jdata = {}
+            for (endpoint, lats) in sorted(self.lats.items()):
+                lats = sorted(lats)
+                jdata[endpoint] = {
+                    "requests": len(lats),
+                    "errors": self.errors[endpoint],
+                    "error_rate": self.errors[endpoint] / len(lats),
+                    "mean_ms": sum(lats) / len(lats),
+                    "p50_ms": percentile(lats, 50),
+                    "p90_ms": percentile(lats, 90),
+                    "p99_ms": percentile(lats, 99),
+                    "max_ms": lats[-1]
+                }
+            return jdata
+
+
+# ================================== Client ================================== #
+# A single client. It logs in, learns the budget's class IDs, and then sends
+# requests one at a time. Transactions are only edited by the client that
+# created them, so clients don't trip over each other's edits.
+class ReplayClient:
+    # Constructor. Takes in the server's URL, the username and password to log
+    # in with, the shared statistics, a seed, and the fraction of requests
+    # that ask the server to send a notification.
+    def __init__(self, url, username, password, stats, seed=0, notify_rate=0.0):
+        self.url = url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.notify_rate = notify_rate
+        self.session = requests.Session()
+        self.class_ids = []
+        self.tids = []              # IDs of transactions this client created
+        self.recording = []         # [endpoint, body, created ID] of requests sent
+
+    # Takes in an endpoint and a JSON body and sends the request. The result
+    # is recorded in the statistics (a request fails if the server doesn't
+    # respond with a 200, or responds with "success" set to false). Returns
+    # the response's JSON, or None if it failed.
+    def request(self, endpoint, body):
+        self.recording.append([endpoint, body, None])
+        start = time.perf_counter()
+        jdata = None
+        try:
+            r = self.session.post(self.url + endpoint, data=json.dumps(body), timeout=60)
+            if r.status_code == 200:
+                jdata = r.json()
+        except Exception as e:
+            pass
+        ms = (time.perf_counter() - start) * 1000.0
+        success = jdata != None and jdata.get("success", False)
+        self.stats.add(endpoint, ms, success)
+        return jdata if success else None
+
+    # Logs in and retrieves the budget's class IDs.
+    def login(self):
+        jdata = self.request("/auth/login", {"username": self.username,
+                                             "password": self.password})
+        assert jdata != None, "failed to log in as \"%s\"" % self.username
+        jdata = self.request("/get/all", {"fields": ["id"]})
+        assert jdata != None, "failed to retrieve the budget's classes"
+        self.class_ids = [c["id"] for c in jdata["payload"]]
+        assert len(self.class_ids) > 0, "the budget has no classes"
+        self.recording = []
+
+    # ------------------------------ Synthetic ------------------------------- #
+    # Picks an operation from the synthetic mix and returns the [endpoint,
+    # body] of its request.
+    def synthetic(self):
+        ops = [m[0] for m in REPLAY_MIX]
+        op = self.rng.choices(ops, weights=[m[1] for m in REPLAY_MIX])[0]
+        vendors = [v for tmp in GENERATE_EXPENSES + GENERATE_INCOMES for v in tmp[1]]
+        if op == "edit_transaction" and len(self.tids) == 0:
+            op = "create_transaction"
+
+        if op == "get_all":
+            return ["/get/all", {"limit": 20}]
+        if op == "search_class":
+            return ["/search/class", {"query": self.rng.choice(vendors).lower(), "limit": 5}]
+        if op == "search_transaction":
+            return ["/search/transaction", {"query": self.rng.choice(vendors), "limit": 20}]
+        if op == "create_transaction":
+            vendor = self.rng.choice(vendors)
+            return ["/create/transaction", {"class_id": self.rng.choice(self.class_ids),
+                                            "price": round(self.rng.uniform(1.0, 200.0), 2),
+                                            "vendor": vendor,
+                                            "description": "replay %s" % vendor,
+                                            "timestamp": int(time.time()),
+                                            "recurring": False}]
+        if op == "edit_class":
+            return ["/edit/class", {"class_id": self.rng.choice(self.class_ids),
+                                    "description": "Edited by replay %d" %
+                                                   self.rng.randint(0, 1000)}]
+        return ["/edit/transaction", {"transaction_id": self.rng.choice(self.tids),
+                                      "price": round(self.rng.uniform(1.0, 200.0), 2)}]
+
+    # Takes in a number of requests and sends that many from the synthetic
+    # mix.
+    def run_synthetic(self, count):
+        for i in range(count):
+            [endpoint, body] = self.synthetic()
+            if self.rng.random() < self.notify_rate:
+                body["notify"] = True
+            jdata = self.request(endpoint, body)
+            if endpoint == "/create/transaction" and jdata != None:
+                self.tids.append(jdata["payload"]["id"])
+                self.recording[-1][2] = self.tids[-1]
+
+    # Takes in a list of recorded [endpoint, body, created ID] requests and
+    # sends each one. Edits to a transaction created by an earlier recorded
+    # request are sent to the transaction its replay created.
+    def run_recording(self, recording):
+        created = {}
+        for (endpoint, body, tid) in recording:
+            body = dict(body)
+            if body.get("transaction_id", None) in created:
+                body["transaction_id"] = created[body["transaction_id"]]
+            jdata = self.request(endpoint, body)
+            if tid != None and jdata != None:
+                created[tid] = jdata["payload"]["id"]
+                self.recording[-1][2] = created[tid]
+
+
+# ================================= Fixture ================================== #
+# Request handler for the stub webhook. Every POST is counted and answered
+# with an empty 200.
+class StubWebhookHandler(BaseHTTPRequestHandler):
+    # Handles a POST request.
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.posts += 1
+        self.send_response(200)
+        self.end_headers()
+
+    # Keeps the stub quiet.
+    def log_message(self, fmt, *args):
+        pass
+
+# A synthetic budget and a server running on it, with its notifications sent
+# to a local stub webhook. Used as a context manager; everything is torn down
+# on exit.
+class ReplayFixture:
+    # Constructor. Takes in the size of the budget to generate, a seed, and
+    # the server mode to run the server in.
+    def __init__(self, periods, classes, transactions, seed=0, server_mode="dev"):
+        self.periods = periods
+        self.classes = classes
+        self.transactions = transactions
+        self.seed = seed
+        self.server_mode = server_mode
+        self.dpath = None
+        self.stub = None
+        self.proc = None
+        self.url = None
+
+    # Generates the budget, starts the stub webhook and the server, and waits
+    # for the server to come up.
+    def __enter__(self):
+        self.dpath = tempfile.mkdtemp(prefix="sb_replay_")
+        try:
+            cpath = make_config(self.dpath)
+            generate(Config(cpath), self.periods, self.classes, self.transactions,
+                     seed=self.seed)
+
+            # start the stub webhook
+            self.stub = ThreadingHTTPServer(("127.0.0.1", 0), StubWebhookHandler)
+            self.stub.lock = threading.Lock()
+            self.stub.posts = 0
+            threading.Thread(target=self.stub.serve_forever, daemon=True).start()
+
+            # write the server's config and start it
+            port = free_port()
+            sconf = {
+                "server_addr": "127.0.0.1",
+                "server_port": port,
+                "server_mode": self.server_mode,
+                "server_root_dpath": self.dpath,
+                "server_home_fname": "index.html",
+                "server_home_auth_fname": "home.html",
+                "server_public_files": [],
+                "server_secret_key": "replay",
+                "sb_config_fpath": cpath,
+                "auth_key": REPLAY_PASSWORD,
+                "auth_jwt_key": "replay",
+                "ifttt_webhook_key": "replay",
+                "notif_webhook_event": "replay",
+                "notif_webhook_url": "http://127.0.0.1:%d/" % self.stub.server_address[1],
+                "certs_enabled": False,
+                "certs_dpath": self.dpath,
+                "certs_cert_fname": "cert.pem",
+                "certs_key_fname": "key.pem",
+                "users": [{"username": REPLAY_USERNAME, "email": "replay@localhost",
+                           "privilege": 1}],
+                "rthread_tick_rate": 43200,
+                "rthread_notif_threshold": 0
+            }
+            spath = os.path.join(self.dpath, "server.json")
+            fp = open(spath, "w")
+            fp.write(json.dumps(sconf, indent=4))
+            fp.close()
+            log = open(os.path.join(self.dpath, "server.log"), "w")
+            self.proc = subprocess.Popen([sys.executable,
+                                          os.path.join(dpath, "server", "main.py"), spath],
+                                         stdout=log, stderr=subprocess.STDOUT)
+            log.close()
+            self.url = "http://127.0.0.1:%d" % port
+            self.wait()
+            return self
+        except Exception as e:
+            self.__exit__(None, None, None)
+            raise e
+
+    # Returns the last few lines of the server's log.
+    def log_tail(self, lines=20):
+        fp = open(os.path.join(self.dpath, "server.log"), "r")
+        text = "".join(fp.readlines()[-lines:])
+        fp.close()
+        return text
+
+    # Waits (for up to 30 seconds) for the server to start answering.
+    def wait(self):
+        for i in range(300):
+            assert self.proc.poll() == None, "the server exited:\n%s" % self.log_tail()
+            try:
+                requests.get(self.url + "/auth/check", timeout=1)
+                return
+            except requests.exceptions.ConnectionError as e:
+                time.sleep(0.1)
+        assert False, "the server didn't start within 30 seconds"
+
+    # Returns the number of notifications the stub webhook received.
+    def notifications(self):
+        with self.stub.lock:
+            return self.stub.posts
+
+    # Stops the server and the stub and deletes the budget.
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.proc != None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired as e:
+                self.proc.kill()
+                self.proc.wait()
+        if self.stub != None:
+            self.stub.shutdown()
+            self.stub.server_close()
+        shutil.rmtree(self.dpath, ignore_errors=True)
+        return False
+
+
+# ================================== Replay ================================== #
+# Takes in a server URL, login credentials, the number of clients, and either
+# a number of synthetic requests per client or a recording (a list of
+# [client, endpoint, body, created ID] requests, which is split between the
+# clients by the client that first sent each request). Returns a JSON object
+# holding the results, along with the new recording.
+def replay(url, username, password, clients, count=0, recording=None, seed=0,
+           notify_rate=0.0):
+    stats = ReplayStats()
+    cs = [ReplayClient(url, username, password, stats, seed=seed + i,
+                       notify_rate=notify_rate) for i in range(clients)]
+    for c in cs:
+        c.login()
+    login_stats = stats
+    stats = ReplayStats()
+    errors = []
+
+    # each client sends its share of the requests
+    def run(idx):
+        c = cs[idx]
+        c.stats = stats
+        try:
+            if recording != None:
+                c.run_recording([r[1:] for r in recording if r[0] % clients == idx])
+            else:
+                c.run_synthetic(count)
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    endpoints = stats.to_json()
+    total = sum(e["requests"] for e in endpoints.values())
+    failed = sum(e["errors"] for e in endpoints.values())
+    result = {
+        "url": url,
+        "clients": clients,
+        "seconds": elapsed,
+        "requests": total,
+        "requests_per_sec": total / elapsed if elapsed > 0 else 0.0,
+        "error_rate": failed / total if total > 0 else 0.0,
+        "client_errors": errors,
+        "login": login_stats.to_json(),
+        "endpoints": endpoints
+    }
+    sent = [[i] + r for (i, c) in enumerate(cs) for r in c.recording]
+    return result, sent
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Replay a mix of requests against the server.")
+    p.add_argument("--url", metavar="URL", default=None,
+                   help="URL of a running server (omit to use --fixture).")
+    p.add_argument("--username", metavar="NAME", default=REPLAY_USERNAME,
+                   help="Username to log in with.")
+    p.add_argument("--password", metavar="KEY", default=REPLAY_PASSWORD,
+                   help="Password (the server's auth key) to log in with.")
+    p.add_argument("--fixture", action="store_true",
+                   help="Start a server on a synthetic budget, with a stub webhook.")
+    p.add_argument("--server-mode", metavar="MODE", default="dev",
+                   choices=["dev", "threads", "processes"],
+                   help="Server mode of the fixture server.")
+    p.add_argument("--periods", metavar="N", type=int, default=3,
+                   help="Number of reset periods in the fixture's budget.")
+    p.add_argument("--classes", metavar="M", type=int, default=10,
+                   help="Number of classes in the fixture's budget.")
+    p.add_argument("--transactions", metavar="K", type=int, default=200,
+                   help="Number of transactions per class in the fixture's budget.")
+    p.add_argument("--clients", metavar="N", type=int, default=8,
+                   help="Number of concurrent clients.")
+    p.add_argument("--requests", metavar="N", type=int, default=100,
+                   help="Number of synthetic requests each client sends.")
+    p.add_argument("--notify-rate", metavar="FRACTION", type=float, default=0.0,
+                   help="Fraction of synthetic requests that ask for a notification.")
+    p.add_argument("--replay", metavar="FILE", default=None,
+                   help="Recording (JSON Lines) to replay instead of the synthetic mix.")
+    p.add_argument("--record", metavar="FILE", default=None,
+                   help="File to record the requests that were sent to (JSON Lines).")
+    p.add_argument("--seed", metavar="N", type=int, default=0,
+                   help="Random seed.")
+    p.add_argument("--output", metavar="FILE", default=None,
+                   help="File to write the results to (instead of stdout).")
+    args = p.parse_args()
+    assert args.fixture or args.url != None, "either --url or --fixture is required"
+
+    # read the recording, if one was given
+    recording = None
+    if args.replay != None:
+        recording = []
+        fp = open(args.replay, "r")
+        for line in fp:
+            if line.strip() != "":
+                r = json.loads(line)
+                recording.append([r.get("client", 0), r["endpoint"], r["body"],
+                                  r.get("id", None)])
+        fp.close()
+
+    # run against the given server, or against a fixture
+    if args.fixture:
+        with ReplayFixture(args.periods, args.classes, args.transactions, seed=args.seed,
+                           server_mode=args.server_mode) as fix:
+            result, sent = replay(fix.url, REPLAY_USERNAME, REPLAY_PASSWORD, args.clients,
+                                  count=args.requests, recording=recording, seed=args.seed,
+                                  notify_rate=args.notify_rate)
+            # notifications are sent after each response, so give the last
+            # ones a moment to land
+            time.sleep(0.5)
+            result["notifications"] = fix.notifications()
+    else:
+        result, sent = replay(args.url, args.username, args.password, args.clients,
+                              count=args.requests, recording=recording, seed=args.seed,
+                              notify_rate=args.notify_rate)
+
+    # save the recording, then write out the results
+    if args.record != None:
+        fp = open(args.record, "w")
+        for (client, endpoint, body, tid) in sent:
+            r = {"client": client, "endpoint": endpoint, "body": body}
+            if tid != None:
+                r["id"] = tid
+            fp.write(json.dumps(r) + "\n")
+        fp.close()
+    text = json.dumps(result, indent=4)
+    if args.output != None:
+        fp = open(args.output, "w")
+        fp.write(text + "\n")
+        fp.close()
+    else:
+        print(text)
+    return result
+
+# Runner code
+if __name__ == "__main__":
+    main()
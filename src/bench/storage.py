@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# Benchmark for the budget storage backends. Builds the same throwaway budget
+# in each backend and measures how long it takes to load the budget (with and
+# without parsing every class's history), search its transactions, and add new
+# transactions.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import time
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.budget import Budget
+from lib.bclass import BudgetClass, BudgetClassType
+from lib.transaction import Transaction
+from lib.storage import STORAGE_BACKENDS
+
+
+# ================================= Helpers ================================== #
+# Creates a temporary directory containing a config file (using the given
+# storage backend) and an empty save and backup location. Returns the
+# directory path and the config file path.
+def make_budget_dir(backend):
+    d = tempfile.mkdtemp(prefix="sb_bench_")
+    os.mkdir(os.path.join(d, "save"))
+    os.mkdir(os.path.join(d, "backup"))
+    jdata = {
+        "name": "Benchmark Budget",
+        "save_location": os.path.join(d, "save"),
+        "backup_location": os.path.join(d, "backup"),
+        "reset_dates": ["%d-1" % m for m in range(1, 13)],
+        "surplus_savings": [{"category": "Savings", "percent": 0.1}],
+        "storage": backend
+    }
+    cpath = os.path.join(d, "config.json")
+    fp = open(cpath, "w")
+    fp.write(json.dumps(jdata))
+    fp.close()
+    return d, cpath
+
+# Takes in a Budget, a number of classes, and a total number of transactions,
+# and writes that many classes and transactions into the budget's storage. The
+# same seed produces the same budget in every backend.
+def populate(budget, class_count, transaction_count, seed=0):
+    rng = random.Random(seed)
+    start = budget.period.start.timestamp()
+    for i in range(class_count):
+        bc = BudgetClass("Class %d" % i, BudgetClassType.EXPENSE,
+                         "Benchmark class %d" % i, keywords=["class%d" % i],
+                         history=[])
+        for j in range(transaction_count // class_count):
+            ts = datetime.fromtimestamp(start + rng.randint(0, 86400 * 25))
+            bc.add(Transaction(float(rng.randint(1, 10000)) / 100.0,
+                               vendor="vendor %d" % rng.randint(0, 200),
+                               description="transaction %d-%d" % (i, j),
+                               timestamp=ts))
+        budget.storage.save_class(budget.period.name, bc)
+
+# Invokes the given function the given number of times and returns the average
+# latency, in microseconds.
+def time_calls(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) * 1000000.0 / count
+
+
+# ================================ Benchmark ================================= #
+# Builds a budget of the given size in the given backend and returns a
+# dictionary of the average load, search, and insert latencies.
+def bench_backend(backend, size, class_count, count):
+    d, cpath = make_budget_dir(backend)
+    try:
+        # the budget is built in its period's first day, so every generated
+        # transaction lands within the period
+        dt = datetime.now()
+        conf = Config(cpath, dt=dt)
+        dt = conf.periods.period(dt).start
+        populate(Budget(conf, dt=dt), class_count, size)
+
+        # time how long a budget takes to load from storage (histories are
+        # parsed on first use), and how long a full load takes
+        load_us = time_calls(lambda i: Budget(conf, dt=dt), count)
+        full_us = time_calls(lambda i: Budget(conf, dt=dt).load_histories(), count)
+
+        # time searches, each on a freshly-loaded budget (so the search index
+        # is built from what was loaded)
+        budgets = [Budget(conf, dt=dt) for i in range(count)]
+        search_us = time_calls(lambda i: budgets[i].search_transaction("vendor %d" % i),
+                               count)
+
+        # time how long it takes to add (and save) a transaction
+        b = budgets[0]
+        classes = b.classes
+        insert_us = time_calls(lambda i: b.add_transaction(
+                                   classes[i % len(classes)],
+                                   Transaction(1.0, vendor="bench", description="insert %d" % i,
+                                               timestamp=dt)),
+                               count)
+        return {
+            "backend": backend,
+            "transactions": size,
+            "load_us": load_us,
+            "full_load_us": full_us,
+            "search_us": search_us,
+            "insert_us": insert_us
+        }
+    finally:
+        shutil.rmtree(d)
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark budget storage backends.")
+    p.add_argument("--backends", metavar="BACKEND", nargs="+",
+                   default=STORAGE_BACKENDS, choices=STORAGE_BACKENDS,
+                   help="Storage backends to benchmark.")
+    p.add_argument("--sizes", metavar="N", type=int, nargs="+",
+                   default=[1000, 10000],
+                   help="Total transaction counts to benchmark.")
+    p.add_argument("--classes", metavar="N", type=int, default=20,
+                   help="Number of budget classes to spread transactions across.")
+    p.add_argument("--count", metavar="N", type=int, default=20,
+                   help="Number of loads, searches, and inserts to time at each size.")
+    args = p.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for backend in args.backends:
+            results.append(bench_backend(backend, size, args.classes, args.count))
+            r = results[-1]
+            print("%8d transactions (%6s): load %.2fus, full load %.2fus, search %.2fus, "
+                  "insert %.2fus" % (size, backend, r["load_us"], r["full_load_us"],
+                                     r["search_us"], r["insert_us"]))
+    return results
+
+# Runner code
+if __name__ == "__main__":
+    main()
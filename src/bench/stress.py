@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# Stress test for concurrent writes to a budget. Builds a throwaway budget and
+# fires thousands of transaction creates at it from many threads at once, the
+# same way the server handles concurrent '/create/transaction' requests (each
+# one fetches the budget from a shared budget cache, looks up the class, and
+# adds the transaction). Other threads read the budget the whole time. Once
+# every thread finishes, the budget is reloaded from storage and checked to
+# make sure no transaction was lost.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+import time
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.budget import Budget
+from lib.bcache import BudgetCache
+from lib.bclass import BudgetClass, BudgetClassType
+from lib.transaction import Transaction
+from lib.storage import STORAGE_BACKENDS
+from lib.locks import lock_manager
+
+
+# ================================= Helpers ================================== #
+# Creates a temporary directory containing a config file (using the given
+# storage backend) and an empty save and backup location. Returns the
+# directory path and the config file path.
+def make_budget_dir(backend):
+    d = tempfile.mkdtemp(prefix="sb_stress_")
+    os.mkdir(os.path.join(d, "save"))
+    os.mkdir(os.path.join(d, "backup"))
+    jdata = {
+        "name": "Stress Budget",
+        "save_location": os.path.join(d, "save"),
+        "backup_location": os.path.join(d, "backup"),
+        "reset_dates": ["%d-1" % m for m in range(1, 13)],
+        "surplus_savings": [{"category": "Savings", "percent": 0.1}],
+        "storage": backend
+    }
+    cpath = os.path.join(d, "config.json")
+    fp = open(cpath, "w")
+    fp.write(json.dumps(jdata))
+    fp.close()
+    return d, cpath
+
+
+# ================================ Stress Test =============================== #
+# Takes in a storage backend, the number of writer and reader threads, the
+# number of creates each writer makes, and the number of classes to spread
+# them across. Returns a dictionary of results, including the number of
+# transactions that were lost.
+def stress(backend, writers, readers, creates, class_count):
+    d, cpath = make_budget_dir(backend)
+    try:
+        dt = datetime.now()
+        b = Budget(Config(cpath, dt=dt), dt=dt)
+        for i in range(class_count):
+            b.add_class(BudgetClass("Class %d" % i, BudgetClassType.EXPENSE,
+                                    "Stress class %d" % i, keywords=["class%d" % i],
+                                    history=[]))
+        bcids = [bc.bcid for bc in b.classes]
+        cache = BudgetCache(cpath)
+        created = {}                    # transaction ID --> class ID
+        created_lock = threading.Lock()
+        errors = []
+        done = threading.Event()
+
+        # each writer creates transactions in random classes, fetching the
+        # budget from the cache each time (like a server request would)
+        def write(idx):
+            rng = random.Random(idx)
+            try:
+                for i in range(creates):
+                    budget = cache.get(dt=dt)
+                    bcid = rng.choice(bcids)
+                    bc = budget.get_class(bcid).data
+                    t = Transaction(float(rng.randint(1, 10000)) / 100.0,
+                                    vendor="writer %d" % idx,
+                                    description="create %d-%d" % (idx, i),
+                                    timestamp=dt)
+                    result = budget.add_transaction(bc, t)
+                    assert result.success, result.message
+                    with created_lock:
+                        created[t.tid] = bcid
+            except Exception as e:
+                errors.append(e)
+
+        # each reader serializes the budget every few milliseconds
+        def read(idx):
+            try:
+                while not done.wait(0.005):
+                    json.dumps(cache.get(dt=dt).to_json())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+        rthreads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+        start = time.perf_counter()
+        for t in threads + rthreads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for t in rthreads:
+            t.join()
+
+        # reload the budget from storage and look for every transaction
+        fresh = Budget(Config(cpath, dt=dt), dt=dt)
+        lost = 0
+        for (tid, bcid) in created.items():
+            bc = fresh.get_class(bcid).data
+            if bc == None or bc.get(tid) == None:
+                lost += 1
+        stored = sum(len(bc.history) for bc in fresh.classes)
+        return {
+            "backend": backend,
+            "creates": writers * creates,
+            "created": len(created),
+            "stored": stored,
+            "lost": lost,
+            "errors": [str(e) for e in errors],
+            "creates_per_sec": len(created) / elapsed
+        }
+    finally:
+        shutil.rmtree(d)
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Stress test concurrent budget writes.")
+    p.add_argument("--backends", metavar="BACKEND", nargs="+",
+                   default=STORAGE_BACKENDS, choices=STORAGE_BACKENDS,
+                   help="Storage backends to test.")
+    p.add_argument("--writers", metavar="N", type=int, default=16,
+                   help="Number of writer threads.")
+    p.add_argument("--readers", metavar="N", type=int, default=4,
+                   help="Number of reader threads.")
+    p.add_argument("--creates", metavar="N", type=int, default=250,
+                   help="Number of transactions each writer creates.")
+    p.add_argument("--classes", metavar="N", type=int, default=4,
+                   help="Number of budget classes to spread transactions across.")
+    args = p.parse_args()
+
+    results = []
+    failed = False
+    for backend in args.backends:
+        r = stress(backend, args.writers, args.readers, args.creates, args.classes)
+        results.append(r)
+        print("%6s: %d creates, %d stored, %d lost, %d errors (%.1f creates/sec)" %
+              (backend, r["creates"], r["stored"], r["lost"], len(r["errors"]),
+               r["creates_per_sec"]))
+        for e in r["errors"][:5]:
+            print("    error: %s" % e)
+        if r["lost"] > 0 or len(r["errors"]) > 0 or r["stored"] != r["creates"]:
+            failed = True
+    print("locks: %s" % json.dumps(lock_manager.to_json()))
+    if failed:
+        sys.exit(1)
+    return results
+
+# Runner code
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+# Benchmark suite for lib/. Generates a synthetic budget (see generate.py) in
+# each storage backend, then times the budget operations the server and CLI
+# rely on: loading a budget (with and without its histories), searching for,
+# looking up, and adding transactions, and converting the budget to JSON and
+# to an Excel file.
+#
+# The results are written out as JSON (to stdout, or to a file), along with
+# the commit and parameters they were measured with. If a previous result file
+# is given as a baseline, any operation that got slower by more than the
+# threshold is reported as a regression (and the suite exits with an error).
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.budget import Budget
+from lib.transaction import Transaction
+from lib.storage import STORAGE_BACKENDS
+from lib.codec import CODEC_BACKEND
+from generate import make_config, generate
+
+
+# ================================= Helpers ================================== #
+# Invokes the given function the given number of times (passing in the index
+# of each call) and returns statistics about the latencies, in microseconds.
+def time_calls(func, count):
+    lats = []
+    for i in range(count):
+        start = time.perf_counter()
+        func(i)
+        lats.append((time.perf_counter() - start) * 1000000.0)
+    lats.sort()
+    return {
+        "count": count,
+        "mean_us": sum(lats) / count,
+        "p50_us": lats[count // 2],
+        "p95_us": lats[min(count - 1, int(count * 0.95))],
+        "min_us": lats[0],
+        "max_us": lats[-1]
+    }
+
+# Returns the commit the source tree is checked out at, or None if it can't be
+# found (for example, if git isn't installed).
+def get_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=dpath,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() if out.returncode == 0 else None
+    except Exception as e:
+        return None
+
+
+# ================================ Benchmarks ================================ #
+# Takes in a storage backend, the size of the budget to generate, the number
+# of times to invoke each operation, and a seed. Returns a dictionary mapping
+# each operation's name to its latency statistics.
+def bench_backend(backend, periods, classes, transactions, count, seed):
+    d = tempfile.mkdtemp(prefix="sb_suite_")
+    try:
+        cpath = make_config(d, backend=backend)
+        dt = datetime.now()
+        conf = Config(cpath, dt=dt)
+        generate(conf, periods, classes, transactions, seed=seed, dt=dt)
+        rng = random.Random(seed)
+        results = {}
+
+        # loading (the first load builds any manifests, so it isn't timed)
+        Budget(conf, dt=dt)
+        results["load"] = time_calls(lambda i: Budget(conf, dt=dt), count)
+        results["load_full"] = time_calls(lambda i: Budget(conf, dt=dt).load_histories(),
+                                          count)
+
+        # searching: the first search on a budget builds its search index
+        budgets = [Budget(conf, dt=dt) for i in range(count)]
+        results["search_transaction_cold"] = time_calls(
+            lambda i: budgets[i].search_transaction("purchase %d" % i), count)
+        b = budgets[0]
+        vendors = sorted(set(t.vendor for bc in b.classes for t in bc.history))
+        results["search_transaction"] = time_calls(
+            lambda i: b.search_transaction(rng.choice(vendors)), count)
+
+        # ID lookups
+        tids = [t.tid for bc in b.classes for t in bc.history]
+        b.transaction_setup()
+        results["get_transaction"] = time_calls(
+            lambda i: b.get_transaction(rng.choice(tids)), count)
+
+        # conversions
+        results["to_json"] = time_calls(lambda i: b.to_json(), count)
+        xpath = os.path.join(d, "budget.xlsx")
+        results["write_to_excel"] = time_calls(lambda i: b.write_to_excel(xpath), count)
+
+        # additions (last, since they change the budget)
+        results["add_transaction"] = time_calls(
+            lambda i: b.add_transaction(rng.choice(b.classes),
+                                        Transaction(1.0, vendor="Suite",
+                                                    description="suite add %d" % i,
+                                                    timestamp=dt)),
+            count)
+        return results
+    finally:
+        shutil.rmtree(d)
+
+# Takes in a new set of results, a baseline set of results, and a threshold
+# (a fraction, such as 0.1 for 10%). Returns a list of the operations whose
+# mean latency grew by more than the threshold.
+def compare(results, baseline, threshold):
+    regressions = []
+    for (backend, ops) in results["results"].items():
+        bops = baseline.get("results", {}).get(backend, {})
+        for (op, stats) in ops.items():
+            if op not in bops or bops[op]["mean_us"] <= 0:
+                continue
+            change = stats["mean_us"] / bops[op]["mean_us"] - 1.0
+            if change > threshold:
+                regressions.append({"backend": backend, "operation": op,
+                                    "baseline_us": bops[op]["mean_us"],
+                                    "mean_us": stats["mean_us"], "change": change})
+    return regressions
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Benchmark budget operations on a synthetic budget.")
+    p.add_argument("--backends", metavar="BACKEND", nargs="+",
+                   default=STORAGE_BACKENDS, choices=STORAGE_BACKENDS,
+                   help="Storage backends to benchmark.")
+    p.add_argument("--periods", metavar="N", type=int, default=3,
+                   help="Number of reset periods to generate.")
+    p.add_argument("--classes", metavar="M", type=int, default=10,
+                   help="Number of classes in each period.")
+    p.add_argument("--transactions", metavar="K", type=int, default=500,
+                   help="Number of transactions in each class.")
+    p.add_argument("--count", metavar="N", type=int, default=10,
+                   help="Number of times to invoke each operation.")
+    p.add_argument("--seed", metavar="N", type=int, default=0,
+                   help="Random seed.")
+    p.add_argument("--output", metavar="FILE", default=None,
+                   help="File to write the results to (instead of stdout).")
+    p.add_argument("--baseline", metavar="FILE", default=None,
+                   help="Previous results to check for regressions against.")
+    p.add_argument("--threshold", metavar="PERCENT", type=float, default=20.0,
+                   help="Slowdown (in percent) reported as a regression.")
+    args = p.parse_args()
+
+    results = {
+        "commit": get_commit(),
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "json_backend": CODEC_BACKEND,
+        "parameters": {
+            "periods": args.periods,
+            "classes": args.classes,
+            "transactions": args.transactions,
+            "count": args.count,
+            "seed": args.seed
+        },
+        "results": {}
+    }
+    for backend in args.backends:
+        results["results"][backend] = bench_backend(backend, args.periods, args.classes,
+                                                    args.transactions, args.count, args.seed)
+
+    # compare against the baseline, if one was given
+    if args.baseline != None:
+        fp = open(args.baseline, "r")
+        baseline = json.loads(fp.read())
+        fp.close()
+        results["baseline"] = baseline.get("commit", None)
+        results["regressions"] = compare(results, baseline, args.threshold / 100.0)
+
+    text = json.dumps(results, indent=4)
+    if args.output != None:
+        fp = open(args.output, "w")
+        fp.write(text + "\n")
+        fp.close()
+    else:
+        print(text)
+    if len(results.get("regressions", [])) > 0:
+        sys.exit(1)
+    return results
+
+# Runner code
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ import sys
 import os
 import argparse
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import shutil
 import signal
 
@@ -25,10 +25,14 @@ from lib.budget import Budget
 from lib.bclass import BudgetClass, BudgetClassType
 from lib.transaction import Transaction
 from lib.btarget import BudgetTarget, BudgetTargetType
+from lib.hstore import HistoryStore
+from lib.importer import import_read, import_rows
+from lib.profiling import Profile, PROFILE_MODES
 
 # Globals
 config = None
 budget = None
+search_limit = 25   # maximum number of search results to list
 
 # Pretty-printing globals
 STAB = "    "
@@ -174,7 +178,7 @@ def input_class_type(prompt="Class type:", blank_ok=False):
 def input_class(prompt="[SEARCH] Budget class:"):
     while True:
         text = input_wrapper(prompt, color=C_CYAN).strip()
-        result = budget.search_class(text)
+        result = budget.search_class(text, limit=search_limit)
         if not result.success:
             print("Failed: %s" % result.message)
             return None
@@ -199,7 +203,7 @@ def input_transaction(prompt="[SEARCH] Transaction:"):
         text = input_wrapper(prompt, color=C_CYAN)
         # now, invoke the Budget to search for a transaction loop back around if
         # nothing was found
-        result = budget.search_transaction(text)
+        result = budget.search_transaction(text, limit=search_limit)
         if not result.success:
             print("Failed: %s" % result.message)
             return None
@@ -264,6 +268,12 @@ def parse_args():
     p.add_argument("--backup", metavar="BACKUP_DIR",
                    help="Copies the current configuration file and all associated files to the specified location.",
                    default=None, nargs=1, type=str)
+    p.add_argument("--from", metavar="YYYY-MM-DD",
+                   help="Lists all transactions (across all reset periods) on or after this date.",
+                   default=None, nargs=1, type=str)
+    p.add_argument("--to", metavar="YYYY-MM-DD",
+                   help="Lists all transactions (across all reset periods) on or before this date.",
+                   default=None, nargs=1, type=str)
     p.add_argument("--to-excel", metavar="EXCEL_OUTPUT_PATH",
                    help="Converts the budget to an Excel spreadsheet and writes it out to disk.",
                    default=None, nargs=1, type=str)
@@ -274,6 +284,12 @@ def parse_args():
     p.add_argument("--add-transaction",
                    help="Add a new transaction.",
                    default=False, action="store_true")
+    p.add_argument("--import", metavar="CSV_OR_JSONL_PATH",
+                   help="Adds every transaction in a CSV or JSON Lines file (see lib/importer.py).",
+                   default=None, nargs=1, type=str)
+    p.add_argument("--strict",
+                   help="With '--import', imports nothing unless every row is valid.",
+                   default=False, action="store_true")
     # removal options
     p.add_argument("--delete-class",
                    help="Remove an existing budget class.",
@@ -288,26 +304,33 @@ def parse_args():
     p.add_argument("--edit-transaction",
                    help="Edit an existing transaction.",
                    default=False, action="store_true")
+    # profiling options
+    p.add_argument("--profile", metavar="DUMP_PATH",
+                   help="Profiles the command and dumps the profile to this file (or into this directory).",
+                   default=None, nargs=1, type=str)
+    p.add_argument("--profile-mode", metavar="MODE",
+                   help="With '--profile', profiles time spent (\"cpu\", the default) or memory allocated (\"memory\").",
+                   default="cpu", choices=PROFILE_MODES, type=str)
 
     return vars(p.parse_args())
 
-# Takes in a string from '--date' and attempts to parse it using the YYYY-MM-DD
-# date format.
-def parse_date(dstr):
+# Takes in a string from '--date' (or another date option) and attempts to
+# parse it using the YYYY-MM-DD date format.
+def parse_date(dstr, option="--date"):
     # attempt to parse as YYYY-MM-DD
     try:
         dt = datetime.strptime(dstr, "%Y-%m-%d")
         return dt
     except Exception as e:
-        fatality(msg="The --date option requires this format: YYYY-MM-DD",
+        fatality(msg="The %s option requires this format: YYYY-MM-DD" % option,
                  exception=e)
 
 
 # =========================== Listing/Summarizing ============================ #
 # Prints basic information about each budget class to the terminal.
 def summarize():
-    ictotal = 0.0
-    ectotal = 0.0
+    # compute all the numbers up front
+    summary = budget.summarize()
 
     # Helper function for printing a budget class
     def summarize_budget_class(c, prefix):
@@ -315,15 +338,14 @@ def summarize():
         color = C_GREEN if c.ctype == BudgetClassType.INCOME else C_YELLOW
         print("%s%s%s%s: %s" % (prefix, color, c.name, C_NONE, c.desc))
 
-        # compute some basic numbers for the class
-        stat_total = 0.0
+        # retrieve the class's numbers from the summary
+        cs = summary.get_class(c.bcid)
+        stat_total = cs.total
         transactions = c.all()
-        for t in transactions:
-            stat_total += t.price
         latest = None if len(transactions) == 0 else transactions[0]
             
         # with the class's target, put together a string to print
-        c_target_val = None if c.target == None else c.target.get_value(total_income=ictotal)
+        c_target_val = cs.target
         c_target_str = ""
         if c_target_val != None:
             # first, come up with an appropriate color depending on the total
@@ -349,9 +371,6 @@ def summarize():
         for i in range(llen):
             prefix3 = STAB_TREE2 if i < llen - 1 else STAB_TREE1
             print("%s%s%s" % (prefix2, prefix3, lines[i]))
-
-        # return the total value for this class
-        return stat_total 
     
     # ----------------------------- Runner Code ------------------------------ #
     # get all classes and separate them into expense and income
@@ -369,38 +388,38 @@ def summarize():
     print("%d Income Classes:" % iclen)
     for i in range(iclen):
         pfx = STAB_TREE2 if i < iclen - 1 else STAB_TREE1
-        ictotal += summarize_budget_class(iclasses[i], pfx)
+        summarize_budget_class(iclasses[i], pfx)
     
     # process all expense classes
     eclen = len(eclasses)
     print("%d Expense Classes:" % eclen)
     for i in range(eclen):
         pfx = STAB_TREE2 if i < eclen - 1 else STAB_TREE1
-        ectotal += summarize_budget_class(eclasses[i], pfx)
+        summarize_budget_class(eclasses[i], pfx)
             
-    # compute and print totals
-    net = ictotal - ectotal
+    # print totals
+    net = summary.surplus
     sys.stdout.write("\n")
-    print("Total income:    %s" % dollar_to_string(ictotal))
-    print("Total expenses:  %s" % dollar_to_string(ectotal))
+    print("Total income:    %s" % dollar_to_string(summary.income))
+    print("Total expenses:  %s" % dollar_to_string(summary.expenses))
     print("----")
     print("Net:             %s" % dollar_to_string(net))
 
     # print surplus savings
-    sslen = len(budget.savings)
+    sslen = len(summary.savings)
     print("\n%d Surplus Savings Categories" % sslen)
     for i in range(sslen):
         pfx = STAB_TREE2 if i < sslen - 1 else STAB_TREE1
+        [sc, save_amount] = summary.savings[i]
         # if we have a positive net value we can do some savings! So we'll print
         # an extra value that shows how much savings should go into each
         # surplus category
         extra = ""
         if net > 0.0:
-            save_amount = budget.savings[i].percent * net
             extra = " (%s%s%s)" % (C_GREEN, dollar_to_string(save_amount), C_NONE)
         # print the summary string
-        print("%s%s%s%s: %s%s" % (pfx, C_CYAN, budget.savings[i].name,
-                                C_NONE, percent_to_string(budget.savings[i].percent),
+        print("%s%s%s%s: %s%s" % (pfx, C_CYAN, sc.name,
+                                C_NONE, percent_to_string(sc.percent),
                                 extra))
 
 
@@ -436,6 +455,35 @@ def list_all():
     for i in range(alen):
         list_budget_class(allclasses[i])
 
+# Handles the '--from' and '--to' options. Lists every transaction in the range
+# (across all reset periods), most recent first, followed by each class's
+# total.
+def list_range(start, end):
+    hs = HistoryStore(config)
+    totals = {}         # class name --> [class type, total]
+    count = 0
+    for m in hs.iter_range(start=start, end=end):
+        t = m.transaction
+        c = m.bclass
+        color = C_GREEN if c.ctype == BudgetClassType.INCOME else C_YELLOW
+        recur_str = "(%sR%s) " % (C_CYAN, C_NONE) if t.recurring else ""
+        print("%s%s%s: %s%s" % (color, c.name, C_NONE, recur_str, t))
+        # add to the class's total
+        if c.name not in totals:
+            totals[c.name] = [c.ctype, 0.0]
+        totals[c.name][1] += t.price
+        count += 1
+
+    # print the totals for each class
+    print("\n%d transactions across %d classes" % (count, len(totals)))
+    names = sorted(totals.keys())
+    nlen = len(names)
+    for i in range(nlen):
+        pfx = STAB_TREE2 if i < nlen - 1 else STAB_TREE1
+        color = C_GREEN if totals[names[i]][0] == BudgetClassType.INCOME else C_YELLOW
+        print("%s%s%s%s: %s" % (pfx, color, names[i], C_NONE,
+                                dollar_to_string(totals[names[i]][1])))
+
 # Handles the '--json' option.
 def list_json():
     print(json.dumps(budget.to_json(), indent=4))
@@ -477,7 +525,15 @@ def add_transaction():
     # read the vendor, description, and budget class
     vendor = input_wrapper("Vendor:", blank_ok=True).strip()
     desc = input_wrapper("Description:", blank_ok=True).strip()
-    bclass = input_class()
+    bclass = None
+    result = budget.suggest_class(vendor, description=desc, limit=1)
+    if result.success:
+        s = result.data[0]
+        if input_boolean("Add to \"%s\"? (%s likely)" %
+                         (s.bclass.name, percent_to_string(s.probability))):
+            bclass = s.bclass
+    if bclass == None:
+        bclass = input_class()
     if bclass == None:
         print("Failed to find a budget class.")
         return
@@ -500,6 +556,23 @@ def add_transaction():
         return
     success("Transaction added.")
 
+# Handles '--import'.
+def import_transactions(fpath, strict=False):
+    # read every row out of the file
+    try:
+        rows = import_read(fpath)
+    except Exception as e:
+        fatality(msg="failed to read %s" % fpath, exception=e)
+
+    # import the rows, then print each row that failed
+    result = import_rows(budget, rows, strict=strict)
+    for r in result.data:
+        if not r["success"] and r["message"] != "":
+            print("Row %d: %s" % (r["row"] + 1, r["message"]))
+    if not result.success:
+        fatality(msg=result.message)
+    success(result.message)
+
 
 # ================================= Deletion ================================= #
 # Handles '--delete-class'.
@@ -719,6 +792,33 @@ def main():
     # parse the command-line arguments
     args = parse_args()
 
+    # if '--profile' was given, we'll run the command under a profile
+    if args.get("profile", None):
+        profile(args)
+    else:
+        run(args)
+
+# Takes in the parsed command-line arguments and runs the command under a
+# profile. Once it finishes (or exits), the profile is dumped to the path
+# given with '--profile', and its top entries are printed.
+def profile(args):
+    code = 0
+    prof = Profile(args["profile_mode"])
+    try:
+        with prof:
+            run(args)
+    except SystemExit as e:
+        code = e.code
+    sys.stderr.write("%s\n" % prof.to_text())
+    try:
+        fpath = prof.dump(args["profile"][0])
+        sys.stderr.write("Profile written to %s.\n" % fpath)
+    except Exception as e:
+        fatality(msg="failed to write the profile", exception=e)
+    sys.exit(code)
+
+# Takes in the parsed command-line arguments and does what they ask.
+def run(args):
     # if '--date' was given, we'll attempt to parse it and save a datetime
     # to represent what the user requested
     budget_datetime = datetime.now()
@@ -744,6 +844,18 @@ def main():
         list_json()
         exit()
 
+    # if '--from' and/or '--to' were given, we'll list the transactions in
+    # that range
+    if args.get("from", None) or args.get("to", None):
+        start = None
+        end = None
+        if args.get("from", None):
+            start = parse_date(args["from"][0], option="--from")
+        if args.get("to", None):
+            end = parse_date(args["to"][0], option="--to") + timedelta(days=1)
+        list_range(start, end)
+        exit()
+
     # if '--list' was given, we'll write out a full list
     if "list" in args and args["list"]:
         list_all()
@@ -769,6 +881,11 @@ def main():
         add_transaction()
         exit()
 
+    # if '--import' was given, we'll import the file's transactions, then exit
+    if args.get("import", None):
+        import_transactions(args["import"][0], strict=args["strict"])
+        exit()
+
     # if '--delete-class' was given, we'll try to remove, then exit
     if "delete_class" in args and args["delete_class"]:
         delete_class()
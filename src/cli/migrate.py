@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# This module implements a command-line tool that copies a budget's saved
+# classes (and their transactions) from one storage backend to another, for
+# both the save location and the backup location. After migrating, set the
+# config's 'storage' field to the new backend.
+#
+#   Connor Shugg
+
+# Imports
+import sys
+import os
+import argparse
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.storage import STORAGE_BACKENDS, make_storage
+
+
+# ================================ Migration ================================= #
+# Takes in a Config object, a source and destination backend, and whether or
+# not to migrate the backup location (rather than the save location). Copies
+# every class in every period from the source to the destination. Returns the
+# number of periods and classes copied.
+def migrate(conf, src_backend, dst_backend, backup=False):
+    src = make_storage(conf, backup=backup, backend=src_backend)
+    dst = make_storage(conf, backup=backup, backend=dst_backend)
+    period_count = 0
+    class_count = 0
+    for name in src.periods():
+        for bc in src.load(name):
+            dst.save_class(name, bc)
+            class_count += 1
+        period_count += 1
+    return [period_count, class_count]
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Copies a budget from one storage backend to another.")
+    p.add_argument("--config", metavar="CONFIG_JSON", required=True,
+                   help="Takes in the path to your snowbudget configuration file.",
+                   type=str)
+    p.add_argument("--from", metavar="BACKEND", required=True, dest="src",
+                   help="The storage backend to copy from (%s)." % ", ".join(STORAGE_BACKENDS),
+                   choices=STORAGE_BACKENDS, type=str)
+    p.add_argument("--to", metavar="BACKEND", required=True, dest="dst",
+                   help="The storage backend to copy to (%s)." % ", ".join(STORAGE_BACKENDS),
+                   choices=STORAGE_BACKENDS, type=str)
+    p.add_argument("--skip-backup",
+                   help="Only migrates the save location (not the backup location).",
+                   default=False, action="store_true")
+    args = p.parse_args()
+    if args.src == args.dst:
+        sys.stderr.write("The source and destination backends are the same.\n")
+        sys.exit(1)
+
+    conf = Config(args.config)
+    locations = [False] if args.skip_backup else [False, True]
+    for backup in locations:
+        (pcount, ccount) = migrate(conf, args.src, args.dst, backup=backup)
+        print("%s: copied %d classes across %d periods." %
+              (conf.backup_location if backup else conf.save_location, ccount, pcount))
+
+# Runner code
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+# This module implements a command-line tool that retrains the learned class
+# suggestion model (see lib/model.py) from a budget's entire history. The model
+# keeps itself up to date as transactions are added and removed, so this is
+# only needed to rebuild it (for example, after editing class files by hand).
+#
+#   Connor Shugg
+
+# Imports
+import sys
+import os
+import argparse
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.model import train_model
+
+
+# Main function.
+def main():
+    p = argparse.ArgumentParser(description="Retrains the class suggestion model from a budget's history.")
+    p.add_argument("--config", metavar="CONFIG_JSON", required=True,
+                   help="Takes in the path to your snowbudget configuration file.",
+                   type=str)
+    args = p.parse_args()
+
+    conf = Config(args.config)
+    m = train_model(conf)
+    print("%s: trained on %d transactions across %d classes (%d tokens)." %
+          (m.fpath, sum(m.docs.values()), len(m.docs), len(m.vocab)))
+
+# Runner code
+if __name__ == "__main__":
+    main()
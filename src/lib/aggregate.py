@@ -0,0 +1,107 @@
+# This module computes a budget's aggregate numbers: the total of each budget
+# class, income and expense totals, the surplus, each class's target value, and
+# how the surplus is split between the savings categories. Everything that
+# displays these numbers (the CLI, the Excel writer, and the server's summary
+# endpoint) gets them from here.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import math
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.bclass import BudgetClassType
+
+
+# ============================== Class Summary =============================== #
+# Simple class that holds the aggregate numbers for a single budget class.
+class ClassSummary:
+    # Constructor. Takes in the budget class, its total, and its number of
+    # transactions.
+    def __init__(self, bclass, total, count):
+        self.bclass = bclass
+        self.total = total
+        self.count = count
+        self.target = None      # computed target value (if the class has one)
+
+    # Returns a JSON representation of the class summary.
+    def to_json(self):
+        bc = self.bclass
+        latest = None
+        if self.count > 0:
+            latest = bc.all()[0].timestamp.timestamp()
+        return {
+            "id": bc.bcid,
+            "name": bc.name,
+            "type": "income" if bc.ctype == BudgetClassType.INCOME else "expense",
+            "total": self.total,
+            "count": self.count,
+            "latest": latest,
+            "target": self.target
+        }
+
+
+# ============================== Budget Summary ============================== #
+# Computes and holds the aggregate numbers for an entire budget.
+class BudgetSummary:
+    # Constructor. Takes in a Budget object and computes everything.
+    def __init__(self, budget):
+        self.classes = []           # ClassSummary objects, in the budget's order
+        self.income = 0.0           # total income
+        self.expenses = 0.0         # total expenses
+        self.savings = []           # [SavingsCategory, amount] pairs
+
+        # total up each class. Each history hands back a flat array of its
+        # prices, which is summed in one call (rather than looping through
+        # transaction objects)
+        for bc in budget.all():
+            total = math.fsum(bc.history.price_column())
+            cs = ClassSummary(bc, total, len(bc.history))
+            self.classes.append(cs)
+            if bc.ctype == BudgetClassType.INCOME:
+                self.income += total
+            else:
+                self.expenses += total
+        self.surplus = self.income - self.expenses
+
+        # with the income total known, compute each class's target
+        for cs in self.classes:
+            if cs.bclass.target != None:
+                cs.target = cs.bclass.target.get_value(total_income=self.income)
+
+        # split any surplus between the savings categories
+        for sc in budget.savings:
+            self.savings.append([sc, sc.percent * max(0.0, self.surplus)])
+
+    # Takes in a class ID and returns the matching ClassSummary, or None.
+    def get_class(self, bcid):
+        for cs in self.classes:
+            if cs.bclass.bcid == bcid:
+                return cs
+        return None
+
+    # Returns a JSON representation of the budget summary.
+    def to_json(self):
+        cdata = []
+        for cs in self.classes:
+            cdata.append(cs.to_json())
+        sdata = []
+        for entry in self.savings:
+            jdata = entry[0].to_json()
+            jdata["amount"] = entry[1]
+            sdata.append(jdata)
+        return {
+            "income": self.income,
+            "expenses": self.expenses,
+            "surplus": self.surplus,
+            "classes": cdata,
+            "savings": sdata
+        }
@@ -0,0 +1,167 @@
+# This module defines a process-resident cache of Budget objects. Building a
+# Budget means loading every class in a reset period from storage, so
+# long-lived processes (such as the server) keep one Budget per reset period in
+# memory and only rebuild it when something in storage changes.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import threading
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.config import Config
+from lib.budget import Budget
+from lib.storage import make_storage
+from lib.timing import timed
+
+
+# ============================ Budget Cache Entry ============================ #
+# Simple class used to hold a single cached Budget along with the information
+# needed to decide whether or not it's still valid.
+class BudgetCacheEntry:
+    # Constructor. Takes in the budget, the date its config was parsed for, and
+    # the signature of its period's storage at the time it was loaded.
+    def __init__(self, budget, date, signature):
+        self.budget = budget
+        self.date = date
+        self.signature = signature
+
+
+# =============================== Budget Cache =============================== #
+# Keeps one Budget object per reset period (keyed by the period's name) and
+# hands them out to callers. Every caller shares the same Budget, whose locks
+# serialize writes to it; when a cached budget writes to storage, the cache
+# refreshes the entry's signature rather than throwing the budget out. Entries
+# are only reloaded when storage changes underneath them (for example, when
+# another process writes to it).
+class BudgetCache:
+    # Constructor. Takes in the path to the budget's config file.
+    def __init__(self, config_fpath):
+        self.config_fpath = config_fpath
+        self.entries = {}                   # period name --> entry
+        self.configs = {}                   # date --> (config mtime, Config)
+        self.lock = threading.Lock()        # protects the entries and stats
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.refreshes = 0
+
+    # Computes a "signature" for the given period: the storage backend's
+    # signature of the period, plus the modification time of the config file.
+    # If any class in the period is added, removed, or rewritten (by this
+    # process or any other), the signature changes.
+    def signature(self, conf, name):
+        return (os.stat(self.config_fpath).st_mtime_ns,) + \
+               make_storage(conf).signature(name)
+
+    # Returns a parsed Config object for the given datetime. The config's
+    # reset dates depend on the day it's parsed for, so parsed configs are kept
+    # per-day and re-parsed whenever the config file is modified.
+    def get_config(self, dt):
+        mtime = os.stat(self.config_fpath).st_mtime_ns
+        entry = self.configs.get(dt.date(), None)
+        if entry != None and entry[0] == mtime:
+            return entry[1]
+        # parse the config, making sure the table doesn't grow without bound
+        with timed("config_parse"):
+            conf = Config(self.config_fpath, dt=dt)
+        if len(self.configs) >= 32:
+            self.configs = {}
+        self.configs[dt.date()] = (mtime, conf)
+        return conf
+
+    # Returns a Budget for the reset period the given datetime falls in. A
+    # cached Budget is returned if one exists and is still valid. Otherwise a
+    # fresh one is loaded from disk and cached. Storage is only read (and
+    # budgets only loaded) without the cache's lock held, so a miss doesn't
+    # hold up other callers, and the lock is never taken while a budget's
+    # period lock is held.
+    def get(self, dt=None):
+        dt = datetime.now() if dt == None else dt
+        with self.lock:
+            conf = self.get_config(dt)
+            name = conf.periods.period(dt).name
+            entry = self.entries.get(name, None)
+
+        # if an entry exists for the same period, was built for the same day
+        # (the config's reset dates are relative to the day), and its storage
+        # hasn't changed, we have a hit. (If the budget is in the middle of a
+        # write, storage is changing because of the budget itself, so it's
+        # still a hit. A write can start, and finish, while the signature is
+        # being computed, so 'writes' and the entry's signature are checked
+        # both before and afterwards; 'writes' stays above zero until the
+        # write's hook has updated the entry)
+        if entry != None and entry.date == dt.date():
+            budget = entry.budget
+            before = entry.signature
+            if budget.writes > 0 or self.signature(conf, name) in [before, entry.signature] or \
+               budget.writes > 0:
+                with self.lock:
+                    self.hits += 1
+                return budget
+
+        # otherwise, load a new budget and compute its signature *after*
+        # construction (loading may write classes on reset dates)
+        b = Budget(conf, dt=dt)
+        b.write_hooks.append(self.refresh)
+        signature = self.signature(conf, name)
+        with self.lock:
+            self.misses += 1
+            # if another caller replaced the entry while the budget was being
+            # loaded, its budget is used instead, so the period only ever has
+            # one budget in use
+            current = self.entries.get(name, None)
+            if current is not entry and current != None and current.date == dt.date():
+                return current.budget
+            self.entries[name] = BudgetCacheEntry(b, dt.date(), signature)
+            return b
+
+    # Invoked by a cached budget after it writes to storage. The budget
+    # already holds what it wrote, so rather than reloading it, its entry's
+    # signature is updated to match storage.
+    def refresh(self, budget):
+        with self.lock:
+            name = budget.period.name
+            entry = self.entries.get(name, None)
+            if entry == None or entry.budget is not budget:
+                return
+            entry.signature = self.signature(budget.conf, name)
+            self.refreshes += 1
+
+    # Throws out the cached entry for the given budget's reset period so the
+    # next 'get()' reloads it from storage. If no budget is given, every entry
+    # is dropped.
+    def invalidate(self, budget=None):
+        with self.lock:
+            if budget == None:
+                self.invalidations += len(self.entries)
+                self.entries = {}
+                return
+            name = budget.period.name
+            if name in self.entries:
+                self.entries.pop(name)
+                self.invalidations += 1
+
+    # --------------------------------- JSON --------------------------------- #
+    # Returns a JSON object containing the cache's statistics.
+    def to_json(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "refreshes": self.refreshes,
+                "hit_rate": 0.0 if lookups == 0 else float(self.hits) / lookups
+            }
@@ -6,8 +6,9 @@
 import os
 import sys
 import json
+import threading
 from enum import IntEnum
-from datetime import datetime
+from datetime import datetime, timedelta
 import hashlib
 
 # Enable import from the parent directory
@@ -19,6 +20,10 @@ if dpath not in sys.path:                           # add to path
 # Local imports
 from lib.transaction import Transaction
 from lib.btarget import BudgetTarget
+from lib.thistory import TransactionHistory
+from lib.ttable import TransactionTable
+from lib.fileio import get_writer
+from lib.codec import Schema, encode, decode
 
 
 # ================================ Type Enum ================================= #
@@ -36,8 +41,12 @@ class BudgetClass:
         self.ctype = ctype          # type of class (EXPENSE, INCOME, etc.)
         self.desc = desc            # description of this class
         self.keywords = keywords    # keywords to identify this class
-        self.history = history      # transaction history
+        self.hlock = None           # protects a deferred history load
+        self.history = history      # transaction history (sorted by timestamp)
+        if not isinstance(history, (TransactionHistory, TransactionTable)):
+            self.history = TransactionHistory(history)
         self.target = target        # target amount to save
+        self.journal_counts = {}    # file path --> number of journal entries
         # we'll generate a unique ID string for this budget class if one wasn't
         # passed into the function
         self.bcid = bcid
@@ -56,48 +65,153 @@ class BudgetClass:
         typestr = "INC" if self.ctype == BudgetClassType.INCOME else "EXP"
         return "%s (%s): %s" % (self.name, typestr, self.desc)
     
-    # Used to iterate across a class's transaction history.
+    # Used to iterate across a class's transaction history (most recent first).
     def __iter__(self):
-        for t in self.all():
-            yield t
+        return iter(self.all())
+
+    # ----------------------------- Lazy History ----------------------------- #
+    # The class's transaction history. If loading it was deferred (see
+    # 'defer()'), it's loaded on first access.
+    @property
+    def history(self):
+        if self.hloader != None:
+            self.history_load()
+        return self.hdata
+
+    # Replaces the class's transaction history.
+    @history.setter
+    def history(self, value):
+        self.hdata = value
+        self.hloader = None
+
+    # Takes in a function that loads and returns the class's history container
+    # (given the class) and defers loading the history until it's accessed.
+    # This lets a budget's classes be listed without parsing their histories.
+    def defer(self, loader):
+        self.hlock = threading.Lock()
+        self.hdata = None
+        self.hloader = loader
+
+    # Returns True if the class's history has been loaded.
+    def history_loaded(self):
+        return self.hloader == None
+
+    # Loads the class's history, if loading it was deferred. If several
+    # threads call this at once, only one of them loads it.
+    def history_load(self):
+        if self.hlock == None:
+            return
+        with self.hlock:
+            loader = self.hloader
+            if loader == None:
+                return
+            history = loader(self)
+            history.adopt(self)
+            self.hdata = history
+            self.hloader = None
 
     # --------------------------------- JSON --------------------------------- #
-    # Used to convert the class into a JSON object.
-    def to_json(self):
-        # iterate through the history and generate a list of JSON objects
-        hdata = []
-        for t in self.history:
-            hdata.append(t.to_json())
-
-        # generate the final JSON
-        jdata = {
-            "id": self.bcid,
-            "name": self.name,
-            "type": "income" if self.ctype == BudgetClassType.INCOME else "expense",
-            "description": self.desc,
-            "keywords": self.keywords,
-            "history": hdata,
-        }
+    # Names of the fields that can be selected when converting to JSON.
+    JSON_FIELDS = ["id", "name", "type", "description", "keywords", "history", "target"]
+
+    # Used to convert the class into a JSON object. Optionally takes in:
+    #   - A list of fields to include (see JSON_FIELDS). By default, all are
+    #     included. The "id" field is always included.
+    #   - A maximum number of transactions and/or a 'since' datetime. If either
+    #     is given, only the first page of the history is included (see
+    #     'page()'), along with a "cursor" field used to retrieve the next.
+    def to_json(self, fields=None, limit=None, since=None):
+        jdata = {"id": self.bcid}
+        want = lambda f: fields == None or f in fields
+        if want("name"):
+            jdata["name"] = self.name
+        if want("type"):
+            jdata["type"] = "income" if self.ctype == BudgetClassType.INCOME else "expense"
+        if want("description"):
+            jdata["description"] = self.desc
+        if want("keywords"):
+            jdata["keywords"] = self.keywords
+
+        # iterate through the history (most recent first) and generate a list
+        # of JSON objects. Writing them in this order means transactions with
+        # equal timestamps keep their relative order when loaded back in
+        if want("history"):
+            ts = self.all()
+            if limit != None or since != None:
+                [ts, jdata["cursor"]] = self.page(limit=limit, since=since)
+            hdata = []
+            for t in ts:
+                hdata.append(t.to_json())
+            jdata["history"] = hdata
 
         # add a 'target' if one exists
-        if self.target != None:
+        if want("target") and self.target != None:
             jdata["target"] = self.target.to_json()
         return jdata
     
-    # Used to create a BudgetClass object from raw JSON data.
+    # Generator that produces the same JSON as 'to_json()' as a series of
+    # strings, encoding one transaction at a time, so a large history can be
+    # written out without building the entire JSON object (or string) first.
+    # (The "history" field is produced last.)
+    def iter_json(self, fields=None, limit=None, since=None):
+        for chunk in BudgetClass.iter_json_parts(self.json_parts(fields=fields, limit=limit,
+                                                                 since=since)):
+            yield chunk
+
+    # Returns what 'iter_json()' encodes, as [JSON string of the class without
+    # its history, list of transactions (or None if the history isn't
+    # included), whether the history is paged, paging cursor]. The
+    # transactions are copied out of the history, so the class can be modified
+    # while they're being encoded; callers sharing the class with writers
+    # should hold the class's lock while calling this.
+    def json_parts(self, fields=None, limit=None, since=None):
+        mfields = BudgetClass.JSON_FIELDS if fields == None else fields
+        mfields = [f for f in mfields if f != "history"]
+        text = encode(self.to_json(fields=mfields))
+        if fields != None and "history" not in fields:
+            return [text, None, False, None]
+        if limit != None or since != None:
+            [ts, cursor] = self.page(limit=limit, since=since)
+            return [text, list(ts), True, cursor]
+        return [text, list(self.all()), False, None]
+
+    # Generator that takes in the parts returned by 'json_parts()' and produces
+    # the class's JSON from them, one transaction at a time.
     @staticmethod
-    def from_json(jdata):
-        # build a list of expected JSON fields and assert they exist
-        expected = [
-            ["id", str, "each class file must have a unique \"id\" string."],
-            ["name", str, "each class file must have a \"name\" string."],
-            ["type", str, "each class file must have a \"type\" string."],
-            ["description", str, "each class file must have a \"description\" string."],
-            ["keywords", list, "each class file must have \"keywords\" list."],
-            ["history", list, "each class file must have a \"history\" list."],
-        ]
-        for f in expected:
-            assert f[0] in jdata and type(jdata[f[0]]) == f[1], f[2]
+    def iter_json_parts(parts):
+        [text, ts, paged, cursor] = parts
+        if ts == None:
+            yield text
+            return
+
+        # open up the history array, then encode each transaction
+        yield text[:-1] + ", \"history\": ["
+        sep = ""
+        for t in ts:
+            yield sep + encode(t.to_json())
+            sep = ", "
+        yield "]"
+        if paged:
+            yield ", \"cursor\": %s" % json.dumps(cursor)
+        yield "}"
+
+    # The fields expected in a budget class's JSON.
+    JSON_SCHEMA = Schema([
+        ["id", str, "each class file must have a unique \"id\" string."],
+        ["name", str, "each class file must have a \"name\" string."],
+        ["type", str, "each class file must have a \"type\" string."],
+        ["description", str, "each class file must have a \"description\" string."],
+        ["keywords", list, "each class file must have \"keywords\" list."],
+        ["history", list, "each class file must have a \"history\" list."],
+    ])
+
+    # Used to create a BudgetClass object from raw JSON data. Optionally takes
+    # in the type of container to hold the class's history in (either
+    # TransactionHistory, the default, or the columnar TransactionTable).
+    @staticmethod
+    def from_json(jdata, history_type=TransactionHistory):
+        # make sure the expected JSON fields exist
+        BudgetClass.JSON_SCHEMA.check(jdata)
 
         # check the correct type
         typestr = jdata["type"].lower()
@@ -114,32 +228,170 @@ class BudgetClass:
         if "target" in jdata:
             c.target = BudgetTarget.from_json(jdata["target"])
         
-        # try to extract the list of history objects and add them to the new
-        # budget class object
-        for entry in jdata["history"]:
-            c.add(Transaction.from_json(entry))
+        # try to extract the list of history objects and build the new budget
+        # class object's history container out of them (all at once, so it's
+        # only sorted once)
+        decode_transaction = Transaction.from_json
+        c.history = history_type([decode_transaction(entry)
+                                  for entry in jdata["history"]])
+        c.history.adopt(c)
         return c
     
     # ------------------------------- File IO -------------------------------- #
-    # Writes this budget class out to disk as a JSON file.
-    def save(self, fpath):
+    # Writes this budget class out to disk as a JSON file, through the given
+    # FileWriter (see lib/fileio.py). The file is compact unless 'pretty' is
+    # set (see lib/codec.py). Since the file now holds the entire class, any
+    # journal sitting next to it is removed.
+    def save(self, fpath, writer=None, pretty=False):
+        writer = get_writer() if writer == None else writer
         # first, convert the object to JSON
         jdata = self.to_json()
-        # open the file, write it all out, then close
-        fp = open(fpath, "w")
-        fp.write(json.dumps(jdata, indent=4))
-        fp.close()
+        # write the file out (atomically), then throw away the journal now
+        # that the snapshot is up to date
+        with writer.lock(fpath):
+            writer.write(fpath, encode(jdata, pretty=pretty))
+            writer.remove(BudgetClass.journal_path(fpath))
+            self.journal_counts[fpath] = 0
 
     # Used to load a budget class JSON file from disk. Returns a new BudgetClass
-    # object on success. Throws some exception on failure.
+    # object on success. Throws some exception on failure. If a journal exists
+    # alongside the file, its entries are replayed on top of the class.
     @staticmethod
-    def load(fpath):
+    def load(fpath, history_type=TransactionHistory):
         # open, read entire content, try to convert to a dictionary, then close
         fp = open(fpath, "r")
-        jdata = json.loads(fp.read())
+        jdata = decode(fp.read())
         fp.close()
-        # invoke the 'from_json' function and return
-        return BudgetClass.from_json(jdata)
+        # invoke the 'from_json' function, replay the journal, and return
+        c = BudgetClass.from_json(jdata, history_type=history_type)
+        c.journal_replay(fpath)
+        return c
+
+    # ------------------------------- Journal -------------------------------- #
+    # Adding or removing a single transaction doesn't rewrite the entire class
+    # file. Instead, a one-line JSON entry is appended to a journal file (JSON
+    # Lines) next to the class file. Once the journal grows past this many
+    # entries it's compacted back into the class file.
+    JOURNAL_COMPACT_THRESHOLD = 256
+
+    # Takes in a class file path and returns the path to its journal. (The
+    # ".jsonl" extension keeps the journal from being loaded as a class file.)
+    @staticmethod
+    def journal_path(fpath):
+        return os.path.splitext(fpath)[0] + ".jsonl"
+
+    # Takes in a class file path, an operation string ("add" or "remove"), and
+    # a transaction, and records the operation in the class's journal. If no
+    # class file exists at the path yet, or the journal has grown too large,
+    # the entire class is saved instead (with 'pretty' passed along to
+    # 'save()'). Writes go through the given FileWriter.
+    def journal_append(self, fpath, op, transaction, writer=None, pretty=False):
+        writer = get_writer() if writer == None else writer
+        with writer.lock(fpath):
+            if not os.path.isfile(fpath):
+                self.save(fpath, writer=writer, pretty=pretty)
+                return
+
+            # build the entry: additions carry the full transaction, removals
+            # only need the transaction's ID
+            entry = {"op": op}
+            if op == "add":
+                entry["transaction"] = transaction.to_json()
+            else:
+                entry["id"] = transaction.tid
+
+            # append the entry to the journal (if a crash left a partial
+            # entry at its end, it's cut off first; otherwise the new entry
+            # would land on the same line and be skipped on replay)
+            jpath = BudgetClass.journal_path(fpath)
+            BudgetClass.journal_repair(jpath)
+            writer.append(jpath, encode(entry) + "\n")
+
+            # if we don't know how long the journal is (i.e. this object didn't
+            # load or save the file), count its lines. Then, compact if needed
+            if fpath not in self.journal_counts:
+                fp = open(jpath, "r")
+                self.journal_counts[fpath] = sum(1 for line in fp)
+                fp.close()
+            else:
+                self.journal_counts[fpath] += 1
+            if self.journal_counts[fpath] >= BudgetClass.JOURNAL_COMPACT_THRESHOLD:
+                self.journal_compact(fpath, writer=writer, pretty=pretty)
+
+    # Takes in a journal path and, if the journal doesn't end with a complete
+    # line, truncates it to the end of its last complete line. Reads only the
+    # end of the file.
+    @staticmethod
+    def journal_repair(jpath):
+        if not os.path.isfile(jpath):
+            return
+        fp = open(jpath, "rb+")
+        try:
+            size = fp.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            fp.seek(size - 1)
+            if fp.read(1) == b"\n":
+                return
+            # search backwards, a block at a time, for the last newline
+            end = size
+            while end > 0:
+                start = max(0, end - 4096)
+                fp.seek(start)
+                idx = fp.read(end - start).rfind(b"\n")
+                if idx >= 0:
+                    end = start + idx + 1
+                    break
+                end = start
+            fp.truncate(end)
+        finally:
+            fp.close()
+
+    # Takes in a class file path and compacts its journal into the class file.
+    # The class is rebuilt from the file and journal on disk rather than from
+    # this object, since another object for the same class (such as a budget
+    # reloaded while this one was still writing) may have appended entries
+    # this object never saw. Expects the file's write lock to be held.
+    def journal_compact(self, fpath, writer=None, pretty=False):
+        c = BudgetClass.load(fpath)
+        c.save(fpath, writer=writer, pretty=pretty)
+        self.journal_counts[fpath] = 0
+
+    # Takes in a class file path and replays its journal (if one exists) on top
+    # of this object's history. Replaying is idempotent: a crash between
+    # 'save()' writing the class file and removing the journal leaves entries
+    # behind that the class file already holds. So an "add" is skipped if the
+    # history already has as many copies of the transaction as the journal
+    # has added so far (identical transactions share an ID, so copies are
+    # counted rather than just checking for the ID).
+    def journal_replay(self, fpath):
+        jpath = BudgetClass.journal_path(fpath)
+        count = 0
+        added = {}                      # transaction ID --> net journal adds
+        if os.path.isfile(jpath):
+            fp = open(jpath, "r")
+            for line in fp:
+                # a crash mid-append can leave a partial final line behind;
+                # anything that doesn't parse (or is missing fields) is skipped
+                try:
+                    entry = decode(line)
+                    op = entry["op"]
+                    if op == "add":
+                        t = Transaction.from_json(entry["transaction"])
+                        added[t.tid] = added.get(t.tid, 0) + 1
+                        if self.history.count(t.tid) < added[t.tid]:
+                            self.add(t)
+                    elif op == "remove":
+                        tid = entry["id"]
+                        added[tid] = added.get(tid, 0) - 1
+                        t = self.history.get(tid)
+                        if t != None:
+                            self.remove(t)
+                except Exception as e:
+                    continue
+                count += 1
+            fp.close()
+        self.journal_counts[fpath] = count
 
     # Turns the category's name in to a Linux-friendly file name.
     def to_file_name(self):
@@ -164,19 +416,29 @@ class BudgetClass:
                 return True
         return False
 
+    # Takes in a transaction ID and returns the matching transaction within
+    # the class's history, or None if it isn't present.
+    def get(self, tid):
+        return self.history.get(tid)
+
     # Adds an 'transaction' object that represents a single transaction. Also
     # sets the transaction's 'owner' field to point at this class.
     def add(self, transaction):
         transaction.owner = self
-        self.history.append(transaction)
+        self.history.add(transaction)
     
-    # Removes the given transaction from the list. Returns True if the removal
-    # succeeded, False otherwise.
+    # Takes in a list of transactions and adds all of them at once (which is
+    # much faster than calling 'add()' for each one).
+    def extend(self, transactions):
+        for t in transactions:
+            t.owner = self
+        self.history.extend(transactions)
+    
+    # Removes the given transaction from the history. Returns True if the
+    # removal succeeded, False otherwise.
     def remove(self, transaction):
-        idx = self.history.index(transaction)
-        if idx < 0:
+        if not self.history.remove(transaction):
             return False
-        self.history.pop(idx)
         transaction.owner = None
         return True
     
@@ -190,15 +452,81 @@ class BudgetClass:
                 # adjust the transaction's date to the the current one
                 t.timestamp = datetime.now()
                 new_history.append(t)
-        # update the internal history array
-        self.history = new_history
+        # update the internal history (keeping the same type of container)
+        self.history = type(self.history)(new_history)
+        self.history.adopt(self)
 
     
-    # Returns a list of all the class's transactions in sorted order by
-    # timestamp (with the most recent transactions appearing first)
+    # Returns a view of all the class's transactions in sorted order by
+    # timestamp (with the most recent transactions appearing first). The
+    # history is kept sorted, so this doesn't sort or copy anything.
     def all(self):
-        return sorted(self.history, key=lambda t: t.timestamp, reverse=True)
+        return self.history.descending()
+
+    # Takes in a start and end datetime and returns a view of the class's
+    # transactions with timestamps in the range [start, end), most recent
+    # first.
+    def range(self, start=None, end=None):
+        return self.history.range(start=start, end=end, reverse=True)
     
+    # Returns one page of the class's history, most recent first. Takes in:
+    #   - A cursor string returned by a previous call, to continue from where
+    #     that page left off (or None to start at the most recent transaction)
+    #   - The maximum number of transactions to return (or None for no limit)
+    #   - A 'since' datetime; if given, only transactions with timestamps after
+    #     it are returned
+    # Returns [transactions, cursor], where 'cursor' is None if there are no
+    # more transactions to retrieve. Because the cursor records the last
+    # transaction's timestamp and ID (rather than a position), transactions
+    # added or removed between calls don't shift the pages.
+    def page(self, cursor=None, limit=None, since=None):
+        start = None
+        if since != None:
+            start = since + timedelta(microseconds=1)
+        end = None
+        if cursor != None:
+            [key, tid] = BudgetClass.cursor_parse(cursor)
+            end = datetime.fromtimestamp(key) + timedelta(microseconds=1)
+        view = self.history.range(start=start, end=end, reverse=True)
+        vlen = len(view)
+
+        # if a cursor was given, the view begins with the transactions sharing
+        # the cursor's timestamp; skip past the cursor's transaction. (If it's
+        # since been removed, all of them are skipped.)
+        idx = 0
+        if cursor != None:
+            ties = 0
+            while ties < vlen and view[ties].timestamp.timestamp() == key:
+                ties += 1
+            idx = ties
+            for i in range(ties):
+                if view[i].tid == tid:
+                    idx = i + 1
+                    break
+
+        # collect the page, and make a cursor if transactions remain
+        stop = vlen if limit == None else min(vlen, idx + limit)
+        result = []
+        for i in range(idx, stop):
+            result.append(view[i])
+        next_cursor = None
+        if stop < vlen and len(result) > 0:
+            next_cursor = BudgetClass.cursor_make(result[-1])
+        return [result, next_cursor]
+
+    # Creates a page cursor string for the given transaction.
+    @staticmethod
+    def cursor_make(transaction):
+        return "%r:%s" % (transaction.timestamp.timestamp(), transaction.tid)
+
+    # Parses a cursor string and returns [timestamp, transaction ID]. Throws
+    # an exception if the cursor is malformed.
+    @staticmethod
+    def cursor_parse(cursor):
+        pieces = cursor.split(":", 1)
+        assert len(pieces) == 2, "malformed history cursor: \"%s\"" % cursor
+        return [float(pieces[0]), pieces[1]]
+
     # Makes a shallow copy of the budget class with the same ID.
     def copy(self):
         return BudgetClass(self.name, self.ctype, self.desc,
@@ -14,6 +14,9 @@ dpath = os.path.dirname(dpath)                      # parent directory
 if dpath not in sys.path:                           # add to path
         sys.path.append(dpath)
 
+# Local imports
+from lib.codec import Schema
+
 
 # ======================== Budget Target Class Types ========================= #
 class BudgetTargetType(Enum):
@@ -50,25 +53,26 @@ class BudgetTarget:
         tstr = "dollar" if self.ttype == BudgetTargetType.DOLLAR else "percent_income"
         return {"value": self.value, "type": tstr}
     
+    # The fields expected in a budget target's JSON, and the target type each
+    # "type" string maps to.
+    JSON_SCHEMA = Schema([
+        ["value", [int, float], "each budget target JSON must have a \"value\" float"],
+        ["type", str, "each budget target JSON must have a \"type\" string"]
+    ])
+    JSON_TYPES = {
+        "dollar": BudgetTargetType.DOLLAR,
+        "percent_income": BudgetTargetType.PERCENT_INCOME
+    }
+
     # Used to parse a given JSON object and return an initialized BudgetTarget.
     @staticmethod
     def from_json(jdata):
-        # check for the expected fields
-        expected = [
-            ["value", [int, float], "each budget target JSON must have a \"value\" float"],
-            ["type", [str], "each budget target JSON must have a \"type\" string"]
-        ]
-        for e in expected:
-            assert e[0] in jdata and type(jdata[e[0]]) in e[1], e[2]
-
-        # check for the correct type string
-        tstr = jdata["type"].lower()
-        expected_type = ["dollar", "percent_income"]
-        assert tstr in expected_type, \
-               "each budget target JSON's \"type\" must be one of: %s" % expected_type
-        tt = BudgetTargetType.DOLLAR
-        if tstr == "percent_income":
-            tt = BudgetTargetType.PERCENT_INCOME
+        # check for the expected fields and the correct type string
+        BudgetTarget.JSON_SCHEMA.check(jdata)
+        tt = BudgetTarget.JSON_TYPES.get(jdata["type"].lower(), None)
+        assert tt != None, \
+               "each budget target JSON's \"type\" must be one of: %s" % \
+               list(BudgetTarget.JSON_TYPES.keys())
 
         # invoke the constructor and return the object
         return BudgetTarget(float(jdata["value"]), ttype=tt)
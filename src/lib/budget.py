@@ -8,6 +8,9 @@ import os
 import sys
 from datetime import datetime
 import shutil
+import threading
+import time
+from contextlib import contextmanager
 from openpyxl import Workbook
 from openpyxl.styles import Font
 from openpyxl.chart import LineChart, Reference, Series
@@ -21,6 +24,15 @@ if dpath not in sys.path:                           # add to path
 # Local imports
 from lib.bclass import BudgetClass, BudgetClassType
 from lib.transaction import Transaction
+from lib.search import SearchIndex
+from lib.classify import Classifier
+from lib.model import get_model, ModelSuggestion
+from lib.aggregate import BudgetSummary
+from lib.thistory import TransactionHistory
+from lib.ttable import TransactionTable
+from lib.storage import make_storage, parallel_map
+from lib.locks import lock_manager
+from lib.timing import timing_report
 
 # Simple class used to represent a return value from these 
 class BudgetResult:
@@ -30,17 +42,64 @@ class BudgetResult:
         self.message = msg
         self.data = data
 
+# Context manager wrapped around one of the lock manager's locks (see
+# 'Budget.period_lock()' and 'Budget.class_lock()'). It counts how many of the
+# budget's locks the current thread holds; once the last one is released, the
+# hooks of any writes made while they were held are run.
+class BudgetLock:
+    # Constructor. Takes in the budget and the lock manager's lock.
+    def __init__(self, budget, lock):
+        self.budget = budget
+        self.lock = lock
+
+    # Acquires the lock.
+    def __enter__(self):
+        self.lock.__enter__()
+        local = self.budget.local
+        local.held = getattr(local, "held", 0) + 1
+        return self
+
+    # Releases the lock, then runs any pending write hooks if it was the last
+    # of the budget's locks this thread held.
+    def __exit__(self, exc_type, exc_value, traceback):
+        local = self.budget.local
+        local.held -= 1
+        self.lock.__exit__(exc_type, exc_value, traceback)
+        if local.held == 0:
+            self.budget.writes_finish()
+        return False
+
 # Budget class
 class Budget:
+    # The learned model's suggestion is only used to pick a class on its own
+    # (see 'classify_transaction()') if it's at least this likely.
+    SUGGEST_MIN_PROBABILITY = 0.6
+
     # Takes in the Config object that was parsed prior to this object's
     # creation. Takes in an optional datetime used to retrieve a specific
     # reset period's budget classes.
     def __init__(self, conf, dt=datetime.now()):
+        load_start = time.perf_counter()
         self.conf = conf
         self.classes = []
+        self.class_index = {}           # class ID --> BudgetClass
+        self.transaction_index = None   # transaction ID --> owning BudgetClass
+        self.class_search = None        # text search index for classes
+        self.transaction_search = None  # text search index for transactions
+        self.classifier = None          # keyword classifier for classes
+        self.index_lock = threading.RLock() # protects the indexes above
         self.savings = conf.surplus_savings
         self.reset_dates = conf.reset_dates
         self.datetime = dt
+        self.writes = 0                 # number of writes in progress
+        self.writes_lock = threading.Lock()
+        self.write_hooks = []           # functions invoked after each write
+        self.local = threading.local()  # per-thread locks held and writes pending
+        self.timings = {}               # load phase --> milliseconds taken
+        # pick the container type used to hold class histories
+        self.history_type = TransactionHistory
+        if conf.history_store == "columnar":
+            self.history_type = TransactionTable
 
         # before we load the classes, we need to know if today is a reset date
         # for the budget. If it is, and the given datetime matches today,
@@ -53,8 +112,12 @@ class Budget:
                           now.month == self.datetime.month and \
                           now.day == self.datetime.day)
 
-        # get the current save root path based on the current reset date
-        sroot = self.save_root_path(dt=self.datetime)
+        # find the storage this budget saves to (and backs up to), and the
+        # reset period being loaded
+        self.storage = make_storage(conf)
+        self.backup_storage = make_storage(conf, backup=True)
+        self.period = conf.periods.period(self.datetime)
+        name = self.period.name
 
         try:
             # if today is a reset day, we'll back up the config file itself to the
@@ -66,71 +129,71 @@ class Budget:
             # if we fail to setup the backup location, don't panic
             pass
 
-        # pass through today's save location and load any existing budget
-        # classes, while also keeping a count of the number we load in
-        current_class_count = 0
-        for root, dirs, files in os.walk(sroot):
-            for f in files:
-                if f.lower().endswith(".json") and "config" not in f.lower():
-                    bc = BudgetClass.load(os.path.join(root, f))
+        # load the period's classes while holding its lock, so classes can't
+        # be added to or removed from the period (or copied into it by another
+        # budget) halfway through
+        with self.period_lock():
+            # load any existing budget classes from this period's storage. Only
+            # the classes' fields are read now; each class's history is parsed
+            # the first time it's needed
+            start = time.perf_counter()
+            self.classes = self.storage.manifest(name, history_type=self.history_type)
+            self.timing("manifest", time.perf_counter() - start)
+
+            # if no classes were loaded, *and* this is some date in the future,
+            # there's a good chance this is the first time we've actually
+            # created/loaded this time period's class. So, we'll reference the
+            # *current* period's budget and copy any classes over
+            date_is_in_future = self.datetime.timestamp() >= nrd.timestamp()
+            if len(self.classes) == 0 and date_is_in_future:
+                current_name = conf.periods.period(now).name
+                for bc in self.storage.load(current_name, history_type=self.history_type):
+                    bc.reset()
+                    self.storage.save_class(name, bc)
                     self.classes.append(bc)
-                    current_class_count += 1
-
-        # if no classes were loaded, *and* this is some date in the future,
-        # there's a good chance this is the first time we've actually
-        # created/loaded this time period's class. So, we'll reference the
-        # *current* period's budget and copy any classes over
-        date_is_in_future = self.datetime.timestamp() >= nrd.timestamp()
-        if current_class_count == 0 and date_is_in_future:
-            # get the path to the current reset date's files, then walk
-            # through the directory to load each class file
-            current_sroot = self.save_root_path(dt=now)
-            for root, dirs, files in os.walk(current_sroot):
-                for f in files:
-                    if f.lower().endswith(".json") and "config" not in f.lower():
-                        bc = BudgetClass.load(os.path.join(root, f))
-                        bc.reset()
-                        bc.save(os.path.join(sroot, f))
-                        self.classes.append(bc)
-
-        # now, if today is a reset day, we'll walk through yesterday's
-        # directory and load in any classes that should be carried over
-        if today_is_reset:
-            yesterday = datetime.fromtimestamp(now.timestamp() - 86400)
-            for root, dirs, files in os.walk(self.save_root_path(dt=yesterday)):
-                for f in files:
-                    # if the file has the JSON extension, we'll try to load it as a
-                    # budget class object
-                    if f.lower().endswith(".json") and "config" not in f.lower():
-                        # load the budget class, and skip it if a copy already
-                        # exists in today's save location
-                        bc = BudgetClass.load(os.path.join(root, f))
-                        already_exists = False
-                        for c in self.classes:
-                            # if a match is found, we'll skip this one
-                            if bc.bcid.lower() == c.bcid.lower():
-                                already_exists = True
-                                break
-                        if already_exists:
-                            continue
-
-                        # otherwise, if the class doesn't already exist in the
-                        # new save location, we'll reset the class and write it
-                        # out to disk
-                        bc.reset()
-                        bc.save(os.path.join(sroot, f))
-                        self.classes.append(bc)
-
-            try:
-                # attempt to initialize the backup location, and save all budget classes
-                # to the backup location if they don't exist
-                for bc in self.classes:
-                    fpath = self.backup_class_path(bc)
-                    if not os.path.isfile(fpath):
-                        bc.save(self.backup_class_path(bc))
-            except Exception as e:
-                # if we fail to set up the backup location, don't panic
-                pass
+
+            # now, if today is a reset day, we'll look through yesterday's period
+            # and load in any classes that should be carried over
+            if today_is_reset:
+                yesterday = datetime.fromtimestamp(now.timestamp() - 86400)
+                yesterday_name = conf.periods.period(yesterday).name
+                for bc in self.storage.load(yesterday_name, history_type=self.history_type):
+                    # skip the class if a copy already exists in today's period
+                    already_exists = False
+                    for c in self.classes:
+                        # if a match is found, we'll skip this one
+                        if bc.bcid.lower() == c.bcid.lower():
+                            already_exists = True
+                            break
+                    if already_exists:
+                        continue
+
+                    # otherwise, if the class doesn't already exist in the new
+                    # period, we'll reset the class and write it out
+                    bc.reset()
+                    self.storage.save_class(name, bc)
+                    self.classes.append(bc)
+
+                try:
+                    # attempt to save all budget classes to the backup location if
+                    # they don't exist there
+                    for bc in self.classes:
+                        if not self.backup_storage.has_class(name, bc):
+                            self.backup_storage.save_class(name, bc)
+                except Exception as e:
+                    # if we fail to set up the backup location, don't panic
+                    pass
+
+            # remember what storage looked like when the budget was loaded
+            self.signature = self.storage.signature(name)
+
+        # with all classes loaded, build the class lookup table (the
+        # transaction lookup table is built on first use)
+        start = time.perf_counter()
+        for bc in self.classes:
+            self.index_class(bc)
+        self.timing("index", time.perf_counter() - start)
+        self.timing("load", time.perf_counter() - load_start)
     
     # Used to iterate through the budget's classes.
     def __iter__(self):
@@ -141,75 +204,148 @@ class Budget:
     # Takes in a BudgetClass object and adds it to the budget. Upon calling this
     # function, the budget is written out to a file.
     def add_class(self, bclass):
-        # before appending to the array, make sure there are no name conflicts
-        for bc in self.classes:
-            assert bclass.name.lower() != bc.name.lower(), \
-                   "duplicate budget class name detected"
-        self.classes.append(bclass)
-
-        # write out to a file
-        sroot = self.save_root_path(self.datetime)
-        fpath = os.path.join(sroot, bclass.to_file_name())
-        bclass.save(fpath)
-        # attempt to back up
-        try:
-            bclass.save(self.backup_class_path(bclass))
-        except Exception as e:
-            m = "Failed to backup class: %s" % e
-            return BudgetResult(success=True, msg=m)
-        return BudgetResult(success=True)
+        with self.period_lock(), self.class_lock(bclass.bcid):
+            self.sync()
+            # before appending to the array, make sure there are no name conflicts
+            for bc in self.classes:
+                assert bclass.name.lower() != bc.name.lower(), \
+                       "duplicate budget class name detected"
+            # make sure the class's history uses this budget's container type
+            if not isinstance(bclass.history, self.history_type):
+                bclass.history = self.history_type(bclass.history)
+            self.classes.append(bclass)
+            self.index_class(bclass)
+
+            # write out to storage, and make the write (and its backup)
+            # durable in one batch
+            with self.writing():
+                self.storage.save_class(self.period.name, bclass)
+                # attempt to back up
+                try:
+                    self.backup_storage.save_class(self.period.name, bclass)
+                except Exception as e:
+                    m = "Failed to backup class: %s" % e
+                    return BudgetResult(success=True, msg=m)
+                return BudgetResult(success=True)
     
     # Takes in a transaction and a budget class and adds it to the budget class,
     # then saves the budget class out to disk.
     def add_transaction(self, bclass, transaction):
-        # if the datetime of the transaction lands in a separate reset date,
+        # if the datetime of the transaction lands in a separate reset period,
         # forbid the operation
-        sroot = self.save_root_path(dt=transaction.timestamp)
-        fpath = os.path.join(sroot, bclass.to_file_name())
-        if (sroot != self.save_root_path(self.datetime)): # if transaction path != the current path
+        periods = self.conf.periods
+        if periods.period(transaction.timestamp) is not periods.period(self.datetime):
             m = "Cannot add a transaction from a different reset date."
             return BudgetResult(success=False, msg=m)
 
-        # add the transaction and save the budget class
-        bclass.add(transaction)
-        bclass.save(fpath)
-
-        # attempt to back up the class we just saved
-        try:
-            bclass.save(self.backup_class_path(bclass, dt=transaction.timestamp))
-        except Exception as e:
-            m = "Failed to backup class: %s" % e
-            return BudgetResult(success=True, msg=m)
-        return BudgetResult(success=True)
-
+        with self.class_lock(bclass.bcid):
+            # make sure the class wasn't deleted while we waited for the lock
+            # (if it was reloaded from storage, the reloaded copy is used)
+            self.sync()
+            bclass = self.class_index.get(bclass.bcid, None)
+            if bclass == None:
+                return BudgetResult(success=False, msg="The class no longer exists.")
+
+            # add the transaction and record it in storage (in one batch with
+            # the backup)
+            bclass.add(transaction)
+            with self.index_lock:
+                if self.transaction_index != None:
+                    self.transaction_index[transaction.tid] = bclass
+                self.search_index_transaction(transaction)
+            with self.writing():
+                self.storage.append(self.period.name, bclass, "add", transaction)
+                self.learn([[bclass.bcid, transaction]])
+
+                # attempt to back up the class we just saved
+                try:
+                    self.backup_storage.append(self.period.name, bclass, "add", transaction)
+                except Exception as e:
+                    m = "Failed to backup class: %s" % e
+                    return BudgetResult(success=True, msg=m)
+                return BudgetResult(success=True)
+
+
+    # Takes in a list of [budget class, transaction] pairs and adds each
+    # transaction to its class. Unlike 'add_transaction()', each affected class
+    # is written to storage exactly once (as a whole), no matter how many
+    # transactions it receives, so thousands of transactions can be added at
+    # once. Nothing is added if any transaction is from a different reset
+    # period or belongs to a class that no longer exists.
+    def add_transactions(self, pairs):
+        periods = self.conf.periods
+        period = periods.period(self.datetime)
+        groups = {}                     # class ID --> list of transactions
+        for (bclass, t) in pairs:
+            if periods.period(t.timestamp) is not period:
+                m = "Cannot add a transaction from a different reset date."
+                return BudgetResult(success=False, msg=m)
+            groups.setdefault(bclass.bcid, []).append(t)
+
+        # the period lock keeps classes from being added or removed while the
+        # transactions are added
+        with self.period_lock():
+            self.sync()
+            for bcid in groups:
+                if bcid not in self.class_index:
+                    return BudgetResult(success=False, msg="The class no longer exists.")
+
+            # add each class's transactions and write it out (in one batch
+            # with every other class and the backups). The transaction search
+            # index is dropped rather than updated one row at a time; it's
+            # rebuilt on the next search
+            with self.index_lock:
+                self.transaction_search = None
+            m = ""
+            with self.writing():
+                self.learn([[bclass.bcid, t] for (bclass, t) in pairs])
+                for (bcid, ts) in groups.items():
+                    with self.class_lock(bcid):
+                        bclass = self.class_index[bcid]
+                        bclass.extend(ts)
+                        with self.index_lock:
+                            if self.transaction_index != None:
+                                for t in ts:
+                                    self.transaction_index[t.tid] = bclass
+                        self.storage.save_class(self.period.name, bclass)
+
+                        # attempt to back up the class we just saved
+                        try:
+                            self.backup_storage.save_class(self.period.name, bclass)
+                        except Exception as e:
+                            m = "Failed to backup class: %s" % e
+            return BudgetResult(success=True, msg=m, data=len(pairs))
 
     # ------------------------------ Searching ------------------------------- #
-    # Expects a class ID string and searches the class list for it. Returns the
-    # first matching budget class, or None if nothing was found.
+    # Expects a class ID string and looks it up in the class index. Returns the
+    # matching budget class, or None if nothing was found.
     def get_class(self, class_id):
-        for bc in self.classes:
-            if bc.match_id(class_id):
-                return BudgetResult(success=True, data=bc)
+        with self.index_lock:
+            bc = self.class_index.get(class_id, None)
+        if bc != None:
+            return BudgetResult(success=True, data=bc)
         return BudgetResult(success=False, msg="Couldn't find a match")
     
-    # Expects a transaction ID string and searches all classes for it. Returns
+    # Expects a transaction ID string and looks it up in the transaction index
+    # to find its owner, then retrieves it from the owner's history. Returns
     # the transaction object if one is found, or None if nothing is found.
     def get_transaction(self, transaction_id):
-        for bc in self.classes:
-            for t in bc:
-                if t.match_id(transaction_id):
-                    return BudgetResult(success=True, data=t)
+        self.transaction_setup()
+        with self.index_lock:
+            bc = self.transaction_index.get(transaction_id, None)
+            t = None if bc == None else bc.get(transaction_id)
+        if t != None:
+            return BudgetResult(success=True, data=t)
         return BudgetResult(success=False, msg="Couldn't find a match")
 
-    # Takes in text and searches the expense classes for a matching one.
-    # Returns a list of matching BudgetClass objects.
-    def search_class(self, text):
-        result = []
-        # search through all budget classes (sorted)
-        for c in self.all():
-            # if the class matches the text in one way or another, add it
-            if c.match(text):
-                result.append(c)
+    # Takes in text and searches the expense classes for a matching one (a
+    # class matches if the text appears within one of its keywords). Returns
+    # a list of matching BudgetClass objects, best matches first. If 'limit'
+    # is given, at most that many classes are returned.
+    def search_class(self, text, limit=None):
+        with self.index_lock:
+            self.search_setup(transactions=False)
+            result = self.class_search.search(text, limit=limit)
         # build a return object
         succ = len(result) > 0
         m = "" if succ else "Couldn't find any matches"
@@ -217,148 +353,429 @@ class Budget:
     
     # Used to search for a transaction given some sort of information about it.
     # Returns a list of transaction objects that matched the text in one way
-    # or another. Returns an empty list if no match is found.
-    def search_transaction(self, text):
-        result = []
-        # search through all budget classes (sorted)
-        for bc in self.all():
-            # search through each transaction in sorted order (most recent
-            # will be checked first)
-            for t in bc.all():
-                if t.match(text):
-                    result.append(t)
+    # or another, best matches first (and most recent first among equally-good
+    # matches). Returns an empty list if no match is found. If 'limit' is given,
+    # at most that many transactions are returned.
+    def search_transaction(self, text, limit=None):
+        # the index is built before taking the lock. A bulk add or reload may
+        # drop it again before the lock is acquired, in which case it's rebuilt
+        result = None
+        while result == None:
+            self.search_setup()
+            with self.index_lock:
+                if self.transaction_search != None:
+                    result = self.transaction_search.search(text, limit=limit)
         # build a return object
         succ = len(result) > 0
         m = "" if succ else "Couldn't find any matches"
         return BudgetResult(success=succ, msg=m, data=result)
+
+    # Takes in a transaction's text (a string, or a list of strings such as its
+    # vendor and description) and picks the classes whose keywords appear
+    # within it (see lib/classify.py). Returns a list of ClassifierMatch
+    # objects, best first. If 'limit' is given, at most that many are returned.
+    def classify(self, text, limit=None):
+        with self.index_lock:
+            self.classify_setup()
+            result = self.classifier.classify(text, limit=limit)
+        succ = len(result) > 0
+        m = "" if succ else "Couldn't find any matches"
+        return BudgetResult(success=succ, msg=m, data=result)
+
+    # Takes in a list of transaction texts and classifies each one. Returns a
+    # list holding the best ClassifierMatch for each (or None).
+    def classify_many(self, texts):
+        with self.index_lock:
+            self.classify_setup()
+            return BudgetResult(success=True, data=self.classifier.classify_many(texts))
+
+    # Takes in a class query (which may be empty) and a transaction's vendor
+    # and description, and picks a class for the transaction. A query is
+    # tried first: the best class whose keywords appear in it or, failing
+    # that, the class search's best match for it (which finds classes with a
+    # keyword that contains the query). Then the best class whose keywords
+    # appear in the vendor and description is used and, if nothing matches,
+    # the learned model's suggestion if it's confident enough. Returns the
+    # BudgetClass.
+    def classify_transaction(self, query, vendor="", description=""):
+        if query != "":
+            result = self.classify(query, limit=1)
+            if result.success:
+                return BudgetResult(success=True, data=result.data[0].bclass)
+            result = self.search_class(query, limit=1)
+            if result.success:
+                return BudgetResult(success=True, data=result.data[0])
+        result = self.classify([vendor, description], limit=1)
+        if result.success:
+            return BudgetResult(success=True, data=result.data[0].bclass)
+        result = self.suggest_class(vendor, description, limit=1)
+        if result.success and result.data[0].probability >= Budget.SUGGEST_MIN_PROBABILITY:
+            return BudgetResult(success=True, data=result.data[0].bclass)
+        return BudgetResult(success=False, msg="Couldn't find a matching class")
+
+    # Takes in a transaction's vendor and description and asks the learned
+    # model (see lib/model.py) which of the budget's classes the transaction
+    # belongs in. Returns a list of ModelSuggestion objects, most likely first.
+    # If 'limit' is given, at most that many are returned.
+    def suggest_class(self, vendor, description="", limit=None):
+        if not self.conf.suggest_model:
+            return BudgetResult(success=False, msg="Class suggestions are disabled")
+        scores = get_model(self.conf).score(vendor, description,
+                                            [bc.bcid for bc in self.classes])
+        result = [ModelSuggestion(self.class_index[bcid], p) for (bcid, p) in scores
+                  if bcid in self.class_index]
+        result = result if limit == None else result[:limit]
+        succ = len(result) > 0
+        m = "" if succ else "Couldn't find any matches"
+        return BudgetResult(success=succ, msg=m, data=result)
+
+    # Takes in a list of [class ID, transaction] pairs that were just added to
+    # (or, if 'remove' is set, removed from) the budget and updates the learned
+    # model. The model only makes suggestions, so failing to update it never
+    # fails the write (the failure is reported on stderr). This is called
+    # while the write's locks are held, so a model that hasn't been trained
+    # yet isn't trained here; it'll learn the transactions from storage when
+    # it is.
+    def learn(self, pairs, remove=False):
+        if not self.conf.suggest_model:
+            return
+        try:
+            m = get_model(self.conf, train=False)
+            if m != None:
+                m.train(pairs, remove=remove)
+        except Exception as e:
+            sys.stderr.write("Failed to update the class suggestion model: %s\n" % e)
+
+    # Builds the keyword classifier, if it hasn't been built yet. Afterwards,
+    # it's kept up to date as classes are added, removed, and edited.
+    def classify_setup(self):
+        if self.classifier != None:
+            return
+        with self.index_lock:
+            if self.classifier != None:
+                return
+            classifier = Classifier()
+            for bc in self.classes:
+                classifier.add(bc)
+            self.classifier = classifier
+
+    # Builds the class search index and (unless 'transactions' is False) the
+    # transaction search index, if they haven't been built yet. This is done on
+    # the first search rather than at load time, so budgets that are never
+    # searched never pay for it. (Each is built while holding the index lock,
+    # which every search holds too, so concurrent requests never search a
+    # half-built index.)
+    def search_setup(self, transactions=True):
+        if self.class_search != None and (not transactions or self.transaction_search != None):
+            return
+        if transactions:
+            self.load_histories()
+        with self.index_lock:
+            if self.class_search == None:
+                self.class_search = SearchIndex()
+                for bc in self.classes:
+                    self.search_index_class(bc)
+            if transactions and self.transaction_search == None:
+                self.transaction_search = SearchIndex()
+                for bc in self.classes:
+                    for t in bc.history:
+                        self.search_index_transaction(t)
     
+    # Adds the given class (and all of its transactions) to the search indexes,
+    # if they've been built. Expects the index lock to be held.
+    def search_index_class(self, bclass):
+        if self.class_search == None:
+            return
+        self.class_search.add(bclass.bcid, bclass, bclass.keywords,
+                              order=bclass.name.lower())
+        if self.transaction_search != None:
+            for t in bclass.history:
+                self.search_index_transaction(t)
+
+    # Adds the given transaction to the transaction search index, if it's been
+    # built. Transactions can be found by their price, vendor, or description,
+    # or by their exact integer timestamp. Expects the index lock to be held.
+    def search_index_transaction(self, transaction):
+        if self.transaction_search == None:
+            return
+        ts = transaction.timestamp.timestamp()
+        self.transaction_search.add(transaction.tid, transaction,
+                                    [str(transaction.price), transaction.desc,
+                                     transaction.vendor],
+                                    exact=[str(int(ts))], order=-ts)
+
     # ------------------------------ Removals -------------------------------- #
     # Takes in a budget class and does two things:
-    #   1. Deletes its file on disk
+    #   1. Deletes it from storage
     #   2. Removes the class from the Budget object's internal list
     # This throws an exception if the class isn't found within.
     def delete_class(self, bclass):
-        # use the given class's ID to find the equivalent object stored in the
-        # Budget object, then use it to get the index
-        result = self.get_class(bclass.bcid)
-        if not result.success:
-            return result
-        bc = result.data
-        idx = self.classes.index(bc)
-        self.classes.pop(idx)
-
-        # now, build the file path and delete the file
-        sroot = self.save_root_path(self.datetime)
-        fpath = os.path.join(sroot, bc.to_file_name())
-        os.remove(fpath)
-        # attempt to back up
-        try:
-            bclass.save(self.backup_class_path(bclass))
-        except Exception as e:
-            m = "Failed to backup class: %s" % e
-            return BudgetResult(success=True, msg=m)
-        return BudgetResult(success=True)
+        with self.period_lock(), self.class_lock(bclass.bcid):
+            self.sync()
+            # use the given class's ID to find the equivalent object stored in
+            # the Budget object, then use it to get the index
+            result = self.get_class(bclass.bcid)
+            if not result.success:
+                return result
+            bc = result.data
+            # the class's history must be read before its file goes away
+            bc.history_load()
+            idx = self.classes.index(bc)
+            self.classes.pop(idx)
+            self.unindex_class(bc)
+
+            # now, delete the class from storage (in one batch with the backup)
+            with self.writing():
+                self.storage.delete_class(self.period.name, bc)
+                # attempt to back up
+                try:
+                    self.backup_storage.save_class(self.period.name, bclass)
+                except Exception as e:
+                    m = "Failed to backup class: %s" % e
+                    return BudgetResult(success=True, msg=m)
+                return BudgetResult(success=True)
 
 
     # Takes in a transaction and deletes it from its corresponding budget class.
     # Throws an exception if the transaction isn't inside the budget.
     def delete_transaction(self, transaction):
-        # locate the true transaction object stored within the budget object AND
-        # the true budget class that's storing the transaction
-        result = self.get_transaction(transaction.tid)
-        if not result.success:
-            return result
-        t = result.data
-        result = self.get_class(transaction.owner.bcid)
-        if not result.success:
-            return result
-        bc = result.data
-        
-        # remove the transaction from the class, then save the budget class
-        bc.remove(t)
-        sroot = self.save_root_path(self.datetime)
-        fpath = os.path.join(sroot, bc.to_file_name())
-        bc.save(fpath)
-        # attempt to back up
-        try:
-            bclass.save(self.backup_class_path(bclass))
-        except Exception as e:
-            m = "Failed to backup class: %s" % e
-            return BudgetResult(success=True, msg=m)
-        return BudgetResult(success=True)
-
+        with self.class_lock(transaction.owner.bcid):
+            self.sync()
+            # locate the true transaction object stored within the budget
+            # object AND the true budget class that's storing the transaction
+            # (now that we hold the lock, neither can change underneath us)
+            result = self.get_transaction(transaction.tid)
+            if not result.success:
+                return result
+            t = result.data
+            result = self.get_class(transaction.owner.bcid)
+            if not result.success:
+                return result
+            bc = result.data
+
+            # remove the transaction from the class, then record the removal
+            # in storage (in one batch with the backup)
+            # (identical transactions share an ID, so the ID stays indexed
+            # until the class's last copy is removed)
+            bc.remove(t)
+            with self.index_lock:
+                rest = bc.history.get(t.tid)
+                if rest == None:
+                    self.transaction_index.pop(t.tid, None)
+                    if self.transaction_search != None:
+                        self.transaction_search.remove(t.tid)
+                else:
+                    self.search_index_transaction(rest)
+            with self.writing():
+                self.storage.append(self.period.name, bc, "remove", t)
+                self.learn([[bc.bcid, t]], remove=True)
+                # attempt to back up
+                try:
+                    self.backup_storage.append(self.period.name, bc, "remove", t)
+                except Exception as e:
+                    m = "Failed to backup class: %s" % e
+                    return BudgetResult(success=True, msg=m)
+                return BudgetResult(success=True)
+
+
+    # ------------------------------- Indexing ------------------------------- #
+    # Adds the given class and all of its transactions to the ID lookup tables.
+    # Each transaction's 'owner' is pointed at the class, since an updated
+    # class may be a copy that shares its history with the original. (A class
+    # whose history hasn't been loaded yet is adopted when it's loaded, and its
+    # transactions are indexed when the transaction table is built.)
+    def index_class(self, bclass):
+        with self.index_lock:
+            self.class_index[bclass.bcid] = bclass
+            if bclass.history_loaded() or self.transaction_index != None:
+                bclass.history.adopt(bclass)
+                if self.transaction_index != None:
+                    for tid in bclass.history.ids():
+                        self.transaction_index[tid] = bclass
+            self.search_index_class(bclass)
+            if self.classifier != None:
+                self.classifier.add(bclass)
+
+    # Builds the transaction lookup table, if it hasn't been built yet. Every
+    # class's history is loaded first.
+    def transaction_setup(self):
+        if self.transaction_index != None:
+            return
+        self.load_histories()
+        with self.index_lock:
+            if self.transaction_index != None:
+                return
+            index = {}
+            for bc in list(self.classes):
+                for tid in bc.history.ids():
+                    index[tid] = bc
+            self.transaction_index = index
+
+    # Loads the history of every class whose history hasn't been loaded yet.
+    # The classes are loaded in parallel. Returns the number of milliseconds
+    # it took.
+    def load_histories(self):
+        classes = [bc for bc in self.classes if not bc.history_loaded()]
+        if len(classes) == 0:
+            return 0.0
+        start = time.perf_counter()
+        parallel_map(lambda bc: bc.history_load(), classes)
+        seconds = time.perf_counter() - start
+        self.timing("histories", seconds)
+        return seconds * 1000.0
+
+    # Removes the given class and all of its transactions from the ID lookup
+    # tables.
+    def unindex_class(self, bclass):
+        with self.index_lock:
+            self.class_index.pop(bclass.bcid, None)
+            if self.transaction_index != None or self.transaction_search != None:
+                for tid in bclass.history.ids():
+                    if self.transaction_index != None:
+                        self.transaction_index.pop(tid, None)
+                    if self.transaction_search != None:
+                        self.transaction_search.remove(tid)
+            if self.class_search != None:
+                self.class_search.remove(bclass.bcid)
+            if self.classifier != None:
+                self.classifier.remove(bclass.bcid)
 
     # ---------------------- Manual Saving and Backups ----------------------- #
     # Takes in a class and saves it to the correct location.
     def update_class(self, bclass):
-        # first, delete the old version of the same budget class. Then, save the
-        # new one with its updated fields
-        result = self.delete_class(bclass)
-        if not result.success:
-            return result
-        result = self.add_class(bclass)
-        if not result.success:
-            return result
-        return BudgetResult(success=True)
+        # first, swap the old version of the class for the new one in memory
+        # (in place, and under the index lock, so readers see one or the
+        # other). Then, replace the old version's files with the new one's.
+        # The period and class locks are held across both, so no other writer
+        # sees the class missing; the index lock isn't held while storage is
+        # written
+        with self.period_lock(), self.class_lock(bclass.bcid):
+            self.sync()
+            result = self.get_class(bclass.bcid)
+            if not result.success:
+                return result
+            old = result.data
+            for bc in self.classes:
+                assert bc.bcid == bclass.bcid or bclass.name.lower() != bc.name.lower(), \
+                       "duplicate budget class name detected"
+            # both histories must be read before the old files go away
+            old.history_load()
+            bclass.history_load()
+            if not isinstance(bclass.history, self.history_type):
+                bclass.history = self.history_type(bclass.history)
+            with self.index_lock:
+                self.classes[self.classes.index(old)] = bclass
+                self.unindex_class(old)
+                self.index_class(bclass)
+
+            # now, rewrite the class in storage (in one batch with the backup)
+            with self.writing():
+                self.storage.delete_class(self.period.name, old)
+                self.storage.save_class(self.period.name, bclass)
+                # attempt to back up
+                try:
+                    self.backup_storage.save_class(self.period.name, bclass)
+                except Exception as e:
+                    m = "Failed to backup class: %s" % e
+                    return BudgetResult(success=True, msg=m)
+                return BudgetResult(success=True)
+
+    # ------------------------------- Locking -------------------------------- #
+    # Returns the lock held while classes are added to or removed from this
+    # budget's reset period (see lib/locks.py).
+    def period_lock(self):
+        return BudgetLock(self, lock_manager.period_lock(self.period.name))
+
+    # Takes in a class ID and returns the lock held while the class's
+    # transactions are modified.
+    def class_lock(self, bcid):
+        return BudgetLock(self, lock_manager.class_lock(self.period.name, bcid))
+
+    # Invoked after taking a write lock. If other processes share the budget
+    # (see lib/locks.py) and one of them has written to this period since the
+    # budget last saw it, the budget's classes are reloaded from storage.
+    def sync(self):
+        if not lock_manager.shared():
+            return
+        if self.storage.signature(self.period.name) != self.signature:
+            self.reload()
+
+    # Reloads all of the budget's classes from storage and rebuilds its
+    # indexes.
+    def reload(self):
+        name = self.period.name
+        classes = self.storage.manifest(name, history_type=self.history_type)
+        with self.index_lock:
+            self.class_index = {}
+            self.transaction_index = None
+            self.class_search = None
+            self.transaction_search = None
+            self.classifier = None
+            self.classes = classes
+            for bc in self.classes:
+                self.index_class(bc)
+        self.signature = self.storage.signature(name)
+
+    # Context manager wrapped around every write to storage. The writes within
+    # it are made durable together. Once they land, and the thread has
+    # released all of the budget's locks, the budget's write hooks are invoked
+    # (the budget cache uses this to record the new state of storage as the
+    # budget's own; its own lock can't be taken while a period lock is held).
+    # Until then, 'writes' is above zero. The time each write takes is
+    # reported as the "save" phase. (With cross-process locking, the budget
+    # records the new state of storage as its own while its locks are still
+    # held, so another process's write isn't mistaken for its own.)
+    @contextmanager
+    def writing(self):
+        with self.writes_lock:
+            self.writes += 1
+        start = time.perf_counter()
+        try:
+            with self.storage.batch():
+                yield
+        finally:
+            timing_report("budget_save", time.perf_counter() - start)
+            if lock_manager.shared():
+                self.signature = self.storage.signature(self.period.name)
+            self.local.pending = getattr(self.local, "pending", 0) + 1
+            if getattr(self.local, "held", 0) == 0:
+                self.writes_finish()
+
+    # Invoked once the thread holds none of the budget's locks. Runs the write
+    # hooks for the writes the thread made (once, no matter how many there
+    # were), then counts the writes as finished. The writes have already
+    # landed, so a hook that fails is reported (on stderr) rather than raised.
+    def writes_finish(self):
+        pending = getattr(self.local, "pending", 0)
+        if pending == 0:
+            return
+        self.local.pending = 0
+        try:
+            for hook in self.write_hooks:
+                try:
+                    hook(self)
+                except Exception as e:
+                    sys.stderr.write("Budget write hook failed: %s\n" % e)
+        finally:
+            with self.writes_lock:
+                self.writes -= pending
 
     # Takes in a timestamp (datetime.now() by default) and uses it to determine
     # the current reset date, and from it, a path to the directory into which a
     # budget object should be saved. If the directory doesn't exist, this
     # function also creates it.
     def save_root_path(self, dt=datetime.now()):
-        # using the given datetime, we'll iterate through the reset dates and
-        # determine which one to use for the directory path
-        d = self.conf.reset_dates[0]
-        best_score = None
-        for rd in self.conf.reset_dates:
-            # compute a difference between the month and the day. We'll select
-            # the reset date with the smallest positive value as the most
-            # recently-passed
-            diff = (dt.month - rd.month) + ((dt.day - rd.day) / 40.0)
-            if diff >= 0.0 and (best_score == None or diff < best_score):
-                best_score = diff
-                d = rd
-        
-        # construct the folder directory path, create it if necessary, and
-        # return it
-        dpath = self.conf.save_location + "/%d-%d-%d" % (dt.year, d.month, d.day)
-        assert not os.path.isfile(dpath), "save root path is a file: %s" % dpath
-        if not os.path.isdir(dpath):
-            os.mkdir(dpath)
-        return dpath
+        return self.conf.periods.save_dir(dt)
 
     # Attempts to set up the current backup location based on the config's
     # 'backup_location' entry. Returns the path to the backup directory.
     def backup_setup(self, dt=datetime.now()):
-        # we'll compute the same kind of score we do above in 'save_root_path'
-        # to determine which reset date to use for backup
-        d = self.conf.reset_dates[0]
-        best_score = None
-        for rd in self.conf.reset_dates:
-            diff = (dt.month - rd.month) + ((dt.day - rd.day) / 40.0)
-            if diff >= 0.0 and (best_score == None or diff < best_score):
-                best_score = diff
-                d = rd
-        
-        # with the correct date, build a backup file path
-        dpath = "%s/%d-%d-%d" % (self.conf.backup_location, dt.year,
-                                 d.month, d.day)
-
-        # if the directory doesn't exist, create it
-        assert not os.path.isfile(dpath), "backup location is a file"
-        if not os.path.isdir(dpath):
-            os.mkdir(dpath)
-        return dpath
-    
-    # Takes in a budget class and returns the path at which it should be saved.
-    def backup_class_path(self, bclass, dt=datetime.now()):
-        dpath = self.backup_setup(dt=dt)
-        fpath = os.path.join(dpath, bclass.to_file_name())
-        return fpath
+        return self.conf.periods.backup_dir(dt)
     
     # Takes in a file path and attempts to create an Excel file for the entire
     # budget.
     def write_to_excel(self, fpath):
+        self.load_histories()
         # first, create an Excel workbook object, and create a worksheet for
         # each budget class
         wb = Workbook()
@@ -370,30 +787,19 @@ class Budget:
         ws1["A1"] = "Name"
         ws1["B1"] = self.conf.name
         ws1["A2"] = "Start Date"
-        start_date = self.reset_dates[-1]
-        start_date = start_date.replace(year=start_date.year - 1)
+        period = self.conf.periods.period(self.datetime)
+        start_date = period.start
         ws1["B2"] = start_date
         ws1["B2"].number_format = "yyyy-mm-dd"
         ws1["A3"] = "End Date"
-        end_date = self.reset_dates[0]
-        end_date = datetime.fromtimestamp(end_date.timestamp() - 86400)
+        end_date = datetime.fromtimestamp(period.end.timestamp() - 86400)
         ws1["B3"] = end_date
         ws1["B3"].number_format = "yyyy-mm-dd"
         
-        # quickly loop through the classes together to compute totals for income
-        # and expenses
-        itotal = 0.0
-        etotal = 0.0
-        for bc in self.classes:
-            # iterate through the class' history
-            total = 0.0
-            for t in bc.history:
-                total += t.price
-            # depending on the type, add to the correct counter
-            if bc.ctype == BudgetClassType.INCOME:
-                itotal += total
-            else:
-                etotal += total
+        # compute totals for income and expenses (and everything else)
+        summary = self.summarize()
+        itotal = summary.income
+        etotal = summary.expenses
 
         # set more overview fields
         ws1["A4"] = "Total Income"
@@ -449,16 +855,14 @@ class Budget:
             ws.column_dimensions["C"].width = 20
             ws.column_dimensions["D"].width = 40
 
-            # sort the transactions in ascending order by date
-            ts = sorted(bc.history, key=lambda t: t.timestamp.timestamp())
+            # the history is already in ascending order by date
+            ts = bc.history.ascending()
 
             # for each transaction in the budget, we'll get its JSON form and
             # use it to construct a row
             idx = 2
-            total = 0.0
             for t in ts:
                 jdata = t.to_json()
-                total += jdata["price"]
                 # set row values
                 ws["A%d" % idx] = datetime.fromtimestamp(jdata["timestamp"])
                 ws["A%d" % idx].number_format = "yyyy-mm-dd"
@@ -470,14 +874,15 @@ class Budget:
                 idx += 1
 
             # add a row to our overview worksheet
+            cs = summary.get_class(bc.bcid)
             tstr = "INCOME" if bc.ctype == BudgetClassType.INCOME else "EXPENSE"
             rn = str(row_num)
             ws1["A" + rn] = bc.name
             ws1["B" + rn] = tstr
-            ws1["C" + rn] = total
+            ws1["C" + rn] = cs.total
             ws1["C" + rn].number_format = "$#0.00"
-            if bc.target != None:
-                ws1["D" + rn] = bc.target.get_value(total_income=itotal)
+            if cs.target != None:
+                ws1["D" + rn] = cs.target
                 ws1["D" + rn].number_format = "$#0.00"
             row_num += 1
                 
@@ -491,13 +896,14 @@ class Budget:
         for c in ["A", "B", "C"]:
             ws1[c + rn].font = header_font
         # iterate through each savings category
-        for sc in sorted(self.savings, key=lambda sc: sc.name):
+        for entry in sorted(summary.savings, key=lambda e: e[0].name):
+            sc = entry[0]
             row_num += 1
             rn = str(row_num)
             ws1["A" + rn] = sc.name
             ws1["B" + rn] = sc.percent
             ws1["B" + rn].number_format = "%#0"
-            ws1["C" + rn] = sc.percent * max(0.0, itotal - etotal)
+            ws1["C" + rn] = entry[1]
             ws1["C" + rn].number_format = "$#0.00"
         
         # save the workbook
@@ -508,15 +914,72 @@ class Budget:
     def all(self):
         return sorted(self.classes, key=lambda bc: bc.name.lower())
     
+    # Computes the budget's aggregate numbers (class totals, income/expense
+    # totals, surplus, targets, and savings) and returns them in a
+    # BudgetSummary object.
+    def summarize(self):
+        self.load_histories()
+        return BudgetSummary(self)
+
     # Creates one monolithic JSON struct containing all budget classes and
     # all transactions within them.
-    def to_json(self):
+    # Optionally takes in a list of fields to include for each class, and a
+    # page size and/or 'since' datetime to limit each class's history (see
+    # 'BudgetClass.to_json()').
+    def to_json(self, fields=None, limit=None, since=None):
+        if fields == None or "history" in fields:
+            self.load_histories()
         jdata = []
-        # iterate through all classes and add their JSON to the data
-        for c in self.classes:
-            jdata.append(c.to_json())
+        # iterate through all classes and add their JSON to the data (each
+        # class is converted under its lock, so it isn't modified halfway)
+        for c in list(self.classes):
+            with self.class_lock(c.bcid):
+                jdata.append(c.to_json(fields=fields, limit=limit, since=since))
         return jdata
+
+    # Generator that produces the same JSON as 'to_json()' as a series of
+    # strings, one class (and one transaction) at a time.
+    def iter_json(self, fields=None, limit=None, since=None):
+        if fields == None or "history" in fields:
+            self.load_histories()
+        return self.iter_json_classes(list(self.classes), fields=fields, limit=limit,
+                                      since=since)
+
+    # Generator that takes in a list of the budget's classes and produces a
+    # JSON array of them, the same way 'iter_json()' does. The generator is
+    # usually run after the caller is done with the budget (such as while a
+    # response is being sent), so each class's transactions are copied out
+    # under the class's lock before they're encoded.
+    def iter_json_classes(self, classes, fields=None, limit=None, since=None):
+        yield "["
+        sep = ""
+        for c in classes:
+            with self.class_lock(c.bcid):
+                parts = c.json_parts(fields=fields, limit=limit, since=since)
+            yield sep
+            for chunk in BudgetClass.iter_json_parts(parts):
+                yield chunk
+            sep = ", "
+        yield "]"
     
+    # Takes in the name of a load phase and the number of seconds it took.
+    # The time is added to the budget's timings (in milliseconds) and reported
+    # to any timing hooks (as "budget_<phase>").
+    def timing(self, phase, seconds):
+        key = "%s_ms" % phase
+        self.timings[key] = self.timings.get(key, 0.0) + seconds * 1000.0
+        timing_report("budget_%s" % phase, seconds)
+
+    # Returns a JSON object describing how the budget was loaded: how long each
+    # phase took (in milliseconds), and how many classes' histories have been
+    # loaded so far.
+    def load_stats(self):
+        loaded = len([bc for bc in self.classes if bc.history_loaded()])
+        jdata = {k: round(v, 3) for (k, v) in self.timings.items()}
+        jdata["classes"] = len(self.classes)
+        jdata["histories_loaded"] = loaded
+        return jdata
+
     # Returns the number of seconds from now until the next scheduled budget
     # reset.
     def time_to_reset(self):
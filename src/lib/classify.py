@@ -0,0 +1,188 @@
+# This module defines the classifier used to automatically pick a budget class
+# for a transaction. Every class's keywords are compiled into a single
+# Aho-Corasick automaton, so a transaction's text (its vendor, description, or
+# a search query) is matched against every keyword of every class in one pass,
+# rather than scanning each class's keywords one at a time.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+
+# ============================ Keyword Automaton ============================= #
+# An Aho-Corasick automaton built from a list of (lowercase) keywords. Each
+# state is a node in a trie of the keywords; each state also has a failure
+# link to the state for the longest proper suffix of its text that's in the
+# trie, and a list of every keyword that ends at the state (including those
+# reached through failure links).
+class KeywordAutomaton:
+    # Constructor. Takes in a list of keywords and compiles the automaton.
+    def __init__(self, keywords):
+        self.keywords = sorted(set(keywords))
+        self.gotos = [{}]           # state --> {character --> next state}
+        self.fails = [0]            # state --> failure state
+        self.outputs = [[]]         # state --> indexes of keywords ending here
+
+        # build the trie
+        for (idx, word) in enumerate(self.keywords):
+            state = 0
+            for c in word:
+                nxt = self.gotos[state].get(c, None)
+                if nxt == None:
+                    nxt = len(self.gotos)
+                    self.gotos.append({})
+                    self.fails.append(0)
+                    self.outputs.append([])
+                    self.gotos[state][c] = nxt
+                state = nxt
+            self.outputs[state].append(idx)
+
+        # set the failure links, breadth-first, so each state's failure state
+        # is finished before the state itself
+        queue = list(self.gotos[0].values())
+        for state in queue:
+            for (c, nxt) in self.gotos[state].items():
+                queue.append(nxt)
+                fail = self.fails[state]
+                while fail != 0 and c not in self.gotos[fail]:
+                    fail = self.fails[fail]
+                self.fails[nxt] = self.gotos[fail].get(c, 0)
+                self.outputs[nxt] = self.outputs[nxt] + self.outputs[self.fails[nxt]]
+
+    # Takes in a (lowercase) string and returns the set of keywords found
+    # within it. A keyword only counts if it's a whole word (or words) of the
+    # text: the characters on either side of it can't be letters or digits,
+    # so "gas" isn't found in "las vegas".
+    def find(self, text):
+        found = set()
+        state = 0
+        gotos = self.gotos
+        fails = self.fails
+        tlen = len(text)
+        for (i, c) in enumerate(text):
+            while state != 0 and c not in gotos[state]:
+                state = fails[state]
+            state = gotos[state].get(c, 0)
+            if len(self.outputs[state]) == 0 or (i + 1 < tlen and text[i + 1].isalnum()):
+                continue
+            for idx in self.outputs[state]:
+                word = self.keywords[idx]
+                start = i + 1 - len(word)
+                if start == 0 or not text[start - 1].isalnum():
+                    found.add(word)
+        return found
+
+
+# ============================= Classifier Match ============================= #
+# Simple class used to hold a single class the classifier matched, its score,
+# and the keywords that matched.
+class ClassifierMatch:
+    # Constructor.
+    def __init__(self, bclass, score, keywords):
+        self.bclass = bclass
+        self.score = score
+        self.keywords = keywords
+
+    # Returns a JSON representation of the match.
+    def to_json(self):
+        return {
+            "class_id": self.bclass.bcid,
+            "score": self.score,
+            "keywords": self.keywords
+        }
+
+
+# ================================ Classifier ================================ #
+# Maps transaction text to budget classes using the classes' keywords. Classes
+# are added and removed one at a time (for example, when a class is edited);
+# the automaton is only recompiled, on the next classification, when a keyword
+# it doesn't already know about is added.
+#
+# A class's score is the total length of its distinct keywords found in the
+# text, so longer (more specific) keywords win. Ties go to the class with more
+# matching keywords, then to the class whose name sorts first, then to the
+# class ID, so the same text always picks the same class.
+class Classifier:
+    # Constructor.
+    def __init__(self):
+        self.classes = {}           # class ID --> BudgetClass
+        self.class_keywords = {}    # class ID --> set of keywords
+        self.keywords = {}          # keyword --> set of class IDs
+        self.automaton = None       # compiled on demand
+
+    # Returns the number of classes in the classifier.
+    def __len__(self):
+        return len(self.classes)
+
+    # ------------------------------ Mutation -------------------------------- #
+    # Adds a budget class (replacing any class with the same ID).
+    def add(self, bclass):
+        self.remove(bclass.bcid)
+        words = set(w.strip().lower() for w in bclass.keywords) - set([""])
+        self.classes[bclass.bcid] = bclass
+        self.class_keywords[bclass.bcid] = words
+        for w in words:
+            if w not in self.keywords:
+                self.keywords[w] = set()
+                self.automaton = None
+            self.keywords[w].add(bclass.bcid)
+
+    # Removes the class with the given ID. Returns True if it was present.
+    # (Keywords no other class uses are left in the automaton; they just
+    # don't map to any class.)
+    def remove(self, bcid):
+        if bcid not in self.classes:
+            return False
+        self.classes.pop(bcid)
+        for w in self.class_keywords.pop(bcid):
+            self.keywords[w].discard(bcid)
+        return True
+
+    # Compiles the automaton, if it's out of date.
+    def compile(self):
+        if self.automaton == None:
+            self.automaton = KeywordAutomaton(self.keywords.keys())
+        return self.automaton
+
+    # ---------------------------- Classification ---------------------------- #
+    # Takes in a string (or a list of strings, which are matched separately)
+    # and returns a list of ClassifierMatch objects, best first. If 'limit' is
+    # given, at most that many matches are returned.
+    def classify(self, text, limit=None):
+        texts = [text] if type(text) == str else text
+        automaton = self.compile()
+        found = set()
+        for t in texts:
+            found |= automaton.find(t.lower())
+
+        # tally up each class's matching keywords
+        matched = {}                # class ID --> list of matching keywords
+        for w in found:
+            for bcid in self.keywords[w]:
+                matched.setdefault(bcid, []).append(w)
+        result = []
+        for (bcid, words) in matched.items():
+            words.sort()
+            score = sum(len(w) for w in words)
+            result.append(ClassifierMatch(self.classes[bcid], score, words))
+        result.sort(key=lambda m: (-m.score, -len(m.keywords),
+                                   m.bclass.name.lower(), m.bclass.bcid))
+        return result if limit == None else result[:limit]
+
+    # Takes in a list of strings (or of lists of strings) and classifies each
+    # one. Returns a list holding the best match for each (or None, if nothing
+    # matched).
+    def classify_many(self, texts):
+        result = []
+        for t in texts:
+            matches = self.classify(t, limit=1)
+            result.append(matches[0] if len(matches) > 0 else None)
+        return result
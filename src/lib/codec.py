@@ -0,0 +1,76 @@
+# This module defines the JSON codec used to read and write budget files. It
+# picks the fastest JSON library available (orjson, if it's installed, and the
+# standard library's json module otherwise), and defines schemas: compiled
+# lists of the fields (and field types) a JSON object is expected to have,
+# used to validate objects before they're decoded.
+#
+# Files are written in a compact encoding by default. The indented encoding
+# (easier to read and edit by hand) is still available; either can be read.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import json
+
+# Optional imports (orjson is much faster than the standard library, but it
+# isn't required)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Globals
+CODEC_BACKEND = "json" if orjson == None else "orjson"
+CODEC_INDENT = 4                    # indentation of the pretty encoding
+
+
+# ================================ Encoding ================================== #
+# Takes in a JSON object and returns it encoded as a string. If 'pretty' is
+# set, the string is indented (with the standard library, since orjson only
+# supports two-space indentation); otherwise it's compact.
+def encode(jdata, pretty=False):
+    if pretty:
+        return json.dumps(jdata, indent=CODEC_INDENT)
+    if orjson != None:
+        return orjson.dumps(jdata).decode("utf-8")
+    return json.dumps(jdata, separators=(",", ":"))
+
+# Takes in a string of JSON and returns the decoded object.
+def decode(text):
+    if orjson != None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+# ================================= Schemas ================================== #
+# A list of the fields a JSON object must have. Each field is given as
+# [key, type (or list of types), error message]. The types are matched
+# exactly (so a bool isn't accepted as an int, and an int isn't accepted as a
+# float, unless both are listed).
+class Schema:
+    # Constructor. Takes in the list of fields and compiles it into a tuple of
+    # (key, set of types, error message) tuples.
+    def __init__(self, fields):
+        compiled = []
+        for f in fields:
+            types = f[1] if type(f[1]) in [list, tuple] else [f[1]]
+            compiled.append((f[0], frozenset(types), f[2]))
+        self.fields = tuple(compiled)
+
+    # Takes in a JSON object and asserts that every field is present and has
+    # the right type. The object is returned.
+    def check(self, jdata):
+        assert type(jdata) == dict, self.fields[0][2]
+        get = jdata.get
+        for (key, types, msg) in self.fields:
+            if type(get(key, None)) not in types:
+                assert False, msg
+        return jdata
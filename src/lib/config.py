@@ -16,6 +16,7 @@ if dpath not in sys.path:                           # add to path
 
 # Local imports
 from lib.savings import SavingsCategory
+from lib.periods import ResetPeriodTable
 
 # Main configuration class.
 class Config:
@@ -49,12 +50,43 @@ class Config:
             assert key in jdata and type(jdata[key]) == f[1], f[2]
             setattr(self, key, jdata[key])
         
+        # ------------------------- Optional Fields -------------------------- #
+        # each optional entry has a default value that's used if it's missing
+        optional = [
+            ["history_store", str, "list", "'history_store' must be a string"],
+            ["history_cache_periods", int, 8, "'history_cache_periods' must be an integer"],
+            ["storage", str, "json", "'storage' must be a string"],
+            ["storage_pretty", bool, False, "'storage_pretty' must be a boolean"],
+            ["durability", str, "batched", "'durability' must be a string"],
+            ["durability_window_ms", int, 5, "'durability_window_ms' must be an integer"],
+            ["suggest_model", bool, True, "'suggest_model' must be a boolean"]
+        ]
+        for f in optional:
+            key = f[0]
+            if key in jdata:
+                assert type(jdata[key]) == f[1], f[3]
+                setattr(self, key, jdata[key])
+            else:
+                setattr(self, key, f[2])
+        # the history store must be one of the known container types
+        assert self.history_store in ["list", "columnar"], \
+               "'history_store' must be either \"list\" or \"columnar\""
+        assert self.history_cache_periods >= 1, "'history_cache_periods' must be at least 1"
+        # the storage backend must be one of the known backends
+        assert self.storage in ["json", "sqlite"], \
+               "'storage' must be either \"json\" or \"sqlite\""
+        # writes are either flushed one at a time, or group-committed
+        assert self.durability in ["always", "batched"], \
+               "'durability' must be either \"always\" or \"batched\""
+        assert self.durability_window_ms >= 0, "'durability_window_ms' must not be negative"
+
         # --------------------------- Reset Dates ---------------------------- #
         # for each entry in the reset dates, we'll try to parse out the month
         # and day for each month
         assert len(self.reset_dates) >= 1, "must have at least one reset date"
         rdates = self.reset_dates.copy()
         self.reset_dates = []
+        self.reset_mdays = []       # (month, day) pair of each reset date
         for rd in rdates:
             # convert to a string, trim whitespace, then split by "-"
             rd = str(rd).strip()
@@ -67,6 +99,7 @@ class Config:
             # extract the day
             day = int(pieces[1].strip())
             assert day > 0 and day < 32, "each day must be a valid [1, 31] day of the month"
+            self.reset_mdays.append((month, day))
 
             # get the given date - we'll use this to set up our reset dates
             # accordingly based on the current month/day
@@ -81,10 +114,12 @@ class Config:
             year = now.year
             if already_happened:
                 year = year + 1
-            self.reset_dates.append(datetime(year, month, day))
+            self.reset_dates.append(ResetPeriodTable.make_date(year, month, day))
         
-        # finally, sort the reset dates chronologically
+        # finally, sort the reset dates chronologically, and build the table
+        # used to find the reset period of any given date
         self.reset_dates = sorted(self.reset_dates)
+        self.periods = ResetPeriodTable(self)
 
         # ------------------------- Surplus Savings -------------------------- #
         # for each of the surplus saving categories, we'll parse to verify
@@ -0,0 +1,285 @@
+# This module defines the I/O layer budget files are written through. Whole
+# files are written to a temporary file in the same directory and renamed over
+# the target, so a crash mid-write never leaves a truncated file behind, and
+# writes to the same file are serialized with a per-file lock.
+#
+# Making writes durable (flushing them to the disk with fsync) is the slow
+# part, and is handled according to a durability mode:
+#
+#   - "always": every write is flushed before it returns.
+#   - "batched": flushes are group-committed. Writers that arrive within a
+#     small window of each other wait on a single round of flushes, and the
+#     writes made within a 'batch()' block (such as a class's save and backup
+#     copies) are flushed together when the block ends.
+#
+# Either way, a whole-file write is always flushed before it's renamed into
+# place, so the rename never exposes a partially-written file.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Globals
+DURABILITY_MODES = ["always", "batched"]
+writers = {}                        # (mode, window) --> FileWriter
+writers_lock = threading.Lock()
+
+
+# ================================= Helpers ================================== #
+# Takes in a path and flushes it to disk. Directories are flushed so renames
+# and newly-created files within them are durable. A path that no longer
+# exists (such as a journal that was compacted away) has nothing to flush.
+def fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError as e:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Takes in a durability mode and a group commit window (in seconds) and
+# returns the shared FileWriter for them, creating it if necessary.
+def get_writer(mode="always", window=0.005):
+    assert mode in DURABILITY_MODES, \
+           "durability mode must be one of: %s" % DURABILITY_MODES
+    key = (mode, window)
+    with writers_lock:
+        w = writers.get(key, None)
+        if w == None:
+            w = FileWriter(mode=mode, window=window)
+            writers[key] = w
+        return w
+
+
+# ============================== Write Metrics =============================== #
+# Simple class that tracks the latency of one kind of operation.
+class WriteMetrics:
+    # Constructor.
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0            # total latency, in seconds
+        self.max = 0.0              # worst latency, in seconds
+
+    # Records one operation that took the given number of seconds.
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Returns a JSON representation of the metrics (latencies in milliseconds).
+    def to_json(self):
+        return {
+            "count": self.count,
+            "avg_ms": 0.0 if self.count == 0 else self.total * 1000.0 / self.count,
+            "max_ms": self.max * 1000.0
+        }
+
+
+# =============================== File Writer ================================ #
+# Writes files atomically and makes them durable according to its durability
+# mode. One writer is shared by everything using the same mode (see
+# 'get_writer()'), so concurrent requests can share group commits.
+class FileWriter:
+    # Constructor. Takes in the durability mode and the group commit window
+    # (in seconds).
+    def __init__(self, mode="always", window=0.005):
+        assert mode in DURABILITY_MODES, \
+               "durability mode must be one of: %s" % DURABILITY_MODES
+        self.mode = mode
+        self.window = window
+        self.locks = {}                     # file path --> lock
+        self.locks_lock = threading.Lock()
+        self.local = threading.local()      # per-thread batch state
+        # group commit state (protected by 'cond')
+        self.cond = threading.Condition()
+        self.pending = set()                # paths waiting to be flushed
+        self.gathering = 1                  # ID of the group being gathered
+        self.committed = 0                  # ID of the last group flushed
+        self.leading = False                # True while a group is flushing
+        self.active = 0                     # threads currently writing
+        self.errors = {}                    # group ID --> flush exception
+        # metrics
+        self.writes = WriteMetrics()        # whole-file writes
+        self.appends = WriteMetrics()       # appends
+        self.commits = WriteMetrics()       # time spent waiting for durability
+        self.groups = WriteMetrics()        # group flushes
+        self.fsyncs = 0
+
+    # Takes in a file path and returns the lock used to serialize writes to
+    # it. The lock is reentrant, so a caller holding it can write the file
+    # more than once.
+    def lock(self, fpath):
+        fpath = os.path.realpath(fpath)
+        with self.locks_lock:
+            l = self.locks.get(fpath, None)
+            if l == None:
+                l = threading.RLock()
+                self.locks[fpath] = l
+            return l
+
+    # ------------------------------- Writing -------------------------------- #
+    # Takes in a file path and a string and replaces the file's contents with
+    # the string. The string is written to a temporary file in the same
+    # directory, flushed, then renamed over the target.
+    def write(self, fpath, data):
+        start = time.perf_counter()
+        dpath = os.path.dirname(os.path.realpath(fpath))
+        with self.lock(fpath):
+            (fd, tpath) = tempfile.mkstemp(dir=dpath, suffix=".tmp",
+                                           prefix="." + os.path.basename(fpath) + ".")
+            try:
+                with os.fdopen(fd, "w") as fp:
+                    fp.write(data)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(tpath, fpath)
+            except Exception as e:
+                if os.path.isfile(tpath):
+                    os.remove(tpath)
+                raise e
+        with self.cond:
+            self.writes.record(time.perf_counter() - start)
+        # the rename itself is made durable by flushing the directory
+        self.commit([dpath])
+
+    # Takes in a file path and a string and appends the string to the file.
+    def append(self, fpath, data):
+        start = time.perf_counter()
+        with self.lock(fpath):
+            fp = open(fpath, "a")
+            fp.write(data)
+            fp.close()
+        with self.cond:
+            self.appends.record(time.perf_counter() - start)
+        self.commit([fpath, os.path.dirname(os.path.realpath(fpath))])
+
+    # Takes in a file path and removes the file (if it exists).
+    def remove(self, fpath):
+        with self.lock(fpath):
+            if not os.path.isfile(fpath):
+                return
+            os.remove(fpath)
+        self.commit([os.path.dirname(os.path.realpath(fpath))])
+
+    # ------------------------------ Durability ------------------------------ #
+    # Takes in a list of paths that were just written and makes them durable.
+    # In "always" mode they're flushed right away. In "batched" mode, they're
+    # flushed with the next group commit (or, within a 'batch()' block, when
+    # the block ends).
+    def commit(self, paths):
+        if self.mode == "always":
+            start = time.perf_counter()
+            for p in paths:
+                fsync_path(p)
+            with self.cond:
+                self.fsyncs += len(paths)
+                self.commits.record(time.perf_counter() - start)
+            return
+
+        # inside a batch, the paths are held until the batch ends
+        batch = getattr(self.local, "batch", None)
+        if batch != None:
+            batch.update(paths)
+            return
+        self.group_commit(paths)
+
+    # Context manager that defers the flushes of every write made by this
+    # thread within it, then flushes all of them together at the end. Batches
+    # can be nested; the outermost one does the flushing.
+    @contextmanager
+    def batch(self):
+        outer = getattr(self.local, "batch", None) == None
+        if outer:
+            self.local.batch = set()
+            with self.cond:
+                self.active += 1
+        try:
+            yield self
+        finally:
+            if outer:
+                paths = self.local.batch
+                self.local.batch = None
+                with self.cond:
+                    self.active -= 1
+                if len(paths) > 0:
+                    self.commit(paths)
+
+    # Takes in a list of paths and waits until they've been flushed by a group
+    # commit. The first thread to arrive leads the group: if other threads are
+    # writing, it waits out the window so their paths can join the group, then
+    # flushes every pending path at once and wakes everyone in the group.
+    def group_commit(self, paths):
+        start = time.perf_counter()
+        with self.cond:
+            self.pending.update(paths)
+            gid = self.gathering
+            while self.committed < gid:
+                if self.leading:
+                    self.cond.wait()
+                    continue
+
+                # lead the next group
+                self.leading = True
+                if self.active > 0 and self.window > 0:
+                    self.cond.release()
+                    time.sleep(self.window)
+                    self.cond.acquire()
+                group = self.gathering
+                flush = self.pending
+                self.pending = set()
+                self.gathering += 1
+
+                # flush the group without holding the lock, so new writers
+                # can gather the next one
+                self.cond.release()
+                gstart = time.perf_counter()
+                error = None
+                try:
+                    for p in flush:
+                        fsync_path(p)
+                except Exception as e:
+                    error = e
+                self.cond.acquire()
+                self.groups.record(time.perf_counter() - gstart)
+                self.fsyncs += len(flush)
+                if error != None:
+                    self.errors[group] = error
+                self.committed = group
+                self.leading = False
+                self.cond.notify_all()
+
+            # keep only the most recent errors around
+            error = self.errors.get(gid, None)
+            while len(self.errors) > 64:
+                self.errors.pop(min(self.errors))
+            self.commits.record(time.perf_counter() - start)
+        if error != None:
+            raise error
+
+    # --------------------------------- JSON --------------------------------- #
+    # Returns a JSON object containing the writer's metrics.
+    def to_json(self):
+        with self.cond:
+            return {
+                "mode": self.mode,
+                "window_ms": self.window * 1000.0,
+                "writes": self.writes.to_json(),
+                "appends": self.appends.to_json(),
+                "commits": self.commits.to_json(),
+                "groups": self.groups.to_json(),
+                "fsyncs": self.fsyncs
+            }
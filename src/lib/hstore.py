@@ -0,0 +1,172 @@
+# This module defines a store that answers queries across every reset period
+# in a budget's storage. A Budget object only ever sees one period; the history
+# store indexes all of the periods instead, loads a period's classes only when
+# a query reaches it, and keeps the most recently used periods in memory.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import heapq
+import threading
+from collections import OrderedDict
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.thistory import TransactionHistory
+from lib.ttable import TransactionTable
+from lib.storage import make_storage, period_start
+
+
+# ============================== Stored Period =============================== #
+# Simple class that represents one stored reset period. Its classes are loaded
+# on demand.
+class HistoryStorePeriod:
+    # Constructor. Takes in the period's start date and its name.
+    def __init__(self, start, name):
+        self.start = start
+        self.end = None             # start of the next period (or None)
+        self.name = name
+        self.classes = None         # loaded BudgetClass objects
+        self.signature = None       # storage signature when loaded
+
+
+# ============================== History Match =============================== #
+# Simple class used to hold a single transaction returned by a query, along
+# with the class and period it was found in.
+class HistoryStoreMatch:
+    # Constructor.
+    def __init__(self, period, bclass, transaction):
+        self.period = period
+        self.bclass = bclass
+        self.transaction = transaction
+
+    # Returns a JSON representation of the match: the transaction's JSON, plus
+    # the class and period it belongs to.
+    def to_json(self):
+        jdata = self.transaction.to_json()
+        jdata["class_id"] = self.bclass.bcid
+        jdata["class_name"] = self.bclass.name
+        jdata["period"] = self.period.name
+        return jdata
+
+
+# ============================== History Store =============================== #
+# Indexes every reset period within a config's storage and answers range
+# queries across them. Up to 'capacity' periods are kept loaded in memory
+# (least recently used periods are dropped first). A loaded period is reloaded
+# if its contents in storage change.
+class HistoryStore:
+    # Constructor. Takes in the Config object, and the maximum number of
+    # periods to keep loaded (by default, the config's 'history_cache_periods').
+    def __init__(self, conf, capacity=None):
+        if capacity == None:
+            capacity = conf.history_cache_periods
+        assert capacity >= 1, "the history store must hold at least one period"
+        self.conf = conf
+        self.storage = make_storage(conf)
+        self.capacity = capacity
+        self.history_type = TransactionHistory
+        if conf.history_store == "columnar":
+            self.history_type = TransactionTable
+        self.periods = []               # all periods, oldest first
+        self.loaded = OrderedDict()     # period name --> loaded period (LRU order)
+        self.lock = threading.Lock()    # protects the loaded periods
+        self.scan()
+
+    # Asks the storage for its periods and rebuilds the list of periods.
+    # Periods that are already loaded stay loaded.
+    def scan(self):
+        periods = []
+        for name in self.storage.periods():
+            p = self.loaded.get(name, None)
+            periods.append(p if p != None else HistoryStorePeriod(period_start(name), name))
+
+        # sort the periods, and let each one end where the next begins
+        periods.sort(key=lambda p: p.start)
+        for i in range(len(periods)):
+            periods[i].end = None if i == len(periods) - 1 else periods[i + 1].start
+        self.periods = periods
+
+    # Takes in a period and returns its classes, loading them from disk if
+    # they aren't loaded (or if the period has changed in storage).
+    def load(self, period):
+        with self.lock:
+            sig = self.storage.signature(period.name)
+            if period.classes != None and period.signature == sig:
+                self.loaded.move_to_end(period.name)
+                return period.classes
+
+            # load every class in the period
+            classes = self.storage.load(period.name, history_type=self.history_type)
+            period.classes = classes
+            period.signature = sig
+
+            # add the period to the LRU, and drop the oldest if it's too big
+            self.loaded[period.name] = period
+            self.loaded.move_to_end(period.name)
+            while len(self.loaded) > self.capacity:
+                (name, old) = self.loaded.popitem(last=False)
+                old.classes = None
+                old.signature = None
+            return classes
+
+    # -------------------------------- Queries ------------------------------- #
+    # Generator that yields the transactions matching a query as
+    # HistoryStoreMatch objects, most recent first. Takes in:
+    #   - A start and end datetime; only transactions in [start, end) match.
+    #     Either may be None to leave that side open.
+    #   - An optional list of class IDs or names (names are case-insensitive)
+    #   - An optional vendor string (matched as a case-insensitive substring)
+    # Periods are only loaded once the query reaches them, so a consumer that
+    # stops early never loads the older periods.
+    def iter_range(self, start=None, end=None, classes=None, vendor=None):
+        cfilter = None
+        if classes != None:
+            cfilter = set([c.lower() for c in classes])
+        vendor = None if vendor == None else vendor.lower()
+
+        # walk the periods from newest to oldest, skipping any that can't hold
+        # transactions in the range
+        for p in reversed(self.periods):
+            if end != None and p.start >= end:
+                continue
+            if start != None and p.end != None and p.end <= start:
+                break
+
+            # take each matching class's slice of the range, then merge the
+            # slices into one descending sequence
+            views = []
+            for bc in self.load(p):
+                if cfilter != None and bc.bcid.lower() not in cfilter and \
+                   bc.name.lower() not in cfilter:
+                    continue
+                views.append(HistoryStore.matches(p, bc, bc.range(start=start, end=end)))
+            for m in heapq.merge(*views, key=lambda m: m.transaction.timestamp,
+                                 reverse=True):
+                if vendor != None and vendor not in (m.transaction.vendor or "").lower():
+                    continue
+                yield m
+
+    # Generator that wraps each transaction in the given view in a match.
+    @staticmethod
+    def matches(period, bclass, view):
+        for t in view:
+            yield HistoryStoreMatch(period, bclass, t)
+
+    # Returns a list of the transactions matching a query (see 'iter_range()').
+    # If 'limit' is given, at most that many (most recent) matches are
+    # returned.
+    def range(self, start=None, end=None, classes=None, vendor=None, limit=None):
+        result = []
+        for m in self.iter_range(start=start, end=end, classes=classes, vendor=vendor):
+            if limit != None and len(result) >= limit:
+                break
+            result.append(m)
+        return result
@@ -0,0 +1,184 @@
+# This module implements bulk transaction imports. Rows (read from a CSV or
+# JSON Lines file, or sent to the server as a JSON list) are each turned into a
+# transaction and routed to a budget class, either by the class's ID or by
+# matching the classes' keywords (see lib/classify.py). Every row is validated before anything is
+# written, then all of the valid rows are added to the budget at once (see
+# 'Budget.add_transactions()').
+#
+# Each row is a dictionary with these fields:
+#   - "class_id" or "query":    the class's ID, or text to search for a class
+#                               (if neither is given, the class is picked from
+#                               the vendor and description)
+#   - "price":                  the transaction's price
+#   - "timestamp":              epoch seconds, or a date ("YYYY-MM-DD", with an
+#                               optional " HH:MM:SS" or "THH:MM:SS")
+#   - "vendor":                 (optional) the transaction's vendor
+#   - "description":            (optional) the transaction's description
+#   - "recurring":              (optional) whether or not the transaction recurs
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import csv
+import json
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.budget import BudgetResult
+from lib.transaction import Transaction
+
+# Globals
+IMPORT_DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+IMPORT_TRUE = ["true", "yes", "y", "1"]
+IMPORT_FALSE = ["false", "no", "n", "0", ""]
+
+
+# ================================ File Input ================================ #
+# Takes in the path to a CSV file (with a header row naming the fields) or a
+# JSON Lines file (one JSON object per line) and returns a list of rows. The
+# format is chosen by the file's extension.
+def import_read(fpath):
+    rows = []
+    fp = open(fpath, "r", newline="")
+    if fpath.lower().endswith(".csv"):
+        for r in csv.DictReader(fp):
+            rows.append(r)
+    else:
+        for line in fp:
+            if line.strip() != "":
+                rows.append(json.loads(line))
+    fp.close()
+    return rows
+
+
+# ================================ Row Parsing =============================== #
+# Takes in a price (a number, or a string such as "$1,024.50") and returns it
+# as a float.
+def parse_price(value):
+    if type(value) == str:
+        value = value.strip().replace("$", "").replace(",", "")
+    assert type(value) in [str, int, float], "\"price\" must be a number"
+    return float(value)
+
+# Takes in a timestamp (epoch seconds, or a date string) and returns a
+# datetime object.
+def parse_timestamp(value):
+    if type(value) in [int, float]:
+        return datetime.fromtimestamp(value)
+    assert type(value) == str, "\"timestamp\" must be a number or a date string"
+    value = value.strip()
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError as e:
+        pass
+    for fmt in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError as e:
+            pass
+    assert False, "\"timestamp\" must be epoch seconds or a date (YYYY-MM-DD)"
+
+# Takes in a "recurring" value (a boolean, or a string such as "yes") and
+# returns it as a boolean.
+def parse_recurring(value):
+    if type(value) == bool:
+        return value
+    assert type(value) == str and value.strip().lower() in IMPORT_TRUE + IMPORT_FALSE, \
+           "\"recurring\" must be true or false"
+    return value.strip().lower() in IMPORT_TRUE
+
+# Takes in a budget, a row, and a dictionary of rows that have already been
+# classified ((query, vendor, description) --> class). Returns the row's budget class and a
+# new transaction. Throws an exception if the row is invalid.
+def parse_row(budget, row, queries):
+    assert type(row) == dict, "each row must be an object"
+    row = {k: v for (k, v) in row.items() if v != None}
+
+    vendor = row.get("vendor", "")
+    desc = row.get("description", "")
+    assert type(vendor) == str, "\"vendor\" must be a string"
+    assert type(desc) == str, "\"description\" must be a string"
+
+    # find the class, either by ID or by classifying the row (each distinct
+    # query is only classified once)
+    bclass = None
+    if row.get("class_id", "") != "":
+        bclass = budget.class_index.get(row["class_id"], None)
+        assert bclass != None, "no class has the ID \"%s\"" % row["class_id"]
+    else:
+        query = row.get("query", "")
+        assert type(query) == str, "\"query\" must be a string"
+        assert query != "" or vendor != "" or desc != "", \
+               "\"class_id\" or \"query\" is required (or a vendor or description to classify)"
+        key = (query, vendor, desc)
+        if key not in queries:
+            result = budget.classify_transaction(query, vendor=vendor, description=desc)
+            queries[key] = result.data if result.success else None
+        bclass = queries[key]
+        assert bclass != None, "no class matches \"%s\"" % " ".join([query, vendor, desc]).strip()
+
+    # build the transaction from the remaining fields
+    assert "price" in row, "\"price\" is required"
+    assert "timestamp" in row, "\"timestamp\" is required"
+    t = Transaction(parse_price(row["price"]), vendor=vendor, description=desc,
+                    timestamp=parse_timestamp(row["timestamp"]),
+                    recur=parse_recurring(row.get("recurring", False)))
+
+    # make sure the transaction lands in the budget's reset period
+    periods = budget.conf.periods
+    assert periods.period(t.timestamp) is periods.period(budget.datetime), \
+           "the timestamp is outside of the budget's reset period"
+    return [bclass, t]
+
+
+# ================================== Import ================================== #
+# Takes in a budget and a list of rows and imports them. Each row is validated
+# first; if 'strict' is set and any row is invalid, nothing is imported.
+# Otherwise, every valid row is imported. Returns a BudgetResult whose data is
+# a list of per-row results, each holding the row's index, whether or not it
+# was imported, a message, and (if it was) its class and transaction IDs.
+def import_rows(budget, rows, strict=False):
+    results = []
+    pairs = []
+    queries = {}
+    for (idx, row) in enumerate(rows):
+        r = {"row": idx, "success": False, "message": ""}
+        try:
+            [bclass, t] = parse_row(budget, row, queries)
+            pairs.append([bclass, t])
+            r["class_id"] = bclass.bcid
+            r["transaction_id"] = t.tid
+            r["success"] = True
+        except Exception as e:
+            r["message"] = str(e)
+        results.append(r)
+
+    # if any row failed validation (and we're being strict), stop here
+    failed = len(rows) - len(pairs)
+    if strict and failed > 0:
+        for r in results:
+            if r["success"]:
+                r["success"] = False
+                r["message"] = "Not imported (another row is invalid)."
+        m = "%d of %d rows are invalid. Nothing was imported." % (failed, len(rows))
+        return BudgetResult(success=False, msg=m, data=results)
+
+    # add every valid row at once
+    if len(pairs) > 0:
+        result = budget.add_transactions(pairs)
+        if not result.success:
+            for r in results:
+                if r["success"]:
+                    r["success"] = False
+                    r["message"] = result.message
+            return BudgetResult(success=False, msg=result.message, data=results)
+    m = "Imported %d of %d rows." % (len(pairs), len(rows))
+    return BudgetResult(success=True, msg=m, data=results)
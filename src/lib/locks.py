@@ -0,0 +1,149 @@
+# This module defines the locks that serialize writes to budgets. Every Budget
+# object in a process shares one lock manager, which hands out a lock per
+# reset period (held while classes are added to or removed from the period)
+# and a lock per budget class within a period (held while the class's
+# transactions are modified). Writes to different classes proceed in
+# parallel. Most reads don't take any locks; reads that walk a class's whole
+# history (such as converting the budget to JSON) hold the class's lock while
+# they copy it.
+#
+# When both are needed, the period lock is always taken before the class
+# lock, so two writers can't deadlock.
+#
+# When several processes serve the same budget (see 'share()'), the lock
+# manager switches to cross-process locking: each period lock also holds an
+# exclusive file lock, and class locks become the period lock, so every write
+# to a period (in any process) is serialized.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import threading
+
+# Optional imports (file locks are only available on Unix systems)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+
+# =============================== Lock Manager =============================== #
+# Hands out reentrant locks keyed by period name and class ID. Locks are
+# created on first use and kept for the life of the process (a budget only has
+# a handful of classes per period).
+class LockManager:
+    # Constructor.
+    def __init__(self):
+        self.locks = {}                 # (period, class ID) --> lock
+        self.lock = threading.Lock()    # protects the table of locks
+        self.shared_dpath = None        # directory of cross-process lock files
+        # statistics
+        self.acquisitions = 0
+        self.contentions = 0
+
+    # Takes in a directory shared by every process serving the budget (such as
+    # the budget's save location) and switches to cross-process locking. Lock
+    # files are created within the directory.
+    def share(self, dpath):
+        assert fcntl != None, "cross-process locking requires the fcntl module"
+        with self.lock:
+            self.shared_dpath = dpath
+            self.locks = {}
+
+    # Returns True if cross-process locking is enabled.
+    def shared(self):
+        return self.shared_dpath != None
+
+    # Takes in a key and returns its lock, creating it if necessary. Period
+    # locks are backed by a lock file when cross-process locking is enabled.
+    def get(self, key):
+        with self.lock:
+            l = self.locks.get(key, None)
+            if l == None:
+                fpath = None
+                if self.shared_dpath != None:
+                    fpath = os.path.join(self.shared_dpath, ".%s.lock" % key[0])
+                l = LockManagerLock(self, fpath=fpath)
+                self.locks[key] = l
+            return l
+
+    # Takes in a period name and returns the period's lock.
+    def period_lock(self, period):
+        return self.get((period, None))
+
+    # Takes in a period name and a class ID and returns the class's lock. With
+    # cross-process locking, this is the period's lock.
+    def class_lock(self, period, bcid):
+        if self.shared_dpath != None:
+            return self.period_lock(period)
+        return self.get((period, bcid))
+
+    # --------------------------------- JSON --------------------------------- #
+    # Returns a JSON object containing the lock manager's statistics.
+    def to_json(self):
+        with self.lock:
+            return {
+                "locks": len(self.locks),
+                "shared": self.shared_dpath != None,
+                "acquisitions": self.acquisitions,
+                "contentions": self.contentions
+            }
+
+
+# ============================ Lock Manager Lock ============================= #
+# A reentrant lock that counts how often it's acquired, and how often a caller
+# had to wait for it. Used as a context manager. If a lock file is given, the
+# outermost acquisition also takes an exclusive lock on the file, which keeps
+# out other processes.
+class LockManagerLock:
+    # Constructor. Takes in the owning lock manager and an optional lock file.
+    def __init__(self, manager, fpath=None):
+        self.manager = manager
+        self.lock = threading.RLock()
+        self.fpath = fpath
+        self.fp = None              # open lock file (while held)
+        self.depth = 0              # number of nested acquisitions
+
+    # Acquires the lock, waiting if another thread (or process) holds it.
+    def __enter__(self):
+        contended = not self.lock.acquire(blocking=False)
+        if contended:
+            self.lock.acquire()
+        try:
+            if self.depth == 0 and self.fpath != None:
+                self.fp = open(self.fpath, "a")
+                fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        except Exception as e:
+            if self.fp != None:
+                self.fp.close()
+                self.fp = None
+            self.lock.release()
+            raise e
+        self.depth += 1
+        with self.manager.lock:
+            self.manager.acquisitions += 1
+            if contended:
+                self.manager.contentions += 1
+        return self
+
+    # Releases the lock.
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0 and self.fp != None:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+            self.fp.close()
+            self.fp = None
+        self.lock.release()
+        return False
+
+
+# Globals
+lock_manager = LockManager()    # shared by every budget in the process
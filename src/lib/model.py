@@ -0,0 +1,325 @@
+# This module defines a learned model that suggests a budget class for a
+# transaction based on its vendor and description. It's a multinomial naive
+# Bayes model: for each class, it counts how often each token (a word from a
+# vendor or description, plus the whole vendor string) appears in the class's
+# transactions, across every reset period.
+#
+# The model is trained from the budget's entire history the first time it's
+# needed (or ahead of time, such as when the server starts, or by cli/train.py),
+# then kept up to date as transactions are added and removed. It's saved next
+# to the budget's save location as a snapshot file plus a journal of the
+# updates made since the snapshot (compacted back into the snapshot once it
+# grows large), just like budget class files.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import re
+import json
+import math
+import threading
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.fileio import get_writer
+from lib.storage import make_storage
+from lib.locks import lock_manager
+
+# Globals
+MODEL_FNAME = ".model.json"
+models = {}                         # save location --> CategoryModel
+models_lock = threading.Lock()
+models_train_lock = threading.Lock()    # held while a model is trained
+
+
+# ================================= Helpers ================================== #
+# Tokens are runs of letters and digits. Tokens that are entirely digits (such
+# as store numbers and reference codes) carry no meaning and are skipped.
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+# Takes in a transaction's vendor and description and returns its list of
+# tokens: every word of both, plus the entire vendor (which is the strongest
+# signal of all).
+def tokenize(vendor, description):
+    vendor = ("" if vendor == None else vendor).strip().lower()
+    description = "" if description == None else description
+    tokens = []
+    for text in [vendor, description.lower()]:
+        for t in TOKEN_REGEX.findall(text):
+            if len(t) > 1 and not t.isdigit():
+                tokens.append(t)
+    if vendor != "":
+        tokens.append("vendor:" + vendor)
+    return tokens
+
+# Takes in a Config object and returns the model for its save location,
+# loading it from disk (or, if it was never saved, training it from the
+# budget's history) if necessary. Models are shared by every caller using the
+# same save location. Training reads the budget's entire history, so it
+# isn't done while 'models_lock' is held; if 'train' is false, None is
+# returned instead of training a model (the training will pick up whatever
+# the caller wrote to the budget).
+def get_model(conf, train=True):
+    key = os.path.realpath(conf.save_location)
+    writer = get_writer(conf.durability, conf.durability_window_ms / 1000.0)
+    fpath = os.path.join(conf.save_location, MODEL_FNAME)
+    with models_lock:
+        m = models.get(key, None)
+        if m != None:
+            return m
+        if os.path.isfile(fpath):
+            m = CategoryModel(fpath, writer=writer)
+            m.load()
+            models[key] = m
+            return m
+    if not train:
+        return None
+
+    # train the model (unless another thread trained it while we waited). If
+    # another process saved a model in the meantime, it's used instead
+    with models_train_lock:
+        with models_lock:
+            m = models.get(key, None)
+        if m != None:
+            return m
+        m = CategoryModel(fpath, writer=writer)
+        m.train_storage(make_storage(conf))
+        with m.file_lock():
+            if os.path.isfile(fpath):
+                m.load()
+            else:
+                m.save()
+        with models_lock:
+            models[key] = m
+        return m
+
+# Takes in a Config object and (re)trains the model for its save location from
+# scratch, using the budget's entire history. The new model is saved and
+# replaces any shared one. Returns the new model.
+def train_model(conf):
+    key = os.path.realpath(conf.save_location)
+    writer = get_writer(conf.durability, conf.durability_window_ms / 1000.0)
+    m = CategoryModel(os.path.join(conf.save_location, MODEL_FNAME), writer=writer)
+    m.train_storage(make_storage(conf))
+    m.save()
+    with models_lock:
+        models[key] = m
+    return m
+
+
+# ============================ Model Suggestion ============================== #
+# Simple class used to hold a single class suggested by the model, along with
+# the model's probability that it's the right class.
+class ModelSuggestion:
+    # Constructor.
+    def __init__(self, bclass, probability):
+        self.bclass = bclass
+        self.probability = probability
+
+    # Returns a JSON representation of the suggestion.
+    def to_json(self):
+        return {
+            "class_id": self.bclass.bcid,
+            "name": self.bclass.name,
+            "probability": self.probability
+        }
+
+
+# ============================== Category Model ============================== #
+# The naive Bayes model. Classes are identified by their IDs, which stay the
+# same as classes are carried from one reset period to the next.
+class CategoryModel:
+    # Once the journal holds this many entries, it's compacted into the
+    # snapshot file.
+    JOURNAL_COMPACT_THRESHOLD = 1024
+
+    # Constructor. Takes in the path to the model's snapshot file and the
+    # FileWriter to write with.
+    def __init__(self, fpath, writer=None):
+        self.fpath = fpath
+        self.writer = get_writer() if writer == None else writer
+        self.lock = threading.RLock()
+        self.docs = {}              # class ID --> number of transactions
+        self.counts = {}            # class ID --> {token --> count}
+        self.totals = {}            # class ID --> total number of tokens
+        self.vocab = {}             # token --> number of classes using it
+        self.journal_count = 0      # number of entries in the journal
+
+    # ------------------------------- Training ------------------------------- #
+    # Takes in a class ID, a list of tokens, and +1 (to learn a transaction)
+    # or -1 (to forget one), and updates the counts.
+    def update(self, bcid, tokens, sign):
+        with self.lock:
+            docs = self.docs.get(bcid, 0) + sign
+            if docs <= 0:
+                self.forget_class(bcid)
+                return
+            self.docs[bcid] = docs
+            counts = self.counts.setdefault(bcid, {})
+            total = self.totals.get(bcid, 0)
+            for t in tokens:
+                c = counts.get(t, 0) + sign
+                if c > 0:
+                    if t not in counts:
+                        self.vocab[t] = self.vocab.get(t, 0) + 1
+                    counts[t] = c
+                    total += sign
+                elif t in counts:
+                    total -= counts.pop(t)
+                    self.vocab_drop(t)
+            self.totals[bcid] = total
+
+    # Takes in a token that a class no longer uses and drops it from the
+    # vocabulary if no other class uses it.
+    def vocab_drop(self, token):
+        n = self.vocab.get(token, 0) - 1
+        if n <= 0:
+            self.vocab.pop(token, None)
+        else:
+            self.vocab[token] = n
+
+    # Takes in a class ID and forgets everything learned about it.
+    def forget_class(self, bcid):
+        with self.lock:
+            for t in self.counts.pop(bcid, {}):
+                self.vocab_drop(t)
+            self.docs.pop(bcid, None)
+            self.totals.pop(bcid, None)
+
+    # Takes in a storage backend and trains the model on every transaction in
+    # every period. (Recurring transactions are carried into each new period,
+    # so each one is only learned once per class.)
+    def train_storage(self, storage):
+        seen = set()
+        for name in storage.periods():
+            for bc in storage.load(name):
+                for t in bc.history:
+                    if t.recurring:
+                        if (bc.bcid, t.tid) in seen:
+                            continue
+                        seen.add((bc.bcid, t.tid))
+                    self.update(bc.bcid, tokenize(t.vendor, t.desc), 1)
+
+    # Takes in a list of [class ID, transaction] pairs and learns each one (or,
+    # if 'remove' is set, forgets each one). The updates are recorded in the
+    # model's journal.
+    def train(self, pairs, remove=False):
+        op = "remove" if remove else "add"
+        lines = []
+        with self.lock:
+            for (bcid, t) in pairs:
+                self.update(bcid, tokenize(t.vendor, t.desc), -1 if remove else 1)
+                lines.append(json.dumps({"op": op, "class_id": bcid, "vendor": t.vendor,
+                                         "description": t.desc}) + "\n")
+            self.journal_append("".join(lines), len(lines))
+
+    # -------------------------------- Scoring ------------------------------- #
+    # Takes in a transaction's vendor and description and a list of candidate
+    # class IDs, and returns a list of [class ID, probability] pairs (best
+    # first) for the candidates the model knows about. Ties go to the class
+    # with more transactions, then to the class ID.
+    def score(self, vendor, description, bcids):
+        tokens = tokenize(vendor, description)
+        with self.lock:
+            bcids = [b for b in bcids if b in self.docs]
+            if len(bcids) == 0 or len(tokens) == 0:
+                return []
+            ndocs = sum(self.docs[b] for b in bcids)
+            vsize = len(self.vocab) + 1
+
+            # compute each class's log-likelihood, with add-one smoothing
+            logs = []
+            for b in bcids:
+                counts = self.counts[b]
+                denom = math.log(self.totals[b] + vsize)
+                lp = math.log(self.docs[b] / ndocs)
+                for t in tokens:
+                    lp += math.log(counts.get(t, 0) + 1) - denom
+                logs.append([b, lp])
+
+        # turn the log-likelihoods into probabilities
+        top = max(lp for (b, lp) in logs)
+        total = sum(math.exp(lp - top) for (b, lp) in logs)
+        result = [[b, math.exp(lp - top) / total] for (b, lp) in logs]
+        result.sort(key=lambda r: (-r[1], -self.docs.get(r[0], 0), r[0]))
+        return result
+
+    # ------------------------------- File IO -------------------------------- #
+    # Returns the path to the model's journal.
+    def journal_path(self):
+        return os.path.splitext(self.fpath)[0] + ".jsonl"
+
+    # Returns the lock held while the model's files are written or read. When
+    # several processes serve the budget, it's a file lock (see lib/locks.py),
+    # since they all append to the same journal.
+    def file_lock(self):
+        return lock_manager.get(("model", None))
+
+    # Writes the entire model out to its snapshot file and removes the
+    # journal.
+    def save(self):
+        with self.lock:
+            jdata = {"docs": self.docs, "counts": self.counts}
+            with self.file_lock(), self.writer.lock(self.fpath):
+                self.writer.write(self.fpath, json.dumps(jdata))
+                self.writer.remove(self.journal_path())
+            self.journal_count = 0
+
+    # Compacts the journal into the snapshot file. The model is rebuilt from
+    # the snapshot and journal on disk rather than saved from this object's
+    # counts, since other processes may have appended updates this one never
+    # saw; afterwards, this object holds the rebuilt model.
+    def compact(self):
+        with self.lock:
+            with self.file_lock():
+                self.load()
+                self.save()
+
+    # Takes in a string of journal entries (and how many there are) and
+    # appends them to the journal, compacting it if it's grown too large.
+    def journal_append(self, text, count):
+        if count == 0:
+            return
+        with self.file_lock(), self.writer.lock(self.fpath):
+            self.writer.append(self.journal_path(), text)
+            self.journal_count += count
+            if self.journal_count >= CategoryModel.JOURNAL_COMPACT_THRESHOLD:
+                self.compact()
+
+    # Loads the model from its snapshot file, then replays its journal.
+    def load(self):
+        with self.lock, self.file_lock():
+            fp = open(self.fpath, "r")
+            jdata = json.loads(fp.read())
+            fp.close()
+            self.docs = jdata["docs"]
+            self.counts = jdata["counts"]
+            self.totals = {b: sum(c.values()) for (b, c) in self.counts.items()}
+            self.vocab = {}
+            for counts in self.counts.values():
+                for t in counts:
+                    self.vocab[t] = self.vocab.get(t, 0) + 1
+
+            # replay the journal (a crash mid-append can leave a partial final
+            # line behind; anything that doesn't parse is skipped)
+            self.journal_count = 0
+            jpath = self.journal_path()
+            if os.path.isfile(jpath):
+                fp = open(jpath, "r")
+                for line in fp:
+                    try:
+                        entry = json.loads(line)
+                    except Exception as e:
+                        continue
+                    self.journal_count += 1
+                    self.update(entry["class_id"],
+                                tokenize(entry["vendor"], entry["description"]),
+                                -1 if entry["op"] == "remove" else 1)
+                fp.close()
@@ -0,0 +1,134 @@
+# This module maps datetimes to budget reset periods. A config's reset dates
+# (month/day pairs) split every year into periods; each period begins on a
+# reset date and ends on the next one, and has its own save and backup
+# directory. The table of reset dates is sorted once, so finding the period of
+# any datetime is a binary search.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import bisect
+import calendar
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+
+# =============================== Reset Period =============================== #
+# Simple class that represents a single reset period: its name, the range of
+# time [start, end), and the directories its budget classes are saved and
+# backed up to.
+class ResetPeriod:
+    # Constructor.
+    def __init__(self, name, start, end, save_dpath, backup_dpath):
+        self.name = name            # "YEAR-MONTH-DAY" of the period's start
+        self.start = start
+        self.end = end
+        self.save_dpath = save_dpath
+        self.backup_dpath = backup_dpath
+
+    # Returns True if the given datetime falls within the period.
+    def contains(self, dt):
+        return dt >= self.start and dt < self.end
+
+
+# ============================ Reset Period Table ============================ #
+# Built from a Config object. Holds the config's reset dates as a sorted list
+# of (month, day) pairs and resolves datetimes to ResetPeriod objects, which
+# are kept once created. Directories that have been created (or found to
+# exist) are remembered, so they're only checked once.
+class ResetPeriodTable:
+    # Constructor. Takes in the Config object.
+    def __init__(self, conf):
+        self.save_location = conf.save_location
+        self.backup_location = conf.backup_location
+        self.mdays = sorted(set(conf.reset_mdays))
+        self.periods = {}       # (year, month, day) of a period's start --> period
+        self.dpaths = set()     # directories known to exist
+
+    # Takes in a year, month, and day and returns the matching datetime. Reset
+    # days that don't exist in a given month (such as February 30th) are moved
+    # back to the month's last day.
+    @staticmethod
+    def make_date(year, month, day):
+        return datetime(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+    # Takes in a year and an index into the reset date table and returns the
+    # matching key. Indexes past either end of the table wrap into the
+    # previous or next year.
+    def key(self, year, idx):
+        count = len(self.mdays)
+        year += idx // count
+        (month, day) = self.mdays[idx % count]
+        return (year, month, day)
+
+    # ------------------------------- Lookups -------------------------------- #
+    # Takes in a datetime and returns the ResetPeriod it falls within. The
+    # period begins on the most recent reset date on or before the datetime's
+    # day; before the year's first reset date, that's last year's final one.
+    def period(self, dt):
+        # on the last day of a month, any reset day past the end of the month
+        # (which is moved back to the last day) has already happened
+        day = dt.day
+        if day == calendar.monthrange(dt.year, dt.month)[1]:
+            day = 31
+        idx = bisect.bisect_right(self.mdays, (dt.month, day)) - 1
+        skey = self.key(dt.year, idx)
+        p = self.periods.get(skey, None)
+        if p != None:
+            return p
+
+        # build the period; the directories are named after its start date
+        ekey = self.key(dt.year, idx + 1)
+        dname = "%d-%d-%d" % skey
+        p = ResetPeriod(dname, ResetPeriodTable.make_date(*skey),
+                        ResetPeriodTable.make_date(*ekey),
+                        self.save_location + "/" + dname,
+                        self.backup_location + "/" + dname)
+        self.periods[skey] = p
+        return p
+
+    # Takes in an iterable of datetimes (or float timestamps) and returns a
+    # list of the ResetPeriod each one falls within, in the same order. Each
+    # distinct day is only looked up once, so thousands of timestamps can be
+    # classified cheaply.
+    def classify(self, dts):
+        days = {}               # date --> period
+        result = []
+        for dt in dts:
+            if type(dt) in [int, float]:
+                dt = datetime.fromtimestamp(dt)
+            day = dt.date()
+            p = days.get(day, None)
+            if p == None:
+                p = self.period(dt)
+                days[day] = p
+            result.append(p)
+        return result
+
+    # ----------------------------- Directories ------------------------------ #
+    # Makes sure the given directory exists, creating it if necessary.
+    def make_dir(self, dpath, errmsg):
+        if dpath in self.dpaths:
+            return dpath
+        assert not os.path.isfile(dpath), "%s: %s" % (errmsg, dpath)
+        if not os.path.isdir(dpath):
+            os.mkdir(dpath)
+        self.dpaths.add(dpath)
+        return dpath
+
+    # Takes in a datetime and returns the save directory of its period,
+    # creating the directory if it doesn't exist.
+    def save_dir(self, dt):
+        return self.make_dir(self.period(dt).save_dpath, "save root path is a file")
+
+    # Takes in a datetime and returns the backup directory of its period,
+    # creating the directory if it doesn't exist.
+    def backup_dir(self, dt):
+        return self.make_dir(self.period(dt).backup_dpath, "backup location is a file")
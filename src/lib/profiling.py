@@ -0,0 +1,192 @@
+# This module defines on-demand profiling, used to find out why a single
+# request (or command) is slow. A profile runs in one of two modes:
+#
+#   - "cpu": the code is run under a deterministic profiler (cProfile), and
+#     the functions it spent the most time in are reported.
+#   - "memory": allocations are traced (with tracemalloc), and the lines that
+#     allocated the most memory (still held when the profile ended) are
+#     reported, along with the peak amount of traced memory.
+#
+# The two aren't run together, since tracing allocations skews the timings.
+# Only one profile runs at a time: the profiler only watches the thread that
+# started it, but allocations are traced across the whole process.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Globals
+PROFILE_MODES = ["cpu", "memory"]
+PROFILE_TOP = 25                    # number of functions/lines reported
+PROFILE_FRAMES = 1                  # frames kept per traced allocation
+PROFILE_EXTENSIONS = {"cpu": "prof", "memory": "snapshot"}
+profile_lock = threading.Lock()     # held while a profile is running
+
+
+# ================================= Helpers ================================== #
+# Returns a file name made from the current time.
+def datetime_name():
+    return time.strftime("%Y%m%d-%H%M%S") + "-%06d" % (int(time.time() * 1000000) % 1000000)
+
+
+# ================================= Profile ================================== #
+# A single profile. It's started, the code being profiled runs, and then it's
+# stopped; afterwards its report can be retrieved (or dumped to a file, for
+# offline analysis with pstats or tracemalloc). Can also be used as a context
+# manager.
+class Profile:
+    # Constructor. Takes in the mode and the number of functions (or lines)
+    # to report.
+    def __init__(self, mode="cpu", top=PROFILE_TOP):
+        assert mode in PROFILE_MODES, \
+               "profile mode must be one of: %s" % PROFILE_MODES
+        self.mode = mode
+        self.top = top
+        self.running = False
+        self.started = None
+        self.seconds = 0.0
+        self.profiler = None        # cProfile profiler ("cpu")
+        self.tracing = False        # True if this profile started tracemalloc
+        self.before = None          # snapshots taken at start and stop ("memory")
+        self.after = None
+        self.peak = 0
+
+    # Context manager entry. Starts the profile.
+    def __enter__(self):
+        self.start()
+        return self
+
+    # Context manager exit. Stops the profile.
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    # Starts the profile. If another profile is running, this waits for it to
+    # finish, unless 'blocking' is false, in which case False is returned
+    # (and nothing is profiled). Returns True once the profile is running. If
+    # the profile fails to start, tracing is stopped and the lock is released
+    # before the exception is raised.
+    def start(self, blocking=True):
+        if not profile_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if self.mode == "memory":
+                self.tracing = not tracemalloc.is_tracing()
+                if self.tracing:
+                    tracemalloc.start(PROFILE_FRAMES)
+                # (the peak can only be reset on Python 3.9 and later; before
+                # that, the peak reported may predate the profile if something
+                # else was already tracing)
+                if hasattr(tracemalloc, "reset_peak"):
+                    tracemalloc.reset_peak()
+                self.before = tracemalloc.take_snapshot()
+            self.started = time.perf_counter()
+            if self.mode == "cpu":
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+        except Exception as e:
+            if self.tracing:
+                tracemalloc.stop()
+                self.tracing = False
+            profile_lock.release()
+            raise e
+        self.running = True
+        return True
+
+    # Stops the profile. Does nothing if it isn't running.
+    def stop(self):
+        if not self.running:
+            return
+        try:
+            if self.mode == "cpu":
+                self.profiler.disable()
+            self.seconds = time.perf_counter() - self.started
+            if self.mode == "memory":
+                self.after = tracemalloc.take_snapshot()
+                self.peak = tracemalloc.get_traced_memory()[1]
+                if self.tracing:
+                    tracemalloc.stop()
+        finally:
+            self.running = False
+            profile_lock.release()
+
+    # ------------------------------- Reports -------------------------------- #
+    # Returns a list of the functions the profile spent the most time in (not
+    # counting the functions they called), most first.
+    def functions(self):
+        stats = pstats.Stats(self.profiler).stats
+        top = sorted(stats.items(), key=lambda s: s[1][2], reverse=True)[:self.top]
+        return [{
+            "function": "%s:%d(%s)" % key,
+            "calls": value[1],
+            "total_s": value[2],
+            "cumulative_s": value[3]
+        } for (key, value) in top]
+
+    # Returns a list of the lines that allocated the most memory during the
+    # profile (that was still held when it stopped), most first.
+    def allocations(self):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        after = self.after.filter_traces(ignore)
+        before = self.before.filter_traces(ignore)
+        diffs = [d for d in after.compare_to(before, "lineno") if d.size_diff > 0]
+        return [{
+            "site": "%s:%d" % (d.traceback[0].filename, d.traceback[0].lineno),
+            "bytes": d.size_diff,
+            "count": d.count_diff
+        } for d in diffs[:self.top]]
+
+    # Returns a JSON representation of the profile's report.
+    def to_json(self):
+        jdata = {"mode": self.mode, "seconds": self.seconds}
+        if self.mode == "cpu":
+            jdata["functions"] = self.functions()
+        else:
+            jdata["peak_bytes"] = self.peak
+            jdata["allocations"] = self.allocations()
+        return jdata
+
+    # Returns the profile's report as a printable table.
+    def to_text(self):
+        jdata = self.to_json()
+        lines = ["%s profile (%.3f seconds)" % (self.mode, self.seconds)]
+        if self.mode == "cpu":
+            lines.append("%10s %12s %12s  %s" % ("calls", "total (s)", "cumul. (s)", "function"))
+            for f in jdata["functions"]:
+                lines.append("%10d %12.6f %12.6f  %s" %
+                             (f["calls"], f["total_s"], f["cumulative_s"], f["function"]))
+        else:
+            lines.append("peak traced memory: %d bytes" % self.peak)
+            lines.append("%12s %10s  %s" % ("bytes", "count", "site"))
+            for a in jdata["allocations"]:
+                lines.append("%12d %10d  %s" % (a["bytes"], a["count"], a["site"]))
+        return "\n".join(lines)
+
+    # Takes in a file path and dumps the raw profile to it: pstats data for a
+    # "cpu" profile, or a tracemalloc snapshot for a "memory" profile. If the
+    # path is a directory, a file named after the given name (or the current
+    # time) is created within it. Returns the path that was written.
+    def dump(self, fpath, name=None):
+        if os.path.isdir(fpath):
+            name = datetime_name() if name == None else name
+            fpath = os.path.join(fpath, "%s.%s" % (name, PROFILE_EXTENSIONS[self.mode]))
+        if self.mode == "cpu":
+            self.profiler.dump_stats(fpath)
+        else:
+            self.after.dump(fpath)
+        return fpath
+
@@ -2,6 +2,19 @@
 #
 #   Connor Shugg
 
+# Imports
+import os
+import sys
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.codec import Schema
+
 class SavingsCategory:
     # Simple constructor that takes in a name and a percentage.
     def __init__(self, name, percent):
@@ -9,15 +22,20 @@ class SavingsCategory:
         self.percent = percent
 
     # ----------------------------- JSON Helpers ----------------------------- #
+    # The fields expected in a savings category's JSON.
+    JSON_SCHEMA = Schema([
+        ["category", str, "each 'surplus_savings' entry much have a \"category\" string "
+                          "and a 'percent' float"],
+        ["percent", float, "each 'surplus_savings' entry much have a \"category\" string "
+                           "and a 'percent' float"]
+    ])
+
     # Takes in JSON and and attempts to use it to create a new SavingsCategory
     # object. The object is returned.
     @staticmethod
     def from_json(jdata):
         # make sure our fields are what we expect
-        assert "category" in jdata and type(jdata["category"]) == str and \
-               "percent" in jdata and type(jdata["percent"]) == float, \
-               "each 'surplus_savings' entry much have a \"category\" string " \
-               "and a 'percent' float"
+        SavingsCategory.JSON_SCHEMA.check(jdata)
         return SavingsCategory(jdata["category"], jdata["percent"])
     
     # Converts the current object to a JSON object and returns it.
@@ -0,0 +1,180 @@
+# This module defines an inverted index used to search budget classes and
+# transactions by text. Every indexed object is broken into short character
+# n-grams, so a substring search only has to look at the objects that contain
+# every n-gram of the query, rather than scanning the entire budget.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import heapq
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+
+# ============================ Search Index Entry ============================ #
+# Simple class used to hold a single indexed object, the (lowercase) text
+# fields it was indexed by, and the n-grams taken from those fields. The
+# n-grams are kept so the object can be removed even if its fields have been
+# modified since it was indexed.
+class SearchIndexEntry:
+    # Constructor.
+    def __init__(self, obj, fields, exact, order, grams):
+        self.obj = obj
+        self.fields = fields
+        self.exact = exact
+        self.order = order
+        self.grams = grams
+
+
+# =============================== Search Index =============================== #
+# Maps character n-grams (of length 1 through GRAM_MAX) to the set of object
+# keys whose text contains them. Queries of up to GRAM_MAX characters are
+# answered directly by a single posting set. Longer queries intersect the sets
+# of their n-grams and then verify the surviving candidates.
+class SearchIndex:
+    GRAM_MAX = 3
+
+    # Constructor.
+    def __init__(self):
+        self.entries = {}       # key --> SearchIndexEntry
+        self.grams = {}         # n-gram --> set of keys
+        self.exacts = {}        # exact-match string --> set of keys
+
+    # Returns the number of indexed objects.
+    def __len__(self):
+        return len(self.entries)
+
+    # Takes in a string and returns the set of all n-grams within it.
+    @staticmethod
+    def make_grams(text):
+        grams = set()
+        tlen = len(text)
+        for n in range(1, SearchIndex.GRAM_MAX + 1):
+            for i in range(tlen - n + 1):
+                grams.add(text[i:i + n])
+        return grams
+
+    # ------------------------------ Mutation -------------------------------- #
+    # Adds an object to the index. Takes in:
+    #   - A unique key for the object
+    #   - The object itself (returned by searches)
+    #   - A list of text fields the object can be found by (substring match)
+    #   - A list of strings the object can be found by (exact match only)
+    #   - A sort key used to order results that score equally
+    def add(self, key, obj, fields, exact=[], order=0):
+        # if the key is already present, remove the old entry first
+        if key in self.entries:
+            self.remove(key)
+        fields = [f.lower() for f in fields]
+        grams = set()
+        for f in fields:
+            grams |= SearchIndex.make_grams(f)
+
+        # add the key to each n-gram's posting set, and to each exact string's
+        for g in grams:
+            if g not in self.grams:
+                self.grams[g] = set()
+            self.grams[g].add(key)
+        for e in exact:
+            if e not in self.exacts:
+                self.exacts[e] = set()
+            self.exacts[e].add(key)
+        self.entries[key] = SearchIndexEntry(obj, fields, exact, order, grams)
+
+    # Removes the object with the given key from the index. Returns True if
+    # something was removed and False otherwise.
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry == None:
+            return False
+        # remove the key from each of its posting sets, dropping any sets that
+        # become empty
+        for g in entry.grams:
+            keys = self.grams[g]
+            keys.discard(key)
+            if len(keys) == 0:
+                self.grams.pop(g)
+        for e in entry.exact:
+            keys = self.exacts[e]
+            keys.discard(key)
+            if len(keys) == 0:
+                self.exacts.pop(e)
+        return True
+
+    # ------------------------------- Searching ------------------------------ #
+    # Takes in a query string and returns the set of keys whose fields contain
+    # it (or whose exact-match strings equal it).
+    def candidates(self, text):
+        result = set(self.exacts.get(text, set()))
+        if len(text) == 0:
+            return result | set(self.entries.keys())
+
+        # short queries are an n-gram themselves, so the posting set is the
+        # exact answer
+        if len(text) <= SearchIndex.GRAM_MAX:
+            return result | self.grams.get(text, set())
+
+        # otherwise, intersect the posting sets of every n-gram in the query,
+        # starting with the smallest, then verify each remaining candidate
+        sets = []
+        for i in range(len(text) - SearchIndex.GRAM_MAX + 1):
+            keys = self.grams.get(text[i:i + SearchIndex.GRAM_MAX], None)
+            if keys == None:
+                return result
+            sets.append(keys)
+        sets.sort(key=len)
+        keys = set(sets[0])
+        for s in sets[1:]:
+            keys &= s
+            if len(keys) == 0:
+                return result
+        for key in keys:
+            for f in self.entries[key].fields:
+                if text in f:
+                    result.add(key)
+                    break
+        return result
+
+    # Takes in a query and an entry and computes a relevance score:
+    #   4 - the query exactly matches one of the exact-match strings
+    #   3 - the query is equal to an entire field
+    #   2 - the query is the beginning of a word within a field
+    #   1 - the query appears somewhere within a field
+    @staticmethod
+    def score(text, entry):
+        if text in entry.exact:
+            return 4
+        best = 0
+        for f in entry.fields:
+            if f == text:
+                return 3
+            idx = f.find(text)
+            while idx >= 0 and best < 2:
+                best = max(best, 1)
+                if idx == 0 or not f[idx - 1].isalnum():
+                    best = 2
+                idx = f.find(text, idx + 1)
+        return best
+
+    # Searches the index for the given text. Returns a list of matching
+    # objects, ordered by descending score and then by each entry's sort key.
+    # If 'limit' is given, at most that many objects are returned.
+    def search(self, text, limit=None):
+        text = text.lower()
+        ranked = []
+        for key in self.candidates(text):
+            entry = self.entries[key]
+            ranked.append((-SearchIndex.score(text, entry), entry.order, entry.obj))
+        # when limited, only the top results need to be put in order
+        rkey = lambda r: (r[0], r[1])
+        if limit != None:
+            ranked = heapq.nsmallest(limit, ranked, key=rkey)
+        else:
+            ranked.sort(key=rkey)
+        return [r[2] for r in ranked]
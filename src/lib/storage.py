@@ -0,0 +1,549 @@
+# This module defines the storage backends budgets are saved to. A backend
+# stores budget classes (and their transactions) grouped by reset period, and
+# is identified by its period names ("YEAR-MONTH-DAY" of each period's start).
+# Two backends are available:
+#
+#   - "json": one JSON file per budget class, in one directory per period
+#     (with a journal file alongside each class file). This is the original
+#     layout.
+#   - "sqlite": a single SQLite database with indexed tables for periods,
+#     classes, and transactions.
+#
+# The backend is chosen with the config's optional 'storage' field. How
+# eagerly writes are flushed to disk is chosen with the 'durability' field.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import re
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.bclass import BudgetClass
+from lib.transaction import Transaction
+from lib.thistory import TransactionHistory
+from lib.fileio import get_writer
+from lib.codec import encode, decode
+from lib.periods import ResetPeriodTable
+
+# Globals
+STORAGE_BACKENDS = ["json", "sqlite"]
+LOAD_THREADS = 8                    # maximum threads used to parse class files
+MANIFEST_FIELDS = ["name", "type", "description", "keywords", "target"]
+storage_cache = {}                  # (backend, location, durability) --> storage
+storage_cache_lock = threading.Lock()
+
+
+# ================================= Helpers ================================== #
+# Period names are "YEAR-MONTH-DAY", after the reset date the period starts
+# on. (The day is the config's, so it may not exist in that month, such as
+# "2026-2-29"; the period then starts on the month's last day.)
+PERIOD_NAME_REGEX = re.compile(r"^(\d+)-(\d+)-(\d+)$")
+
+# Takes in a period name and returns its start datetime, or None if the name
+# isn't a valid period name.
+def period_start(name):
+    m = PERIOD_NAME_REGEX.match(name)
+    if m == None:
+        return None
+    try:
+        return ResetPeriodTable.make_date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    except ValueError as e:
+        return None
+
+# Computes a "signature" for the given directory: the name, size, and
+# modification time of every file within it. If any file is added, removed, or
+# rewritten, the signature changes. Temporary files (which the file writer
+# renames over their targets) are skipped, as is any file that disappears
+# while the directory is being walked.
+def directory_signature(dpath):
+    sig = []
+    for root, dirs, files in os.walk(dpath):
+        for f in sorted(files):
+            if f == JSONStorage.MANIFEST_FNAME or f.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(root, f))
+            except FileNotFoundError as e:
+                continue
+            sig.append((f, st.st_size, st.st_mtime_ns))
+    return tuple(sig)
+
+# Returns True if the given file name is a budget class file. (Hidden files,
+# such as a period's manifest, are never class files.)
+def is_class_file(fname):
+    return fname.lower().endswith(".json") and "config" not in fname.lower() and \
+           not fname.startswith(".")
+
+# Takes in a function and a list of items, and returns a list of the results
+# of calling the function on each item. Calls are spread across a pool of
+# threads (class files are read and parsed this way).
+def parallel_map(func, items):
+    items = list(items)
+    if len(items) <= 1:
+        return [func(i) for i in items]
+    with ThreadPoolExecutor(max_workers=min(LOAD_THREADS, len(items))) as pool:
+        return list(pool.map(func, items))
+
+# Takes in a Config object and returns the storage object for its save
+# location (or, if 'backup' is set, its backup location). The backend is taken
+# from the config, unless one is given. Storage objects are shared by every
+# caller using the same location (and durability settings).
+def make_storage(conf, backup=False, backend=None):
+    backend = conf.storage if backend == None else backend
+    assert backend in STORAGE_BACKENDS, \
+           "storage backend must be one of: %s" % STORAGE_BACKENDS
+    location = conf.backup_location if backup else conf.save_location
+    key = (backend, os.path.realpath(location), conf.durability, conf.durability_window_ms,
+           conf.storage_pretty)
+    with storage_cache_lock:
+        s = storage_cache.get(key, None)
+        if s == None:
+            if backend == "sqlite":
+                s = SQLiteStorage(os.path.join(location, SQLiteStorage.DB_FNAME),
+                                  durability=conf.durability)
+            else:
+                s = JSONStorage(location, get_writer(conf.durability,
+                                                     conf.durability_window_ms / 1000.0),
+                                pretty=conf.storage_pretty)
+            storage_cache[key] = s
+        return s
+
+
+# ============================ Storage Interface ============================= #
+# The interface every storage backend implements. Each method takes the name
+# of the reset period to operate on. A backend must implement every abstract
+# method before it can be created.
+class BudgetStorage(ABC):
+    # Returns a list of the names of every period in storage, oldest first.
+    @abstractmethod
+    def periods(self):
+        pass
+
+    # Loads and returns a list of the BudgetClass objects in the given period,
+    # using the given history container type.
+    @abstractmethod
+    def load(self, name, history_type=TransactionHistory):
+        pass
+
+    # Returns a list of the BudgetClass objects in the given period, like
+    # 'load()', except each class's history may be deferred (see
+    # 'BudgetClass.defer()') and only loaded when it's first accessed. By
+    # default, every class is loaded in full.
+    def manifest(self, name, history_type=TransactionHistory):
+        return self.load(name, history_type=history_type)
+
+    # Returns a value that changes whenever the given period's contents change
+    # (by this process or any other).
+    @abstractmethod
+    def signature(self, name):
+        pass
+
+    # Returns True if the given class is stored in the given period.
+    @abstractmethod
+    def has_class(self, name, bclass):
+        pass
+
+    # Writes out the entire class (replacing any stored version of it).
+    @abstractmethod
+    def save_class(self, name, bclass):
+        pass
+
+    # Records the addition ('op' = "add") or removal ('op' = "remove") of a
+    # single transaction to or from the given class.
+    @abstractmethod
+    def append(self, name, bclass, op, transaction):
+        pass
+
+    # Deletes the given class (and its transactions) from the given period.
+    @abstractmethod
+    def delete_class(self, name, bclass):
+        pass
+
+    # Returns a context manager that groups the writes made within it, so they
+    # can be made durable together.
+    def batch(self):
+        return nullcontext()
+
+
+# =============================== JSON Storage =============================== #
+# The original storage layout: within the location, each period has a
+# directory named after it, holding one JSON file (and journal) per class.
+# Files are written through a FileWriter (see lib/fileio.py).
+#
+# Each period's directory also holds a manifest: every class file's class
+# (without its history), along with the file's inode, size, and modification
+# time. The manifest lets a period's classes be listed without parsing their
+# files; an entry whose file has changed is ignored (and rewritten).
+class JSONStorage(BudgetStorage):
+    MANIFEST_FNAME = ".manifest.json"
+
+    # Constructor. Takes in the path to the storage location, the FileWriter
+    # to write with, and whether or not class files are indented.
+    def __init__(self, location, writer=None, pretty=False):
+        self.location = location
+        self.writer = get_writer() if writer == None else writer
+        self.pretty = pretty
+        self.dpaths = set()     # directories known to exist
+
+    # Returns the path to the given period's directory, creating it if it
+    # doesn't exist.
+    def period_dir(self, name):
+        dpath = os.path.join(self.location, name)
+        if dpath in self.dpaths:
+            return dpath
+        assert not os.path.isfile(dpath), "save root path is a file: %s" % dpath
+        if not os.path.isdir(dpath):
+            os.mkdir(dpath)
+        self.dpaths.add(dpath)
+        return dpath
+
+    # Returns the path to the given class's file within the given period.
+    def class_path(self, name, bclass):
+        return os.path.join(self.period_dir(name), bclass.to_file_name())
+
+    # Lists the period directories within the location.
+    def periods(self):
+        names = []
+        for f in os.listdir(self.location):
+            if period_start(f) != None and os.path.isdir(os.path.join(self.location, f)):
+                names.append(f)
+        return sorted(names, key=period_start)
+
+    # Returns the paths of every class file within the period's directory.
+    def class_files(self, name):
+        fpaths = []
+        for root, dirs, files in os.walk(os.path.join(self.location, name)):
+            for f in sorted(files):
+                if is_class_file(f):
+                    fpaths.append(os.path.join(root, f))
+        return fpaths
+
+    # Loads every class file within the period's directory (in parallel).
+    def load(self, name, history_type=TransactionHistory):
+        return parallel_map(lambda fpath: BudgetClass.load(fpath, history_type=history_type),
+                            self.class_files(name))
+
+    # Builds each class from its manifest entry, deferring its history. Files
+    # without an up-to-date entry are loaded in full (in parallel), and the
+    # manifest is rewritten with their new entries.
+    def manifest(self, name, history_type=TransactionHistory):
+        dpath = os.path.join(self.location, name)
+        mpath = os.path.join(dpath, JSONStorage.MANIFEST_FNAME)
+        old = {}
+        try:
+            fp = open(mpath, "r")
+            old = decode(fp.read())
+            fp.close()
+        except Exception as e:
+            pass
+
+        # use each file's entry if its file hasn't changed since
+        classes = []
+        entries = {}
+        stale = []                  # [index, key, path, stamp] of each stale file
+        for fpath in self.class_files(name):
+            key = os.path.relpath(fpath, dpath)
+            st = os.stat(fpath)
+            stamp = [st.st_ino, st.st_size, st.st_mtime_ns]
+            entry = old.get(key, None)
+            if entry == None or entry["stamp"] != stamp:
+                stale.append([len(classes), key, fpath, stamp])
+                classes.append(None)
+                continue
+            jdata = dict(entry["class"])
+            jdata["history"] = []
+            bc = BudgetClass.from_json(jdata, history_type=history_type)
+            bc.defer(JSONStorage.history_loader(fpath, history_type))
+            classes.append(bc)
+            entries[key] = entry
+
+        # load the stale files, then update the manifest (it only speeds up
+        # loading, so failing to write it isn't an error)
+        loaded = parallel_map(lambda st: BudgetClass.load(st[2], history_type=history_type),
+                              stale)
+        for (st, bc) in zip(stale, loaded):
+            classes[st[0]] = bc
+            entries[st[1]] = {"stamp": st[3], "class": bc.to_json(fields=MANIFEST_FIELDS)}
+        if len(stale) > 0 or len(entries) != len(old):
+            try:
+                self.writer.write(mpath, encode(entries))
+            except Exception as e:
+                pass
+        return classes
+
+    # Takes in a class file path and returns a function that loads the class's
+    # history from it (for 'BudgetClass.defer()').
+    @staticmethod
+    def history_loader(fpath, history_type):
+        def load(bclass):
+            c = BudgetClass.load(fpath, history_type=history_type)
+            bclass.journal_counts.update(c.journal_counts)
+            return c.history
+        return load
+
+    # Returns the signature of the period's directory.
+    def signature(self, name):
+        return directory_signature(os.path.join(self.location, name))
+
+    # Checks for the class's file.
+    def has_class(self, name, bclass):
+        return os.path.isfile(self.class_path(name, bclass))
+
+    # Writes out the class's file.
+    def save_class(self, name, bclass):
+        bclass.save(self.class_path(name, bclass), writer=self.writer, pretty=self.pretty)
+
+    # Appends the operation to the class's journal.
+    def append(self, name, bclass, op, transaction):
+        bclass.journal_append(self.class_path(name, bclass), op, transaction,
+                              writer=self.writer, pretty=self.pretty)
+
+    # Deletes the class's file (and its journal).
+    def delete_class(self, name, bclass):
+        fpath = self.class_path(name, bclass)
+        with self.writer.lock(fpath):
+            assert os.path.isfile(fpath), "class file not found: %s" % fpath
+            self.writer.remove(fpath)
+            self.writer.remove(BudgetClass.journal_path(fpath))
+
+    # Defers the flushes of every write within the batch until it ends.
+    def batch(self):
+        return self.writer.batch()
+
+
+# ============================== SQLite Storage ============================== #
+# Stores everything in a single SQLite database (in write-ahead-log mode). In
+# "always" durability mode every commit is flushed to disk; in "batched" mode,
+# commits are flushed when SQLite checkpoints its log.
+# Every write bumps its period's version number, which serves as the period's
+# signature. Connections are kept in a small pool shared by every thread;
+# statements are written with parameters, so each one is prepared once and
+# reused from the connection's statement cache.
+class SQLiteStorage(BudgetStorage):
+    DB_FNAME = "budget.sqlite3"
+    POOL_SIZE = 8                   # idle connections kept open
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS periods ("
+        "    name TEXT PRIMARY KEY,"
+        "    start REAL NOT NULL,"
+        "    version INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS periods_start ON periods (start)",
+        "CREATE TABLE IF NOT EXISTS classes ("
+        "    period TEXT NOT NULL,"
+        "    id TEXT NOT NULL,"
+        "    name TEXT NOT NULL,"
+        "    type TEXT NOT NULL,"
+        "    description TEXT NOT NULL,"
+        "    keywords TEXT NOT NULL,"
+        "    target TEXT,"
+        "    PRIMARY KEY (period, id))",
+        "CREATE TABLE IF NOT EXISTS transactions ("
+        "    seq INTEGER PRIMARY KEY,"
+        "    period TEXT NOT NULL,"
+        "    class_id TEXT NOT NULL,"
+        "    id TEXT NOT NULL,"
+        "    price REAL NOT NULL,"
+        "    vendor TEXT NOT NULL,"
+        "    description TEXT NOT NULL,"
+        "    timestamp REAL NOT NULL,"
+        "    recurring INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS transactions_id ON transactions (period, class_id, id)",
+        "CREATE INDEX IF NOT EXISTS transactions_time ON transactions (period, class_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS transactions_vendor ON transactions (vendor)"
+    ]
+
+    # Constructor. Takes in the path to the database file and the durability
+    # mode. The database is set up once, here: write-ahead logging is a
+    # setting of the file itself, and the tables only need to be created once.
+    def __init__(self, fpath, durability="batched"):
+        self.fpath = fpath
+        self.synchronous = "FULL" if durability == "always" else "NORMAL"
+        self.pool = []                      # idle connections
+        self.pool_lock = threading.Lock()
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for stmt in SQLiteStorage.SCHEMA:
+                    conn.execute(stmt)
+
+    # Opens and returns a new connection to the database. (The synchronous
+    # setting only applies to the connection it's made on.)
+    def open(self):
+        conn = sqlite3.connect(self.fpath, timeout=30.0, cached_statements=256,
+                               check_same_thread=False)
+        conn.execute("PRAGMA synchronous=%s" % self.synchronous)
+        return conn
+
+    # Context manager that takes a connection out of the pool (opening a new
+    # one if none are idle) and puts it back afterwards. Only 'POOL_SIZE'
+    # idle connections are kept; any others are closed.
+    @contextmanager
+    def connection(self):
+        with self.pool_lock:
+            conn = self.pool.pop() if len(self.pool) > 0 else None
+        if conn == None:
+            conn = self.open()
+        try:
+            yield conn
+        finally:
+            with self.pool_lock:
+                if len(self.pool) < SQLiteStorage.POOL_SIZE:
+                    self.pool.append(conn)
+                    conn = None
+            if conn != None:
+                conn.close()
+
+    # Makes sure the given period has a row, then bumps its version. Must be
+    # called within a transaction.
+    @staticmethod
+    def touch(conn, name):
+        conn.execute("INSERT OR IGNORE INTO periods (name, start) VALUES (?, ?)",
+                     (name, period_start(name).timestamp()))
+        conn.execute("UPDATE periods SET version = version + 1 WHERE name = ?", (name,))
+
+    # Converts a transaction to a row for the transactions table.
+    @staticmethod
+    def transaction_row(name, bclass, t):
+        return (name, bclass.bcid, t.tid, t.price, t.vendor, t.desc,
+                t.timestamp.timestamp(), 1 if t.recurring else 0)
+
+    # Lists the periods table, ordered by start date.
+    def periods(self):
+        with self.connection() as conn:
+            rows = conn.execute("SELECT name FROM periods ORDER BY start")
+            return [r[0] for r in rows]
+
+    # Returns a list of the JSON of each class in the period (with an empty
+    # history), in the order they were added.
+    def class_rows(self, name):
+        classes = []
+        with self.connection() as conn:
+            for r in conn.execute("SELECT id, name, type, description, keywords, "
+                                  "target FROM classes WHERE period = ? ORDER BY rowid",
+                                  (name,)):
+                jdata = {"id": r[0], "name": r[1], "type": r[2], "description": r[3],
+                         "keywords": json.loads(r[4]), "history": []}
+                if r[5] != None:
+                    jdata["target"] = json.loads(r[5])
+                classes.append(jdata)
+        return classes
+
+    # Builds each class in the period from its rows.
+    def load(self, name, history_type=TransactionHistory):
+        classes = self.class_rows(name)
+        cdata = {jdata["id"]: jdata for jdata in classes}
+
+        # add each transaction to its class's history, most recent first (and
+        # in insertion order among equal timestamps, like the JSON files)
+        with self.connection() as conn:
+            for r in conn.execute("SELECT class_id, id, price, vendor, description, "
+                                  "timestamp, recurring FROM transactions WHERE period = ? "
+                                  "ORDER BY class_id, timestamp DESC, seq", (name,)):
+                jdata = cdata.get(r[0], None)
+                if jdata != None:
+                    jdata["history"].append({"id": r[1], "price": r[2], "vendor": r[3],
+                                             "description": r[4], "timestamp": r[5],
+                                             "recurring": r[6] == 1})
+        return [BudgetClass.from_json(jdata, history_type=history_type) for jdata in classes]
+
+    # Builds each class from its row, deferring its history (which is only
+    # queried when it's accessed).
+    def manifest(self, name, history_type=TransactionHistory):
+        classes = []
+        for jdata in self.class_rows(name):
+            bc = BudgetClass.from_json(jdata, history_type=history_type)
+            bc.defer(self.history_loader(name, bc.bcid, history_type))
+            classes.append(bc)
+        return classes
+
+    # Takes in a period name and a class ID and returns a function that loads
+    # the class's history from its transaction rows (for 'BudgetClass.defer()').
+    def history_loader(self, name, bcid, history_type):
+        def load(bclass):
+            with self.connection() as conn:
+                rows = conn.execute("SELECT id, price, vendor, description, timestamp, "
+                                    "recurring FROM transactions WHERE period = ? AND "
+                                    "class_id = ? ORDER BY timestamp DESC, seq",
+                                    (name, bcid))
+                return history_type(Transaction.from_json({"id": r[0], "price": r[1],
+                                                           "vendor": r[2], "description": r[3],
+                                                           "timestamp": r[4],
+                                                           "recurring": r[5] == 1})
+                                    for r in rows)
+        return load
+
+    # Returns the period's version number.
+    def signature(self, name):
+        with self.connection() as conn:
+            row = conn.execute("SELECT version FROM periods WHERE name = ?",
+                               (name,)).fetchone()
+        return () if row == None else (row[0],)
+
+    # Checks for the class's row.
+    def has_class(self, name, bclass):
+        with self.connection() as conn:
+            row = conn.execute("SELECT 1 FROM classes WHERE period = ? AND id = ?",
+                               (name, bclass.bcid)).fetchone()
+        return row != None
+
+    # Replaces the class's row and all of its transaction rows.
+    def save_class(self, name, bclass):
+        jdata = bclass.to_json(fields=["name", "type", "description", "keywords", "target"])
+        target = None if "target" not in jdata else json.dumps(jdata["target"])
+        with self.connection() as conn, conn:
+            SQLiteStorage.touch(conn, name)
+            conn.execute("INSERT OR REPLACE INTO classes (period, id, name, type, "
+                         "description, keywords, target) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (name, bclass.bcid, bclass.name, jdata["type"], bclass.desc,
+                          json.dumps(bclass.keywords), target))
+            conn.execute("DELETE FROM transactions WHERE period = ? AND class_id = ?",
+                         (name, bclass.bcid))
+            conn.executemany("INSERT INTO transactions (period, class_id, id, "
+                             "price, vendor, description, timestamp, recurring) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (SQLiteStorage.transaction_row(name, bclass, t)
+                              for t in bclass.all()))
+
+    # Inserts or deletes the single transaction's row.
+    def append(self, name, bclass, op, transaction):
+        # if the class isn't stored yet, write the whole thing
+        if not self.has_class(name, bclass):
+            self.save_class(name, bclass)
+            return
+        with self.connection() as conn, conn:
+            SQLiteStorage.touch(conn, name)
+            if op == "add":
+                conn.execute("INSERT INTO transactions (period, class_id, id, "
+                             "price, vendor, description, timestamp, recurring) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             SQLiteStorage.transaction_row(name, bclass, transaction))
+            else:
+                # identical transactions share an ID, so only delete one row
+                conn.execute("DELETE FROM transactions WHERE seq = (SELECT seq "
+                             "FROM transactions WHERE period = ? AND class_id = ? "
+                             "AND id = ? LIMIT 1)",
+                             (name, bclass.bcid, transaction.tid))
+
+    # Deletes the class's row and all of its transaction rows.
+    def delete_class(self, name, bclass):
+        with self.connection() as conn, conn:
+            SQLiteStorage.touch(conn, name)
+            conn.execute("DELETE FROM classes WHERE period = ? AND id = ?",
+                         (name, bclass.bcid))
+            conn.execute("DELETE FROM transactions WHERE period = ? AND class_id = ?",
+                         (name, bclass.bcid))
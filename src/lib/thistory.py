@@ -0,0 +1,205 @@
+# This module defines the container used to hold a budget class's transaction
+# history. Transactions are kept sorted by timestamp as they're inserted, so
+# the history never needs to be re-sorted to be listed in order, and date
+# ranges can be found with a binary search.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import bisect
+from array import array
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+
+# ======================= Transaction History Container ====================== #
+# Holds transactions in ascending timestamp order, alongside a parallel list of
+# their timestamps (as floats) that's used for binary searches. Among
+# transactions with equal timestamps, the most recently inserted one comes
+# first; this way, the descending view lists equal transactions in the order
+# they were inserted (matching a stable sort of the insertion order).
+class TransactionHistory:
+    # Constructor. Takes in an optional iterable of transactions.
+    def __init__(self, transactions=[]):
+        # sort the reversed input, so equal timestamps end up in reverse
+        # insertion order (as they would if inserted one at a time)
+        ts = sorted(reversed(list(transactions)), key=lambda t: t.timestamp)
+        self.transactions = ts
+        self.keys = [t.timestamp.timestamp() for t in ts]
+        self.tids = {}                  # transaction ID --> [transactions]
+        for t in ts:
+            self.tids.setdefault(t.tid, []).append(t)
+
+    # Returns the number of transactions in the history.
+    def __len__(self):
+        return len(self.transactions)
+
+    # Iterates through the history in ascending timestamp order.
+    def __iter__(self):
+        return iter(self.transactions)
+
+    # Iterates through the history in descending timestamp order.
+    def __reversed__(self):
+        return reversed(self.transactions)
+
+    # Returns the transaction at the given index (in ascending order).
+    def __getitem__(self, idx):
+        return self.transactions[idx]
+
+    # Returns True if the given transaction object is in the history.
+    def __contains__(self, transaction):
+        return self.find(transaction) >= 0
+
+    # ------------------------------ Mutation -------------------------------- #
+    # Inserts a transaction at its sorted position.
+    def add(self, transaction):
+        key = transaction.timestamp.timestamp()
+        idx = bisect.bisect_left(self.keys, key)
+        self.keys.insert(idx, key)
+        self.transactions.insert(idx, transaction)
+        self.tids.setdefault(transaction.tid, []).append(transaction)
+
+    # Alias for 'add()', so the history can be used where a list was expected.
+    def append(self, transaction):
+        self.add(transaction)
+
+    # Takes in a list of transactions and inserts all of them, as if each one
+    # was passed to 'add()' in order. The history is sorted once, rather than
+    # inserting one transaction at a time.
+    def extend(self, transactions):
+        # the new transactions are newer than every existing one, so among
+        # equal timestamps they go first (in reverse order)
+        ts = list(reversed(transactions)) + self.transactions
+        ts.sort(key=lambda t: t.timestamp)
+        self.transactions = ts
+        self.keys = [t.timestamp.timestamp() for t in ts]
+        for t in transactions:
+            self.tids.setdefault(t.tid, []).append(t)
+
+    # Takes in a transaction object and returns its index within the history,
+    # or -1 if it isn't present. Objects are compared by identity.
+    def find(self, transaction):
+        # look within the range of equal timestamps first
+        key = transaction.timestamp.timestamp()
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key)
+        for idx in range(lo, hi):
+            if self.transactions[idx] is transaction:
+                return idx
+        # the transaction's timestamp may have been modified since it was
+        # inserted, so fall back to a full search
+        for idx in range(len(self.transactions)):
+            if self.transactions[idx] is transaction:
+                return idx
+        return -1
+
+    # Removes the given transaction object. Returns True if it was found and
+    # removed, and False otherwise.
+    def remove(self, transaction):
+        idx = self.find(transaction)
+        if idx < 0:
+            return False
+        self.keys.pop(idx)
+        self.transactions.pop(idx)
+        # identical transactions share an ID, so only drop this one from the
+        # ID's entries
+        entries = self.tids.get(transaction.tid, [])
+        for i in range(len(entries)):
+            if entries[i] is transaction:
+                entries.pop(i)
+                break
+        if len(entries) == 0:
+            self.tids.pop(transaction.tid, None)
+        return True
+
+    # Re-sorts the history. This must be invoked if transactions' timestamps
+    # are modified while they're in the history.
+    def resort(self):
+        self.__init__(reversed(self.transactions))
+
+    # Sets the 'owner' field of every transaction in the history.
+    def adopt(self, owner):
+        for t in self.transactions:
+            t.owner = owner
+
+    # ------------------------------- Queries -------------------------------- #
+    # Takes in a transaction ID and returns the matching transaction, or None.
+    # If several identical transactions share the ID, the earliest-inserted
+    # one is returned.
+    def get(self, tid):
+        entries = self.tids.get(tid, None)
+        return entries[0] if entries else None
+
+    # Takes in a transaction ID and returns the number of transactions in the
+    # history that share it.
+    def count(self, tid):
+        return len(self.tids.get(tid, []))
+
+    # Returns an iterable of all transaction IDs in the history.
+    def ids(self):
+        return self.tids.keys()
+
+    # Returns a read-only view of the history in descending timestamp order
+    # (most recent first). The view doesn't copy the history.
+    def descending(self):
+        return TransactionHistoryView(self.transactions, reverse=True)
+
+    # Returns a read-only view of the history in ascending timestamp order.
+    def ascending(self):
+        return TransactionHistoryView(self.transactions)
+
+    # Returns an array of the prices of every transaction in the history.
+    def price_column(self):
+        return array("d", [t.price for t in self.transactions])
+
+    # Takes in a start and end datetime and returns a view of all transactions
+    # with timestamps in the range [start, end). Either bound may be None to
+    # leave that side of the range open.
+    def range(self, start=None, end=None, reverse=False):
+        lo = 0 if start == None else bisect.bisect_left(self.keys, start.timestamp())
+        hi = len(self.keys) if end == None else bisect.bisect_left(self.keys, end.timestamp())
+        return TransactionHistoryView(self.transactions, lo=lo, hi=max(lo, hi),
+                                      reverse=reverse)
+
+
+# ========================= Transaction History View ========================= #
+# A read-only window into a slice of a TransactionHistory, in either direction.
+# Supports iteration, indexing, and len() without copying the underlying list.
+class TransactionHistoryView:
+    # Constructor. Takes in the underlying list, the slice bounds, and whether
+    # or not the view runs in reverse.
+    def __init__(self, transactions, lo=0, hi=None, reverse=False):
+        self.transactions = transactions
+        self.lo = lo
+        self.hi = len(transactions) if hi == None else hi
+        self.reverse = reverse
+
+    # Returns the number of transactions in the view.
+    def __len__(self):
+        return self.hi - self.lo
+
+    # Iterates through the view.
+    def __iter__(self):
+        if self.reverse:
+            for idx in range(self.hi - 1, self.lo - 1, -1):
+                yield self.transactions[idx]
+        else:
+            for idx in range(self.lo, self.hi):
+                yield self.transactions[idx]
+
+    # Returns the transaction at the given index within the view.
+    def __getitem__(self, idx):
+        vlen = self.hi - self.lo
+        if idx < 0:
+            idx += vlen
+        if idx < 0 or idx >= vlen:
+            raise IndexError("transaction history view index out of range")
+        if self.reverse:
+            return self.transactions[self.hi - 1 - idx]
+        return self.transactions[self.lo + idx]
@@ -0,0 +1,40 @@
+# This module lets the library report how long its phases of work take (such
+# as loading a budget's classes, or saving them) to whoever is interested.
+# Callers (such as the server's metrics) add a function to 'timing_hooks'; it
+# is invoked with the name of each phase and the number of seconds it took.
+# With no hooks, reporting a phase costs next to nothing.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Globals
+timing_hooks = []                   # functions taking (phase, seconds)
+
+
+# ================================= Timing =================================== #
+# Takes in the name of a phase and the number of seconds it took, and passes
+# them to every timing hook.
+def timing_report(phase, seconds):
+    for hook in timing_hooks:
+        hook(phase, seconds)
+
+# Context manager that times the code within it and reports it as the given
+# phase.
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing_report(phase, time.perf_counter() - start)
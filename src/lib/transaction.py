@@ -15,7 +15,14 @@ dpath = os.path.dirname(dpath)                      # parent directory
 if dpath not in sys.path:                           # add to path
         sys.path.append(dpath)
 
+# Local imports
+from lib.codec import Schema
+
 class Transaction:
+    # Transactions are by far the most numerous objects in a budget, so they
+    # don't carry a per-instance __dict__.
+    __slots__ = ("price", "vendor", "desc", "timestamp", "recurring", "owner", "tid")
+
     # Takes in the vendor of the transaction, the price (absolute value), and
     # one or two more optional fields.
     def __init__(self, price, vendor="", description="", timestamp=datetime.now(),
@@ -62,28 +69,31 @@ class Transaction:
         }
         return jdata
     
-    # Used to create a Transaction object from raw JSON data.
+    # The fields expected in a transaction's JSON.
+    JSON_SCHEMA = Schema([
+        ["id", str, "each transaction JSON must have a unique \"id\" string."],
+        ["price", float, "each transaction JSON must have a \"price\" float."],
+        ["vendor", str, "each transaction JSON must have a \"vendor\" string."],
+        ["description", str, "each transaction JSON must have a \"description\" string."],
+        ["timestamp", float, "each transaction JSON must have a \"timestamp\" float."],
+        ["recurring", bool, "each transaction JSON must have a \"recurring\" boolean."]
+    ])
+
+    # Used to create a Transaction object from raw JSON data. Transactions are
+    # decoded by the thousands when a class is loaded, so once the JSON is
+    # validated, the object's fields are set directly (the JSON always has an
+    # ID, so there's nothing for the constructor to compute).
     @staticmethod
     def from_json(jdata):
-        # build a list of expected JSON fields and assert they exist
-        expected = [
-            ["id", str, "each transaction JSON must have a unique \"id\" string."],
-            ["price", float, "each transaction JSON must have a \"price\" float."],
-            ["vendor", str, "each transaction JSON must have a \"vendor\" string."],
-            ["description", str, "each transaction JSON must have a \"description\" list."],
-            ["timestamp", float, "each transaction JSON must have a \"timestamp\" float."],
-            ["recurring", bool, "each transaction JSON must have a \"recurring\" boolean."]
-        ]
-        for f in expected:
-            assert f[0] in jdata and type(jdata[f[0]]) == f[1], f[2]
-
-        # attempt to parse the timestamp
-        ts = datetime.fromtimestamp(jdata["timestamp"])
-            
-        # create the object
-        t = Transaction(jdata["price"], vendor=jdata["vendor"],
-                        description=jdata["description"], timestamp=ts,
-                        tid=jdata["id"], recur=jdata["recurring"])
+        Transaction.JSON_SCHEMA.check(jdata)
+        t = Transaction.__new__(Transaction)
+        t.price = jdata["price"]
+        t.vendor = jdata["vendor"]
+        t.desc = jdata["description"]
+        t.timestamp = datetime.fromtimestamp(jdata["timestamp"])
+        t.recurring = jdata["recurring"]
+        t.owner = None
+        t.tid = jdata["id"]
         return t
     
     # ------------------------------ Operations ------------------------------ #
@@ -0,0 +1,371 @@
+# This module defines a columnar container for a budget class's transaction
+# history. Rather than holding one Python object per transaction, it keeps
+# parallel arrays of prices and timestamps (plus lists of interned strings),
+# and only creates lightweight row objects when a transaction is accessed.
+# It's a drop-in alternative to the TransactionHistory container for budgets
+# that load large histories.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import weakref
+from array import array
+from datetime import datetime
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Local imports
+from lib.transaction import Transaction
+from lib.thistory import TransactionHistoryView
+
+
+# ================================= Helpers ================================== #
+# Transaction IDs are usually 64-character hex strings (SHA-256 digests). These
+# are stored as 32 raw bytes when possible, and as-is otherwise.
+def tid_pack(tid):
+    if len(tid) == 64:
+        try:
+            return bytes.fromhex(tid)
+        except ValueError as e:
+            pass
+    return tid
+
+# Reverses 'tid_pack()'.
+def tid_unpack(packed):
+    if type(packed) == bytes:
+        return packed.hex()
+    return packed
+
+
+# ============================= Transaction Row ============================== #
+# A proxy object for a single row in a TransactionTable. It behaves like a
+# Transaction: reads and writes of its fields go straight to the table's
+# columns. If its row is removed from the table, the proxy keeps a copy of the
+# row's values so it can still be used (for example, to re-add it elsewhere).
+class TransactionRow:
+    __slots__ = ("table", "slot", "values", "__weakref__")
+
+    # Constructor. Takes in the table and the slot number of the row.
+    def __init__(self, table, slot):
+        self.table = table
+        self.slot = slot
+        self.values = None
+
+    # Invoked when the row is removed from the table. Copies the row's values
+    # into the proxy and disconnects it from the table.
+    def detach(self):
+        t = self.table
+        self.values = {
+            "price": t.prices[self.slot],
+            "vendor": t.vendors[self.slot],
+            "desc": t.descs[self.slot],
+            "timestamp": datetime.fromtimestamp(t.keys[self.slot]),
+            "recurring": t.recurring[self.slot] == 1,
+            "tid": tid_unpack(t.tids[self.slot]),
+            "owner": None
+        }
+        self.table = None
+
+    # Reads a field, either from the table or from the detached copy.
+    def get_field(self, name):
+        if self.table == None:
+            return self.values[name]
+        t = self.table
+        if name == "price":
+            return t.prices[self.slot]
+        elif name == "vendor":
+            return t.vendors[self.slot]
+        elif name == "desc":
+            return t.descs[self.slot]
+        elif name == "timestamp":
+            return datetime.fromtimestamp(t.keys[self.slot])
+        elif name == "recurring":
+            return t.recurring[self.slot] == 1
+        elif name == "tid":
+            return tid_unpack(t.tids[self.slot])
+        return t.owner
+
+    # Writes a field, either to the table or to the detached copy.
+    def set_field(self, name, value):
+        if self.table == None:
+            self.values[name] = value
+            return
+        t = self.table
+        if name == "price":
+            t.prices[self.slot] = value
+        elif name == "vendor":
+            t.vendors[self.slot] = sys.intern(value)
+        elif name == "desc":
+            t.descs[self.slot] = value
+        elif name == "timestamp":
+            t.keys[self.slot] = value.timestamp()
+        elif name == "recurring":
+            t.recurring[self.slot] = 1 if value else 0
+        elif name == "tid":
+            t.tids[self.slot] = tid_pack(value)
+        # the owner of a row is always the table's owner, so it can't be
+        # changed while the row is attached
+
+    # Field properties, so the row can be used anywhere a Transaction is.
+    price = property(lambda self: self.get_field("price"),
+                     lambda self, v: self.set_field("price", v))
+    vendor = property(lambda self: self.get_field("vendor"),
+                      lambda self, v: self.set_field("vendor", v))
+    desc = property(lambda self: self.get_field("desc"),
+                    lambda self, v: self.set_field("desc", v))
+    timestamp = property(lambda self: self.get_field("timestamp"),
+                         lambda self, v: self.set_field("timestamp", v))
+    recurring = property(lambda self: self.get_field("recurring"),
+                         lambda self, v: self.set_field("recurring", v))
+    tid = property(lambda self: self.get_field("tid"),
+                   lambda self, v: self.set_field("tid", v))
+    owner = property(lambda self: self.get_field("owner"),
+                     lambda self, v: self.set_field("owner", v))
+
+    # Borrow the rest of the Transaction interface.
+    __str__ = Transaction.__str__
+    to_date_string = Transaction.to_date_string
+    to_dollar_string = Transaction.to_dollar_string
+    to_json = Transaction.to_json
+    match_id = Transaction.match_id
+    match = Transaction.match
+
+
+# ============================ Transaction Table ============================= #
+# Columnar transaction storage. Each transaction occupies a "slot" across the
+# column arrays; slots of removed transactions are reused. A separate array of
+# slot numbers holds the rows in ascending timestamp order (with the same tie
+# ordering as TransactionHistory), so the table supports the same views and
+# range queries.
+class TransactionTable:
+    # Constructor. Takes in an optional iterable of transactions (or anything
+    # that looks like one). The iterable is consumed one item at a time, so a
+    # generator can be used to avoid creating every object up front.
+    def __init__(self, transactions=[]):
+        self.owner = None
+        self.prices = array("d")        # transaction prices
+        self.keys = array("d")          # transaction timestamps (epoch seconds)
+        self.recurring = bytearray()    # recurring flags (0 or 1)
+        self.vendors = []               # interned vendor strings
+        self.descs = []                 # description strings
+        self.tids = []                  # packed transaction IDs
+        self.slots = {}                 # packed transaction ID --> [slots]
+        self.free = []                  # unused slots
+        self.proxies = weakref.WeakValueDictionary() # slot --> live row object
+        for t in transactions:
+            self.put(t)
+
+        # put the slots in order. The reversed input is sorted so that equal
+        # timestamps end up in reverse insertion order
+        count = len(self.keys)
+        self.order = array("l", sorted(range(count - 1, -1, -1),
+                                       key=self.keys.__getitem__))
+        self.rows = TransactionTableRows(self)
+
+    # Returns the number of transactions in the table.
+    def __len__(self):
+        return len(self.order)
+
+    # Iterates through the table in ascending timestamp order.
+    def __iter__(self):
+        for slot in self.order:
+            yield self.row(slot)
+
+    # Iterates through the table in descending timestamp order.
+    def __reversed__(self):
+        for idx in range(len(self.order) - 1, -1, -1):
+            yield self.row(self.order[idx])
+
+    # Returns the transaction at the given index (in ascending order).
+    def __getitem__(self, idx):
+        return self.row(self.order[idx])
+
+    # Returns True if the given transaction is in the table.
+    def __contains__(self, transaction):
+        return tid_pack(transaction.tid) in self.slots
+
+    # Returns the row object for the given slot, creating one if necessary.
+    def row(self, slot):
+        r = self.proxies.get(slot, None)
+        if r == None:
+            r = TransactionRow(self, slot)
+            self.proxies[slot] = r
+        return r
+
+    # ------------------------------ Mutation -------------------------------- #
+    # Writes the given transaction's values into a free slot (without placing
+    # it in the timestamp order) and returns the slot number.
+    def put(self, transaction):
+        packed = tid_pack(transaction.tid)
+        price = transaction.price
+        vendor = sys.intern(transaction.vendor)
+        key = transaction.timestamp.timestamp()
+        recur = 1 if transaction.recurring else 0
+        if len(self.free) > 0:
+            slot = self.free.pop()
+            self.prices[slot] = price
+            self.keys[slot] = key
+            self.recurring[slot] = recur
+            self.vendors[slot] = vendor
+            self.descs[slot] = transaction.desc
+            self.tids[slot] = packed
+        else:
+            slot = len(self.keys)
+            self.prices.append(price)
+            self.keys.append(key)
+            self.recurring.append(recur)
+            self.vendors.append(vendor)
+            self.descs.append(transaction.desc)
+            self.tids.append(packed)
+        self.slots.setdefault(packed, []).append(slot)
+        return slot
+
+    # Returns the first position in the timestamp order whose timestamp is
+    # greater than or equal to (or, if 'right' is set, strictly greater than)
+    # the given key.
+    def bisect(self, key, right=False):
+        lo = 0
+        hi = len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self.keys[self.order[mid]]
+            if k < key or (right and k == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Copies a transaction into the table at its sorted position.
+    def add(self, transaction):
+        slot = self.put(transaction)
+        self.order.insert(self.bisect(self.keys[slot]), slot)
+
+    # Alias for 'add()', so the table can be used where a list was expected.
+    def append(self, transaction):
+        self.add(transaction)
+
+    # Takes in a list of transactions and copies all of them into the table,
+    # as if each one was passed to 'add()' in order. The timestamp order is
+    # sorted once, rather than inserting one slot at a time.
+    def extend(self, transactions):
+        slots = [self.put(t) for t in transactions]
+        slots.reverse()
+        slots.extend(self.order)
+        self.order = array("l", sorted(slots, key=self.keys.__getitem__))
+
+    # Removes the transaction with the same ID as the given one. Identical
+    # transactions share an ID, so if the given transaction is one of this
+    # table's rows, that exact row is removed; otherwise the earliest-inserted
+    # row with the ID is. Returns True if a row was found and removed, and
+    # False otherwise. Any live row object for the removed row keeps a copy of
+    # its values.
+    def remove(self, transaction):
+        packed = tid_pack(transaction.tid)
+        entries = self.slots.get(packed, None)
+        if entries == None:
+            return False
+        slot = entries[0]
+        if type(transaction) == TransactionRow and transaction.table is self:
+            if transaction.slot not in entries:
+                return False
+            slot = transaction.slot
+        entries.remove(slot)
+        if len(entries) == 0:
+            self.slots.pop(packed)
+        # look for the slot among the rows with an equal timestamp; if a row's
+        # timestamp was modified in place, fall back to a full search
+        pos = -1
+        lo = self.bisect(self.keys[slot])
+        hi = self.bisect(self.keys[slot], right=True)
+        for idx in range(lo, hi):
+            if self.order[idx] == slot:
+                pos = idx
+                break
+        if pos < 0:
+            pos = self.order.index(slot)
+        self.order.pop(pos)
+
+        # detach any live row object, then free the slot. The freed slot's
+        # price is zeroed, so the price column can be summed as-is
+        r = self.proxies.pop(slot, None)
+        if r != None:
+            r.detach()
+        self.prices[slot] = 0.0
+        self.vendors[slot] = ""
+        self.descs[slot] = ""
+        self.tids[slot] = None
+        self.free.append(slot)
+        return True
+
+    # Re-sorts the table. This must be invoked if timestamps are modified
+    # while the rows are in the table.
+    def resort(self):
+        self.order = array("l", sorted(reversed(self.order), key=self.keys.__getitem__))
+
+    # Sets the owner of every row in the table.
+    def adopt(self, owner):
+        self.owner = owner
+
+    # ------------------------------- Queries -------------------------------- #
+    # Takes in a transaction ID and returns the matching row, or None. If
+    # several identical rows share the ID, the earliest-inserted one is
+    # returned.
+    def get(self, tid):
+        entries = self.slots.get(tid_pack(tid), None)
+        if not entries:
+            return None
+        return self.row(entries[0])
+
+    # Takes in a transaction ID and returns the number of rows in the table
+    # that share it.
+    def count(self, tid):
+        return len(self.slots.get(tid_pack(tid), []))
+
+    # Returns an iterable of all transaction IDs in the table.
+    def ids(self):
+        return (tid_unpack(packed) for packed in self.slots)
+
+    # Returns a read-only view of the table in descending timestamp order
+    # (most recent first).
+    def descending(self):
+        return TransactionHistoryView(self.rows, reverse=True)
+
+    # Returns a read-only view of the table in ascending timestamp order.
+    def ascending(self):
+        return TransactionHistoryView(self.rows)
+
+    # Returns the table's price column. Unused slots hold a price of zero, so
+    # the column can be summed directly.
+    def price_column(self):
+        return self.prices
+
+    # Takes in a start and end datetime and returns a view of all transactions
+    # with timestamps in the range [start, end). Either bound may be None.
+    def range(self, start=None, end=None, reverse=False):
+        lo = 0 if start == None else self.bisect(start.timestamp())
+        hi = len(self.order) if end == None else self.bisect(end.timestamp())
+        return TransactionHistoryView(self.rows, lo=lo, hi=max(lo, hi),
+                                      reverse=reverse)
+
+
+# ========================== Transaction Table Rows ========================== #
+# Presents a TransactionTable's rows as a sequence (in timestamp order), so
+# TransactionHistoryView objects can be created on top of it.
+class TransactionTableRows:
+    # Constructor.
+    def __init__(self, table):
+        self.table = table
+
+    # Returns the number of rows.
+    def __len__(self):
+        return len(self.table.order)
+
+    # Returns the row at the given position in timestamp order.
+    def __getitem__(self, idx):
+        return self.table.row(self.table.order[idx])
@@ -8,11 +8,15 @@
 #   Connor Shugg
 
 # Includes and Flask setup
-from flask import Flask, request, Response, send_from_directory, session
+from flask import Flask, request, Response, send_from_directory, session, g
 import csv
 import json
+import itertools
 import os
 import sys
+import time
+import uuid
+import threading
 from datetime import datetime
 
 # Enable import from the parent directory
@@ -23,26 +27,45 @@ if dpath not in sys.path:                           # add to path
 
 # Local imports
 from server.auth import auth_check_login, auth_make_cookie, auth_check_cookie, \
-                        auth_cookie_name
+                        auth_check_bearer, auth_cookie_name, auth_cache_stats
 from server.log import log_write
 from server.users import User
 from server.notif import notif_send_email
+from server.metrics import RequestMetrics, metrics_start, metrics_add, metrics_phase, \
+                           metrics_begin, metrics_end, metrics_finish, METRICS_CONTENT_TYPE
 from lib.config import Config
 from lib.budget import Budget
+from lib.bcache import BudgetCache
+from lib.hstore import HistoryStore
+from lib.fileio import get_writer
 from lib.bclass import BudgetClass, BudgetClassType
 from lib.transaction import Transaction
 from lib.btarget import BudgetTarget
+from lib.importer import import_rows
+from lib.model import get_model
+from lib.timing import timing_hooks
+from lib.profiling import Profile, PROFILE_MODES
 
 # Flask setup
 app = Flask(__name__)
 config = None   # main server config
+bcache = None   # process-wide budget cache
+hstore = None   # process-wide store of all reset periods' histories
+metrics = RequestMetrics()  # per-endpoint request phase timings
+profiles = []               # reports of the most recently profiled requests
+profiles_lock = threading.Lock()
+profiling = threading.local()   # profile of the request each thread is handling
+STREAM_CHUNK_SIZE = 65536   # minimum size of each streamed response chunk
+PROFILE_KEEP = 16           # number of profiled requests' reports kept
 
 # ============================= Helper Functions ============================= #
-# Used to retrieve a fresh Budget object from the configuration path stored in
-# the server's config module.
+# Used to retrieve a Budget object from the configuration path stored in the
+# server's config module. Budgets are served out of the budget cache, so
+# concurrent requests share the same Budget object; its mutation methods take
+# the locks needed to keep concurrent writes from being lost.
 def get_budget(dt=datetime.now()):
-    conf = Config(config.sb_config_fpath, dt=dt)
-    return Budget(conf, dt=dt)
+    with metrics_phase("budget"):
+        return bcache.get(dt=dt)
 
 # Takes a dictionary of data and adds an optional message to it, then packs it
 # all into a Flask Response object.
@@ -61,10 +84,12 @@ def make_response_json(jdata={}, msg="", success=True, rstatus=200, rheaders={})
         alldata["success"] = success
     if jdata != {}:
         alldata["payload"] = jdata
-    resp = Response(response=json.dumps(alldata), status=rstatus)
+    with metrics_phase("serialize"):
+        resp = Response(response=json.dumps(alldata), status=rstatus)
     
-    # store the JSON data in the session for post-processing
-    session["response_jdata"] = alldata
+    # store a summary of the response in the session for post-processing
+    # (the payload is left out; the session is sent back as a cookie)
+    session["response_jdata"] = {"message": msg, "success": success}
     
     # set all given headers, as well as the content type
     for key in rheaders:
@@ -73,6 +98,60 @@ def make_response_json(jdata={}, msg="", success=True, rstatus=200, rheaders={})
     # return given completed response
     return resp
 
+# Takes in an iterable of strings that together form a JSON payload, and sends
+# it (wrapped like 'make_response_json()' would) as a streamed, chunked
+# response. The payload is encoded while it's being sent, so it's never held in
+# memory all at once. Small strings are combined into chunks of at least
+# STREAM_CHUNK_SIZE characters. Since the payload is encoded after the request
+# has otherwise finished, the time spent encoding it is recorded on its own
+# (as the endpoint's "stream" phase).
+def make_response_stream(chunks, msg="", success=True):
+    head = json.dumps({"message": msg, "success": success})
+    endpoint = get_endpoint()
+    timed = config.metrics_enabled
+    def generate():
+        yield head[:-1] + ", \"payload\": "
+        buf = []
+        size = 0
+        spent = 0.0
+        start = time.perf_counter()
+        for c in chunks:
+            buf.append(c)
+            size += len(c)
+            if size >= STREAM_CHUNK_SIZE:
+                spent += time.perf_counter() - start
+                yield "".join(buf)
+                start = time.perf_counter()
+                buf = []
+                size = 0
+        buf.append("}")
+        spent += time.perf_counter() - start
+        if timed:
+            metrics.observe(endpoint, "stream", spent)
+        yield "".join(buf)
+    resp = Response(response=generate(), status=200)
+
+    # store a summary of the response in the session for post-processing
+    session["response_jdata"] = {"message": msg, "success": success}
+    resp.headers["Content-Type"] = "application/json"
+    return resp
+
+# Generator that produces a JSON array from the given objects, encoding one
+# object at a time. Objects that can encode themselves in pieces (such as
+# budget classes, with their histories) are encoded that way.
+def iter_json_array(objs):
+    yield "["
+    sep = ""
+    for o in objs:
+        yield sep
+        if hasattr(o, "iter_json"):
+            for chunk in o.iter_json():
+                yield chunk
+        else:
+            yield json.dumps(o.to_json())
+        sep = ", "
+    yield "]"
+
 # Takes in a request's URL arguments and attempts to find an entry with the
 # given key value. Returns None on failure to find and the value on success.
 def get_url_parameter(args, key):
@@ -110,15 +189,24 @@ def parse_request_json(request):
     except Exception as e:
         return Exception("FAILURE: %s" % e)
 
-# References the pre-processed session field.
+# References the pre-processed request JSON data. (It's kept in the request's
+# context rather than the session: the session is sent back as a cookie, and
+# request bodies, such as bulk transaction creations, can be large.)
 def get_request_json():
-    return session["jdata"]
+    return g.jdata
 
 # Takes in a file path local to the server's root directory and appends it to
 # the path tot he root directory before passing it into send_file()
 def serve_file(fpath):
     return send_from_directory(config.server_root_dpath, fpath, etag=False)
 
+# Returns the endpoint (the URL rule, such as "/get/all") the current request
+# was routed to, or "unmatched" if it wasn't routed to one.
+def get_endpoint():
+    if request.url_rule == None:
+        return "unmatched"
+    return request.url_rule.rule
+
 # Takes in the given session and retrieves the user object. Returns None if one
 # isn't found or valid.
 def get_user(ses):
@@ -140,23 +228,123 @@ def check_notify(session):
     return "user_notify" in session and session["user_notify"]
 
 
+# ================================ Profiling ================================= #
+# Returns true if the given user is allowed to profile requests (and see the
+# reports). Nobody is, unless the server config sets 'profile_privilege'.
+def check_profile_privilege(user):
+    if config.profile_privilege == None:
+        return False
+    return user != None and user.privilege >= config.profile_privilege
+
+# Starts profiling the current request's handler if the user asked for it
+# (with an "X-SB-Profile" header, or a "profile" URL parameter, set to
+# "cpu" or "memory") and is allowed to. Only one request is profiled at a
+# time; a request that asks while another is being profiled is handled
+# normally (and its response's "X-SB-Profile" header is set to "busy").
+def profile_begin():
+    profiling.current = None
+    mode = request.headers.get("X-SB-Profile", None)
+    if mode == None:
+        mode = get_url_parameter(request.args, "profile")
+    if mode == None or mode not in PROFILE_MODES:
+        return
+    user = get_user(session)
+    if not check_profile_privilege(user):
+        return
+    prof = Profile(mode)
+    profiling.current = prof if prof.start(blocking=False) else "busy"
+
+# Stops profiling the current request, if it's being profiled, and keeps its
+# report (and, if the server config has a 'profile_dpath', dumps the raw
+# profile there). The report's ID is sent back in the given response's
+# "X-SB-Profile" header. (For streamed responses, only the work done before
+# the response starts streaming is profiled.)
+def profile_end(response=None):
+    prof = getattr(profiling, "current", None)
+    profiling.current = None
+    if prof == None:
+        return
+    if prof == "busy":
+        if response != None:
+            response.headers["X-SB-Profile"] = "busy"
+        return
+    prof.stop()
+
+    # build the report
+    user = get_user(session)
+    pid = uuid.uuid4().hex[:16]
+    jdata = {"id": pid, "endpoint": get_endpoint(),
+             "user": None if user == None else user.username,
+             "timestamp": datetime.now().timestamp()}
+    jdata.update(prof.to_json())
+    if config.profile_dpath != "":
+        try:
+            jdata["dump"] = prof.dump(config.profile_dpath, name=pid)
+        except Exception as e:
+            log_write("Failed to dump profile %s: %s" % (pid, e))
+    log_write("Profiled a request to %s (%s): %s." % (jdata["endpoint"], prof.mode, pid))
+
+    # keep the newest reports
+    with profiles_lock:
+        profiles.append(jdata)
+        del profiles[:-PROFILE_KEEP]
+    if response != None:
+        response.headers["X-SB-Profile"] = pid
+
+
 # ============================== Pre-Processing ============================== #
 @app.before_first_request
 def server_init():
     # retrieve the config from the app's config and set up the log
     global config
     config = app.config["server_config_obj"]
+    # set up the budget cache
+    global bcache
+    bcache = BudgetCache(config.sb_config_fpath)
+    # set up the history store (for queries across reset periods)
+    global hstore
+    hstore = HistoryStore(bcache.get_config(datetime.now()))
+    # attribute the library's timed phases (budget loads and saves, config
+    # parsing) to the requests that triggered them
+    if config.metrics_enabled and metrics_add not in timing_hooks:
+        timing_hooks.append(metrics_add)
+    # load (or train) the class suggestion model in the background, so it's
+    # never trained in the middle of a request
+    sbconf = bcache.get_config(datetime.now())
+    if sbconf.suggest_model:
+        threading.Thread(target=model_init, args=[sbconf], daemon=True).start()
+
+# Takes in a budget config and loads (or trains) its class suggestion model.
+# Failures are logged; the model is trained again when it's first needed.
+def model_init(sbconf):
+    try:
+        get_model(sbconf)
+    except Exception as e:
+        log_write("Failed to load the class suggestion model: %s" % e)
 
 # Invoked before an endpoint handler is called.
 # Resource: https://pythonise.com/series/learning-flask/python-before-after-request
 @app.before_request
 def pre_process():
+    if config.metrics_enabled:
+        metrics_start()
+    pre_process_request()
+    metrics_begin("handler")
+    profile_begin()
+
+# Helper function for 'pre_process()' that does the actual work.
+def pre_process_request():
     # extract JSON data, if any
-    jdata = parse_request_json(request)
-    session["jdata"] = jdata
+    with metrics_phase("parse"):
+        jdata = parse_request_json(request)
+    # (the data is kept out of the session, which is sent back as a cookie;
+    # a copy left in a cookie by an older server is dropped)
+    g.jdata = jdata
+    session.pop("jdata", None)
     
     # check for authentication
-    user = auth_check_cookie(request.headers.get("Cookie"))
+    with metrics_phase("auth"):
+        user = auth_check_cookie(request.headers.get("Cookie"))
     session["user"] = None if user == None else user.to_json()
     if user != None:
         log_write("User \"%s\" is making a request (privilege: %d)." %
@@ -171,13 +359,15 @@ def pre_process():
 
     # initialize the "notify" field
     if jdata != None:
-        update_notify(session, session["jdata"])
+        update_notify(session, jdata)
 
 
 # ============================= Post-Processing ============================== #
 # Used to post-process successful requests.
 @app.after_request
 def post_process(response):
+    profile_end(response)
+    metrics_end("handler")
     jdata = None
     if "response_jdata" in session:
         jdata = session["response_jdata"]
@@ -195,15 +385,22 @@ def post_process(response):
                 msg = "%s" % jdata["message"]
         # send the notification
         log_write("Notification requested. Sending message \"%s\" to %s." % (msg, user.email))
-        notif_send_email(user.email, msg, subject=sub)
+        with metrics_phase("notify"):
+            notif_send_email(user.email, msg, subject=sub)
+    if config.metrics_enabled:
+        metrics_finish(metrics, get_endpoint(), response.status_code)
     return response
 
 # Used to post-process failed requests. (Typically triggered when an exception
-# is thrown.)
+# is thrown.) A request that failed before it could be post-processed has its
+# timings recorded here.
 @app.teardown_request
 def post_process_error(error=None):
     if error != None:
         log_write("ERROR: %s" % error)
+    profile_end()
+    if config.metrics_enabled:
+        metrics_finish(metrics, get_endpoint(), 500)
 
 
 # ==================== Root and Authentication Endpoints ===================== #
@@ -269,17 +466,103 @@ def endpoint_auth_check():
 
 
 # ================================ Retrieval ================================= #
-# Used to retrieve ALL budget classes.
+# Helper function for the endpoints that return pages of class histories.
+# Looks for the optional "fields", "limit", "since", and "cursor" JSON fields
+# and returns them as [fields, limit, since, cursor] (with None for any that
+# weren't given). Returns None if any of them are invalid.
+def get_page_params(jdata):
+    params = [None, None, None, None]
+    if type(jdata) != dict:
+        return params
+    fields = jdata.get("fields", None)
+    if fields != None:
+        if type(fields) != list:
+            return None
+        for f in fields:
+            if f not in BudgetClass.JSON_FIELDS:
+                return None
+        params[0] = fields
+    limit = jdata.get("limit", None)
+    if limit != None:
+        if type(limit) != int or limit < 1:
+            return None
+        params[1] = limit
+    since = jdata.get("since", None)
+    if since != None:
+        if type(since) not in [int, float]:
+            return None
+        try:
+            params[2] = datetime.fromtimestamp(since)
+        except Exception as e:
+            return None
+    cursor = jdata.get("cursor", None)
+    if cursor != None:
+        if type(cursor) != str:
+            return None
+        try:
+            BudgetClass.cursor_parse(cursor)
+        except Exception as e:
+            return None
+        params[3] = cursor
+    return params
+
+# Used to retrieve ALL budget classes. Optionally takes in:
+#   - "fields": a list of the class fields to include (such as only the class
+#     metadata, with no "history")
+#   - "limit": the maximum number of transactions to include per class
+#   - "since": a timestamp; only transactions after it are included
+# If "limit" or "since" are given, each class's JSON has a "cursor" field that
+# can be passed to /get/history to retrieve the next page of transactions.
 @app.route("/get/all", methods = ["GET", "POST"])
 def endpoint_get_all():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+    params = get_page_params(get_request_json())
+    if params == None:
+        return make_response_json(success=False, msg="Invalid JSON fields.")
+
+    # invoke the API to retrieve *all* budget classes as a combined JSON
+    # object, which is streamed back as it's encoded
+    b = get_budget(dt=session["datetime"])
+    return make_response_stream(b.iter_json(fields=params[0], limit=params[1],
+                                            since=params[2]))
+
+# Used to retrieve a page of a budget class's transaction history, most recent
+# first. Expects a class ID, and optionally takes in "limit", "since", and a
+# "cursor" returned by a previous call (or by /get/all). The response holds the
+# transactions, and the cursor for the next page (null if there are no more).
+@app.route("/get/history", methods = ["POST"])
+def endpoint_get_history():
     user = get_user(session)
     if user == None:
         return make_response_json(rstatus=404)
 
-    # invoke the API to retrieve *all* budget classes as a combined JSON object
+    # extract the json data in the request body
+    jdata = get_request_json()
+    if type(jdata) == Exception:
+        return make_response_json(rstatus=400, msg="Failed to parse request body.")
+    elif jdata == None:
+        return make_response_json(rstatus=400, msg="Missing request body.")
+    if not check_json_fields(jdata, [["class_id", str]]):
+        return make_response_json(success=False, msg="Missing JSON fields.")
+    params = get_page_params(jdata)
+    if params == None:
+        return make_response_json(success=False, msg="Invalid JSON fields.")
+
+    # find the class and retrieve the page
     b = get_budget(dt=session["datetime"])
-    classes = b.to_json()
-    return make_response_json(jdata=classes)
+    result = b.get_class(jdata["class_id"])
+    if not result.success:
+        m = "Failed: %s" % result.message
+        return make_response_json(success=False, msg=m)
+    [ts, cursor] = result.data.page(cursor=params[3], limit=params[1],
+                                    since=params[2])
+    hdata = []
+    for t in ts:
+        hdata.append(t.to_json())
+    return make_response_json(jdata={"id": result.data.bcid, "history": hdata,
+                                     "cursor": cursor})
 
 # Helper function for the /get methods that takes in the ID field to expect in
 # the JSON request body.
@@ -353,6 +636,73 @@ def endpoint_get_savings():
         result.append(sc.to_json())
     return make_response_json(jdata=result)
 
+# Used to retrieve transactions across any number of reset periods, most
+# recent first. Optionally takes in:
+#   - "from" and "to": timestamps bounding the range [from, to)
+#   - "classes": a list of class IDs or names to include
+#   - "vendor": a string that must appear in each transaction's vendor
+#   - "limit": the maximum number of transactions to return
+# Each returned transaction also holds the ID and name of its class, and the
+# name of the reset period it was recorded in.
+@app.route("/get/range", methods = ["POST"])
+def endpoint_get_range():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+
+    # extract the json data in the request body
+    jdata = get_request_json()
+    if type(jdata) == Exception:
+        return make_response_json(rstatus=400, msg="Failed to parse request body.")
+    elif jdata == None:
+        jdata = {}
+
+    # check each of the optional fields
+    optional = [["from", [int, float]], ["to", [int, float]], ["classes", list],
+                ["vendor", str], ["limit", int]]
+    for o in optional:
+        if o[0] in jdata and jdata[o[0]] != None and \
+           not check_json_fields(jdata, [o]):
+            return make_response_json(success=False, msg="Invalid JSON fields.")
+    start = None
+    end = None
+    try:
+        if jdata.get("from", None) != None:
+            start = datetime.fromtimestamp(jdata["from"])
+        if jdata.get("to", None) != None:
+            end = datetime.fromtimestamp(jdata["to"])
+    except Exception as e:
+        return make_response_json(success=False, msg="Invalid JSON fields.")
+    classes = jdata.get("classes", None)
+    if classes != None:
+        for c in classes:
+            if type(c) != str:
+                return make_response_json(success=False, msg="Invalid JSON fields.")
+    limit = jdata.get("limit", None)
+    if limit != None and limit < 1:
+        return make_response_json(success=False, msg="Invalid JSON fields.")
+
+    # pick up any new periods, then stream back the matches
+    hstore.scan()
+    matches = hstore.iter_range(start=start, end=end, classes=classes,
+                                vendor=jdata.get("vendor", None))
+    if limit != None:
+        matches = itertools.islice(matches, limit)
+    return make_response_stream(iter_json_array(matches))
+
+# Used to retrieve the budget's aggregate numbers: each class's total and
+# target, income and expense totals, the surplus, and each savings category's
+# share of the surplus.
+@app.route("/get/summary", methods = ["GET", "POST"])
+def endpoint_get_summary():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+
+    # compute the summary and return it
+    b = get_budget(dt=session["datetime"])
+    return make_response_json(jdata=b.summarize().to_json())
+
 # Used to build and return an Excel spreadsheet version of the budget.
 @app.route("/get/spreadsheet", methods = ["GET", "POST"])
 def endpoint_get_spreadsheet():
@@ -369,6 +719,62 @@ def endpoint_get_spreadsheet():
     # attempt to serve the file that was just created
     return serve_file(sname)
 
+# Used to retrieve the budget cache's statistics (hit/miss counters, etc.),
+# along with how long the current budget took to load and the authentication
+# token cache's statistics.
+@app.route("/get/cache", methods = ["GET", "POST"])
+def endpoint_get_cache():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+    jdata = bcache.to_json()
+    jdata["budget"] = get_budget(dt=datetime.now()).load_stats()
+    jdata["auth"] = auth_cache_stats()
+    return make_response_json(jdata=jdata)
+
+# Used to retrieve the request metrics (the time each endpoint's requests spent
+# in each phase), in the Prometheus text format. Clients that can't log in
+# (such as a Prometheus server) can send their token in an "Authorization:
+# Bearer" header instead.
+@app.route("/metrics", methods = ["GET"])
+def endpoint_metrics():
+    user = get_user(session)
+    if user == None:
+        user = auth_check_bearer(request.headers.get("Authorization"))
+    if user == None or not config.metrics_enabled:
+        return make_response_json(rstatus=404)
+    return Response(response=metrics.to_prometheus(), status=200,
+                    headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+# Used to retrieve the reports of the most recently profiled requests, newest
+# first. Optionally takes in an "id" to retrieve a single report. Only
+# available to users allowed to profile requests.
+@app.route("/get/profiles", methods = ["GET", "POST"])
+def endpoint_get_profiles():
+    user = get_user(session)
+    if not check_profile_privilege(user):
+        return make_response_json(rstatus=404)
+    jdata = get_request_json()
+    with profiles_lock:
+        reports = list(reversed(profiles))
+    if type(jdata) == dict and "id" in jdata:
+        for r in reports:
+            if r["id"] == jdata["id"]:
+                return make_response_json(jdata=r)
+        return make_response_json(success=False, msg="Couldn't find a matching profile.")
+    return make_response_json(jdata=reports)
+
+# Used to retrieve the file writer's statistics (write and commit latencies,
+# group commit sizes, etc.).
+@app.route("/get/io", methods = ["GET", "POST"])
+def endpoint_get_io():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+    conf = bcache.get_config(datetime.now())
+    writer = get_writer(conf.durability, conf.durability_window_ms / 1000.0)
+    return make_response_json(jdata=writer.to_json())
+
 
 # ================================== Search ================================== #
 # Helper function used for the searcher endpoints. Takes in the 'mode' to
@@ -389,6 +795,13 @@ def search_helper(mode):
     expect = [["query", str]]
     if not check_json_fields(jdata, expect):
         return make_response_json(success=False, msg="Missing JSON fields.")
+
+    # an optional "limit" caps the number of (ranked) results returned
+    limit = None
+    if "limit" in jdata:
+        if type(jdata["limit"]) != int or jdata["limit"] < 1:
+            return make_response_json(success=False, msg="Invalid JSON fields.")
+        limit = jdata["limit"]
     
     # invoke the budget API to search for classes
     b = get_budget(dt=session["datetime"])
@@ -396,9 +809,9 @@ def search_helper(mode):
     result = None
     mode = mode.lower()
     if mode == "class":
-        result = b.search_class(jdata["query"])
+        result = b.search_class(jdata["query"], limit=limit)
     elif mode == "transaction":
-        result = b.search_transaction(jdata["query"])
+        result = b.search_transaction(jdata["query"], limit=limit)
 
     # if the search failed, return an appropriate message
     if not result.success:
@@ -406,11 +819,11 @@ def search_helper(mode):
         return make_response_json(success=False, msg=m)
     matches = result.data
 
-    # build a JSON array of all matches
-    jarray = []
-    for c in matches:
-        jarray.append(c.to_json())
-    return make_response_json(jdata=jarray)
+    # stream back a JSON array of all matches (classes are streamed by the
+    # budget, which copies their histories safely)
+    if mode == "class":
+        return make_response_stream(b.iter_json_classes(matches))
+    return make_response_stream(iter_json_array(matches))
    
 # Takes in some string as input and uses it to search for matching budget
 # classes.
@@ -423,6 +836,37 @@ def endpoint_search_class():
 def endpoint_search_transaction():
     return search_helper("transaction")
 
+# Used to ask the learned model which class a transaction belongs in, given its
+# vendor (and, optionally, its description). Responds with the budget's
+# classes, most likely first, along with their probabilities.
+@app.route("/suggest/class", methods = ["POST"])
+def endpoint_suggest_class():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+
+    # extract the json data in the request body
+    jdata = get_request_json()
+    if type(jdata) == Exception:
+        return make_response_json(rstatus=400, msg="Failed to parse request body.")
+    elif jdata == None:
+        return make_response_json(rstatus=400, msg="Missing request body.")
+
+    # we're expecting a vendor, and optionally a description and a limit
+    if not check_json_fields(jdata, [["vendor", str]]):
+        return make_response_json(success=False, msg="Missing JSON fields.")
+    desc = jdata.get("description", "")
+    limit = jdata.get("limit", None)
+    if type(desc) != str or (limit != None and (type(limit) != int or limit < 1)):
+        return make_response_json(success=False, msg="Invalid JSON fields.")
+
+    b = get_budget(dt=session["datetime"])
+    result = b.suggest_class(jdata["vendor"], description=desc, limit=limit)
+    if not result.success:
+        m = "Failed: %s" % result.message
+        return make_response_json(success=False, msg=m)
+    return make_response_json(jdata=[s.to_json() for s in result.data])
+
 
 # ================================= Creation ================================= #
 # Used to create a new budget class.
@@ -553,13 +997,15 @@ def endpoint_create_transaction_search():
         return make_response_json(success=False, msg="Missing JSON fields.")
     jdata["price"] = float(jdata["price"]) # make sure the price is a float
 
-    # first, search for the class, given its ID (make a shallow copy)
+    # first, pick a class using the query (or, if the query doesn't match any
+    # class's keywords, the vendor and description)
     b = get_budget(dt=session["datetime"])
-    result = b.search_class(jdata["query"])
+    result = b.classify_transaction(jdata["query"], vendor=jdata["vendor"],
+                                    description=jdata["description"])
     if not result.success:
         m = "Failed: %s" % result.message
         return make_response_json(success=False, msg=m)
-    bclass = result.data[0]
+    bclass = result.data
 
     # try to convert the given timestamp integer into a datetime object
     ts = None
@@ -579,6 +1025,41 @@ def endpoint_create_transaction_search():
     return make_response_json(msg="Transaction created. Added to class: \"%s\"." % bclass.name,
                               jdata=t.to_json())
 
+# Used to create many transactions at once. The request holds a list of rows
+# (see lib/importer.py), each of which names its class by ID ("class_id") or by
+# a search query ("query"). Every row is validated before anything is written,
+# and each affected class is saved exactly once. If "strict" is true, nothing
+# is imported unless every row is valid. The response holds a result for each
+# row.
+@app.route("/create/transactions", methods = ["POST"])
+def endpoint_create_transactions():
+    user = get_user(session)
+    if user == None:
+        return make_response_json(rstatus=404)
+
+    # extract the json data in the request body
+    jdata = get_request_json()
+    if type(jdata) == Exception:
+        return make_response_json(rstatus=400, msg="Failed to parse request body.")
+    elif jdata == None:
+        return make_response_json(rstatus=400, msg="Missing request body.")
+
+    # we're expecting a list of rows, and an optional 'strict' flag
+    if not check_json_fields(jdata, [["transactions", list]]):
+        return make_response_json(success=False, msg="Missing JSON fields.")
+    strict = jdata.get("strict", False)
+    if type(strict) != bool:
+        return make_response_json(success=False, msg="Invalid JSON fields.")
+
+    # import the rows and send back each row's result
+    b = get_budget(dt=session["datetime"])
+    result = import_rows(b, jdata["transactions"], strict=strict)
+    imported = sum(1 for r in result.data if r["success"])
+    rdata = {"imported": imported, "failed": len(result.data) - imported,
+             "results": result.data}
+    m = result.message if result.success else "Failed: %s" % result.message
+    return make_response_json(success=result.success, msg=m, jdata=rdata)
+
 
 # ================================= Deletion ================================= #
 # Helper function for the two delete endpoints.
@@ -790,42 +1271,52 @@ def endpoint_edit_transaction():
         else:
             jdata[key] = None
     
-    # make updates to the transaction where appropriate
+    # convert every field before anything is changed (a budget's transactions
+    # are shared by every request, so the cached transaction is never
+    # modified; an edited copy replaces it)
+    price = t.price
+    vendor = t.vendor
+    desc = t.desc
+    ts = t.timestamp
+    recurring = t.recurring
     if jdata["price"] != None:
-        t.price = float(jdata["price"])
+        price = float(jdata["price"])
         changes += 1
     if jdata["vendor"] != None:
-        t.vendor = jdata["vendor"]
+        vendor = jdata["vendor"]
         changes += 1
     if jdata["description"] != None:
-        t.desc = jdata["description"]
+        desc = jdata["description"]
         changes += 1
     if jdata["timestamp"] != None:
         # try to convert the given timestamp integer into a datetime object
         try:
             ts = datetime.fromtimestamp(jdata["timestamp"])
-            t.timestamp = ts
             changes += 1
         except Exception as e:
             return make_response_json(success=False, msg="Invalid JSON fields.")
     if jdata["recurring"] != None:
-        t.recurring = jdata["recurring"]
+        recurring = jdata["recurring"]
         changes += 1
     if bc != None:
         changes += 1
 
-    # delete the transaction then re-add it to the correct class to force the
-    # update
+    # delete the transaction then add the edited copy to the correct class
+    # (if the copy can't be added, the original is put back)
     if changes > 0:
-        bc = t.owner if bc == None else bc
+        owner = t.owner
+        bc = owner if bc == None else bc
+        new_t = Transaction(price, vendor=vendor, description=desc, timestamp=ts,
+                            tid=t.tid, recur=recurring)
         # attempt a delete
         result = b.delete_transaction(t)
         if not result.success:
             m = "Failed: %s" % result.message
             return make_response_json(success=False, msg=m)
         # attempt an add
-        result = b.add_transaction(bc, t)
+        result = b.add_transaction(bc, new_t)
         if not result.success:
+            b.add_transaction(owner, t)
             m = "Failed: %s" % result.message
             return make_response_json(success=False, msg=m)
         return make_response_json(msg="Made %d changes." % changes)
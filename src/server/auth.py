@@ -8,6 +8,10 @@ import jwt
 from datetime import datetime
 import os
 import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 
 # Enable import from the parent directory
 dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
@@ -23,6 +27,17 @@ config = None
 auth_password = None            # authentication password
 auth_secret = None              # JWT decode/encode key
 auth_cookie_name = "sb_auth"    # name of cookie
+auth_users = {}                 # username --> User
+# Verified tokens are cached (keyed by a digest of the token), so a client
+# sending the same token again doesn't pay for decoding it again. Entries
+# expire after AUTH_CACHE_TTL seconds (or when their token does), and the
+# least-recently used entry is evicted once there are AUTH_CACHE_SIZE of them
+AUTH_CACHE_SIZE = 1024
+AUTH_CACHE_TTL = 300
+auth_cache = OrderedDict()      # token digest --> [decoded JWT, expiry time]
+auth_cache_lock = threading.Lock()
+auth_cache_hits = 0
+auth_cache_misses = 0
 
 
 # ============================= Helper Functions ============================= #
@@ -34,14 +49,19 @@ def read_file(fpath):
     return contents
 
 # ============================== Initialization ============================== #
-# Initialization function for authentication functionality.
+# Initialization function for authentication functionality. Can be invoked
+# again with a new config; the users and keys are replaced, and every cached
+# token is thrown out.
 def auth_init(conf):
     global config
     config = conf
     # retrieve the correct config entries
-    global auth_password, auth_secret
-    auth_password = conf.auth_key
-    auth_secret = conf.auth_jwt_key
+    global auth_password, auth_secret, auth_users
+    with auth_cache_lock:
+        auth_password = conf.auth_key
+        auth_secret = conf.auth_jwt_key
+        auth_users = {u.username: u for u in conf.users}
+        auth_cache.clear()
 
     log_write("Authentication password:   '%s'" % auth_password)
     log_write("JWT password:              '%s'" % auth_secret)
@@ -70,12 +90,10 @@ def auth_check_login(data):
             return None
 
         # make sure the username is in our database
-        for u in config.users:
-            if result["username"] == u.username:
-                log_write("User \"%s\" logged in." % u.username)
-                return u
-        # if no matching user was found, return
-        return None
+        u = auth_users.get(result["username"], None)
+        if u != None:
+            log_write("User \"%s\" logged in." % u.username)
+        return u
     # on exception, print and return
     except Exception as e:
         log_write("Failed to parse JSON contents: %s" % e)
@@ -102,7 +120,25 @@ def auth_check_cookie(cookie):
     # if parsing failed, or we never found the cookie, return
     if result == None:
         return None
+    return auth_check_token(result)
+
+# Checks an HTTP "Authorization" header for a bearer token (the same JWT sent
+# in the authentication cookie), for clients that can't hold onto cookies.
+# Returns the User object representing the user that's making the request.
+def auth_check_bearer(header):
+    if header == None:
+        return None
+    pieces = header.strip().split(" ")
+    if len(pieces) != 2 or pieces[0].lower() != "bearer":
+        return None
+    result = auth_parse_cookie(pieces[1])
+    if result == None:
+        return None
+    return auth_check_token(result)
 
+# Takes in a decoded JWT and checks its fields. Returns the User object it was
+# issued to, or None if it isn't valid.
+def auth_check_token(result):
     # check for the correct fields in the decoded JWT
     if "iat" not in result or "exp" not in result or "sub" not in result:
         return None
@@ -110,12 +146,9 @@ def auth_check_cookie(cookie):
     now = int(datetime.now().timestamp())
     if result["iat"] > now:
         return None
-    # make sure the 'sub' is one of our registered users
-    user = None
-    for u in config.users:
-        if result["sub"] == u.username:
-            user = u
-            break
+    # make sure the 'sub' is one of our registered users (this is checked
+    # every time, even for cached tokens, so removing a user locks them out)
+    user = auth_users.get(result["sub"], None)
     if user == None:
         return None
 
@@ -138,12 +171,47 @@ def auth_make_cookie(user):
     token = jwt.encode(data, auth_secret, algorithm="HS512")
     return token
 
+# Takes in an encoded JWT cookie and returns its decoded contents, or None if
+# its signature doesn't check out. Tokens that check out are cached.
 def auth_parse_cookie(cookie):
-    global auth_secret
+    global auth_secret, auth_cache_hits, auth_cache_misses
+    key = hashlib.sha256(cookie.encode()).digest()
+    now = time.time()
+    with auth_cache_lock:
+        entry = auth_cache.get(key, None)
+        if entry != None and entry[1] > now:
+            auth_cache.move_to_end(key)
+            auth_cache_hits += 1
+            return entry[0]
+        auth_cache_misses += 1
+        secret = auth_secret
     try:
         # we won't verify the expiration here - we do this manually
-        return jwt.decode(cookie, auth_secret, algorithms=["HS512"],
-                          options={"verify_exp": False})
+        result = jwt.decode(cookie, secret, algorithms=["HS512"],
+                            options={"verify_exp": False})
     except Exception as e:
         return None
 
+    # cache the token, unless the key changed while it was being decoded
+    expires = now + AUTH_CACHE_TTL
+    if type(result.get("exp", None)) in [int, float]:
+        expires = min(expires, result["exp"])
+    with auth_cache_lock:
+        if secret == auth_secret:
+            auth_cache[key] = [result, expires]
+            auth_cache.move_to_end(key)
+            while len(auth_cache) > AUTH_CACHE_SIZE:
+                auth_cache.popitem(last=False)
+    return result
+
+# Returns a JSON object containing the token cache's statistics.
+def auth_cache_stats():
+    with auth_cache_lock:
+        lookups = auth_cache_hits + auth_cache_misses
+        return {
+            "entries": len(auth_cache),
+            "hits": auth_cache_hits,
+            "misses": auth_cache_misses,
+            "hit_rate": 0.0 if lookups == 0 else float(auth_cache_hits) / lookups
+        }
+
@@ -56,6 +56,37 @@ class Config:
             assert key in jdata and type(jdata[key]) == f[1], f[2]
             setattr(self, key, jdata[key])
 
+        # each optional entry has a default value that's used if it's missing
+        optional = [
+            # serving-related configs
+            ["server_mode", str, "dev", "server_mode must be a string"],
+            ["server_workers", int, 4, "server_workers must be an int"],
+            ["server_threads", int, 8, "server_threads must be an int"],
+            ["server_keepalive", int, 5, "server_keepalive must be an int"],
+            ["server_backlog", int, 2048, "server_backlog must be an int"],
+            # notification-related configs
+            ["notif_webhook_url", str, "", "notif_webhook_url must be a string"],
+            # metrics-related configs
+            ["metrics_enabled", bool, True, "metrics_enabled must be a boolean"],
+            # profiling-related configs (profiling is off unless a privilege
+            # level is given)
+            ["profile_privilege", int, None, "profile_privilege must be an int"],
+            ["profile_dpath", str, "", "profile_dpath must be a string"]
+        ]
+        for f in optional:
+            key = f[0]
+            if key in jdata:
+                assert type(jdata[key]) == f[1], f[3]
+                setattr(self, key, jdata[key])
+            else:
+                setattr(self, key, f[2])
+        # the server either runs on the flask development server, a pool of
+        # threads, or a pool of processes
+        assert self.server_mode in ["dev", "threads", "processes"], \
+               "server_mode must be either \"dev\", \"threads\", or \"processes\""
+        assert self.server_workers >= 1, "server_workers must be at least 1"
+        assert self.server_threads >= 1, "server_threads must be at least 1"
+
         # for each user, try to create a user object
         uobjs = []
         for udata in self.users:
@@ -1,5 +1,8 @@
 #!/usr/bin/python3
-# Super small main file that invokes 'app.run()' to run the server.
+# Main file that runs the server. By default, the server runs on the Flask
+# development server ('app.run()'). The server config's 'server_mode' can
+# instead run it on a pool of threads (with waitress) or a pool of processes
+# (with gunicorn).
 #
 #   Connor Shugg
 
@@ -24,6 +27,21 @@ from server.log import log_init, log_write
 from server.notif import notif_init, notif_send_email
 import lib.config
 from lib.budget import Budget
+from lib.locks import lock_manager
+
+# Optional imports (production WSGI servers, and file locks)
+try:
+    import waitress
+except ImportError:
+    waitress = None
+try:
+    import gunicorn.app.base
+except ImportError:
+    gunicorn = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Colors and pretty-printing
 C_NONE = "\033[0m"
@@ -38,21 +56,39 @@ rthread = None
 def sigint_handler(sig, frame):
     # join the renewer thread
     log_write("\nSIGINT detected. Joining renewer thread.")
+    renewer_stop()
+    
+    # exit
+    log_write("Exiting.")
+    sys.exit(0)
+
+# Creates and starts the renewer thread.
+def renewer_start(config):
     global rthread
+    rt = RenewerThread(config,
+                       tick_rate=config.rthread_tick_rate,
+                       notif_threshold=config.rthread_notif_threshold)
+    rthread = rt
+    rt.start()
+
+# Stops and joins the renewer thread (if one is running).
+def renewer_stop():
+    global rthread
+    if rthread == None:
+        return
     with rthread.cond:          # acquire condition variable lock
         rthread.kill = True     # set kill switch
         rthread.cond.notify()   # wake up the thread
     rthread.join()              # join thread
-    
-    # exit
-    log_write("Exiting.")
-    sys.exit(0)
+    rthread = None
 
 
 # ============================== Renewer Thread ============================== #
 # The renewer thread is spawned simply to refresh the budget periodically to
 # make sure it doesn't miss important dates (such as reset dates). It's also
-# used to notify users of certain periodic events.
+# used to notify users of certain periodic events. When the server runs as a
+# pool of processes, every worker runs a renewer thread, but only one of them
+# (the one holding the renewer lock file) does any work.
 class RenewerThread(threading.Thread):
     # Constructor. Takes in the server's config object.
     def __init__(self, conf, tick_rate=43200, notif_threshold=172800):
@@ -63,6 +99,7 @@ class RenewerThread(threading.Thread):
         # set up synchronization fields
         self.kill = False                   # master thread kill switch
         self.cond = threading.Condition()   # condition variable
+        self.lock_fp = None                 # renewer lock file (once elected)
 
         # invoke the parent constructor
         threading.Thread.__init__(self, target=self.run)
@@ -73,6 +110,24 @@ class RenewerThread(threading.Thread):
             notif_send_email(user.email, message, subject)
             log_write("Notified user '%s': '%s'" % (user.username, message))
 
+    # Takes in the path to the renewer lock file and attempts to become the
+    # server's one active renewer by taking an exclusive lock on it. Once taken,
+    # the lock is held until the process exits, at which point another
+    # worker's renewer takes over on its next tick. Returns True if this thread
+    # holds the lock.
+    def elect(self, fpath):
+        if self.lock_fp != None or fcntl == None:
+            return True
+        fp = open(fpath, "a")
+        try:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            fp.close()
+            return False
+        self.lock_fp = fp
+        log_write("Renewer thread elected (pid %d)." % os.getpid())
+        return True
+
     # Main runner function for the thread.
     def run(self):
         log_write("Renewer thread spawned.")
@@ -84,8 +139,15 @@ class RenewerThread(threading.Thread):
                 if self.kill:
                     break
 
-            # get a new configuration and budget object
+            # get a new configuration. If another process is the renewer,
+            # there's nothing to do until the next tick
             conf = lib.config.Config(self.conf.sb_config_fpath)
+            if not self.elect(os.path.join(conf.save_location, ".renewer.lock")):
+                with self.cond:
+                    self.cond.wait(timeout=self.tick_rate)
+                continue
+
+            # get a new budget object
             b = Budget(conf)
             
             # compute the time-to-reset
@@ -122,6 +184,72 @@ class RenewerThread(threading.Thread):
         log_write("Renewer thread exiting.")
 
 
+# ================================= Serving ================================== #
+# Runs the server on the Flask development server.
+def serve_dev(config):
+    if config.certs_enabled:
+        app.run(config.server_addr, port=config.server_port,
+                ssl_context=(os.path.join(config.certs_dpath, config.certs_cert_fname),
+                             os.path.join(config.certs_dpath, config.certs_key_fname)))
+    else:
+        app.run(config.server_addr, port=config.server_port)
+
+# Runs the server in this process on a pool of 'server_threads' threads, using
+# waitress. Idle connections are kept open for 'server_keepalive' seconds.
+def serve_threads(config):
+    assert waitress != None, "server_mode \"threads\" requires the waitress package"
+    assert not config.certs_enabled, "server_mode \"threads\" doesn't support HTTPS; " \
+                                     "use \"processes\" or a reverse proxy"
+    waitress.serve(app, host=config.server_addr, port=config.server_port,
+                   threads=config.server_threads, backlog=config.server_backlog,
+                   channel_timeout=config.server_keepalive)
+
+# Runs the server on a pool of 'server_workers' processes (each with a pool of
+# 'server_threads' threads), using gunicorn. The workers share budgets through
+# storage: writes take cross-process locks (see lib/locks.py), and each
+# worker's budget cache reloads a budget when another worker writes to it.
+def serve_processes(config):
+    assert gunicorn != None, "server_mode \"processes\" requires the gunicorn package"
+    conf = lib.config.Config(config.sb_config_fpath)
+    lock_manager.share(conf.save_location)
+
+    # each worker runs its own renewer thread (see 'RenewerThread.elect()')
+    options = {
+        "bind": "%s:%d" % (config.server_addr, config.server_port),
+        "workers": config.server_workers,
+        "threads": config.server_threads,
+        "worker_class": "gthread",
+        "keepalive": config.server_keepalive,
+        "backlog": config.server_backlog,
+        "preload_app": True,
+        "post_worker_init": lambda worker: renewer_start(config),
+        "worker_exit": lambda server, worker: renewer_stop()
+    }
+    if config.certs_enabled:
+        options["certfile"] = os.path.join(config.certs_dpath, config.certs_cert_fname)
+        options["keyfile"] = os.path.join(config.certs_dpath, config.certs_key_fname)
+    GunicornApplication(app, options).run()
+
+# Small gunicorn application that serves the Flask app with the given options
+# (rather than parsing them from the command line).
+if gunicorn != None:
+    class GunicornApplication(gunicorn.app.base.BaseApplication):
+        # Constructor. Takes in the WSGI app and a dictionary of options.
+        def __init__(self, wsgi_app, options):
+            self.wsgi_app = wsgi_app
+            self.options = options
+            gunicorn.app.base.BaseApplication.__init__(self)
+
+        # Applies the options to gunicorn's config.
+        def load_config(self):
+            for (key, value) in self.options.items():
+                self.cfg.set(key, value)
+
+        # Returns the WSGI app to serve.
+        def load(self):
+            return self.wsgi_app
+
+
 # ============================== Server Startup ============================== #
 # Main function
 def main():
@@ -138,24 +266,23 @@ def main():
     auth_init(config)
     notif_init(config)
 
+    # in process mode, gunicorn manages the workers (and their renewers)
+    log_write("Serving in \"%s\" mode." % config.server_mode)
+    if config.server_mode == "processes":
+        serve_processes(config)
+        return
+
     # set up the SIGINT handler
     signal.signal(signal.SIGINT, sigint_handler)
 
     # create the renwer thread
-    global rthread
-    rt = RenewerThread(config,
-                       tick_rate=config.rthread_tick_rate,
-                       notif_threshold=config.rthread_notif_threshold)
-    rthread = rt
-    rt.start()
+    renewer_start(config)
 
-    # run the flask app, with or without HTTPS
-    if config.certs_enabled:
-        app.run(config.server_addr, port=config.server_port,
-                ssl_context=(os.path.join(config.certs_dpath, config.certs_cert_fname),
-                             os.path.join(config.certs_dpath, config.certs_key_fname)))
+    # run the flask app
+    if config.server_mode == "threads":
+        serve_threads(config)
     else:
-        app.run(config.server_addr, port=config.server_port)
+        serve_dev(config)
 
 # Runner code
 if (__name__ == "__main__"):
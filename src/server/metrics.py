@@ -0,0 +1,177 @@
+# Python module responsible for the server's request metrics. Each request is
+# broken up into phases (parsing the request, checking its cookie, retrieving
+# the budget, running the endpoint, serializing the response, sending a
+# notification), and the time each phase takes is added to a histogram kept
+# per endpoint and phase. Phases reported by the library (such as loading or
+# saving a budget; see lib/timing.py) are attributed to the request that
+# triggered them.
+#
+# The histograms are exported in the Prometheus text format. In "processes"
+# server mode, every worker keeps (and exports) its own metrics.
+#
+#   Connor Shugg
+
+# Imports
+import os
+import sys
+import time
+import bisect
+import threading
+
+# Enable import from the parent directory
+dpath = os.path.dirname(os.path.realpath(__file__)) # directory of this file
+dpath = os.path.dirname(dpath)                      # parent directory
+if dpath not in sys.path:                           # add to path
+        sys.path.append(dpath)
+
+# Globals
+# Upper bounds of the histogram buckets, in seconds
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PREFIX = "snowbudget"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+metrics_local = threading.local()   # phases of the request each thread is handling
+
+
+# ================================ Histogram ================================= #
+# Simple class that counts observations into a fixed set of buckets.
+class Histogram:
+    # Constructor.
+    def __init__(self):
+        self.buckets = [0] * (len(METRICS_BUCKETS) + 1) # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    # Records one observation of the given number of seconds.
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+# ============================= Request Metrics ============================== #
+# Holds a histogram of every (endpoint, phase) pair seen so far, and a count
+# of the responses sent by each endpoint, per status code.
+class RequestMetrics:
+    # Constructor.
+    def __init__(self):
+        self.histograms = {}        # (endpoint, phase) --> Histogram
+        self.responses = {}         # (endpoint, status) --> count
+        self.lock = threading.Lock()
+
+    # Takes in an endpoint, a phase, and a number of seconds and records it.
+    def observe(self, endpoint, phase, seconds):
+        key = (endpoint, phase)
+        with self.lock:
+            h = self.histograms.get(key, None)
+            if h == None:
+                h = Histogram()
+                self.histograms[key] = h
+            h.observe(seconds)
+
+    # Takes in an endpoint, the status code of its response, and a dictionary
+    # of phase --> seconds, and records all of them at once.
+    def observe_request(self, endpoint, status, phases):
+        with self.lock:
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+            for (phase, seconds) in phases.items():
+                h = self.histograms.get((endpoint, phase), None)
+                if h == None:
+                    h = Histogram()
+                    self.histograms[(endpoint, phase)] = h
+                h.observe(seconds)
+
+    # Returns the metrics in the Prometheus text format.
+    def to_prometheus(self):
+        with self.lock:
+            hists = sorted((k, list(h.buckets), h.count, h.sum)
+                           for (k, h) in self.histograms.items())
+            responses = sorted(self.responses.items())
+        name = "%s_request_phase_seconds" % METRICS_PREFIX
+        lines = ["# HELP %s Time spent in each phase of a request." % name,
+                 "# TYPE %s histogram" % name]
+        for ((endpoint, phase), buckets, count, total) in hists:
+            labels = "endpoint=\"%s\",phase=\"%s\"" % (metrics_escape(endpoint), phase)
+            cumulative = 0
+            for (bound, n) in zip(METRICS_BUCKETS, buckets):
+                cumulative += n
+                lines.append("%s_bucket{%s,le=\"%s\"} %d" % (name, labels, bound, cumulative))
+            lines.append("%s_bucket{%s,le=\"+Inf\"} %d" % (name, labels, count))
+            lines.append("%s_sum{%s} %.9f" % (name, labels, total))
+            lines.append("%s_count{%s} %d" % (name, labels, count))
+        name = "%s_responses_total" % METRICS_PREFIX
+        lines.append("# HELP %s Responses sent, by endpoint and status code." % name)
+        lines.append("# TYPE %s counter" % name)
+        for ((endpoint, status), n) in responses:
+            lines.append("%s{endpoint=\"%s\",status=\"%d\"} %d" %
+                         (name, metrics_escape(endpoint), status, n))
+        return "\n".join(lines) + "\n"
+
+
+# ============================= Request Phases =============================== #
+# Takes in a label value and escapes it for the Prometheus text format.
+def metrics_escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Begins timing the current request. Its phases are kept (per thread, since
+# every server mode handles one request per thread at a time) until
+# 'metrics_finish()' is called.
+def metrics_start():
+    metrics_local.start = time.perf_counter()
+    metrics_local.phases = {}
+    metrics_local.begun = {}
+
+# Takes in a phase and a number of seconds and adds it to the current
+# request's phases. Does nothing outside of a request that's being timed (so
+# it can be used as a timing hook for the library).
+def metrics_add(phase, seconds):
+    phases = getattr(metrics_local, "phases", None)
+    if phases != None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+# Context manager that times the code within it and adds it to the current
+# request's phases.
+class metrics_phase:
+    # Constructor. Takes in the name of the phase.
+    def __init__(self, phase):
+        self.phase = phase
+
+    # Starts the timer.
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    # Stops the timer and adds the time to the phase.
+    def __exit__(self, exc_type, exc_value, traceback):
+        metrics_add(self.phase, time.perf_counter() - self.start)
+        return False
+
+# Takes in a phase and marks the time it begins, for phases that can't be
+# wrapped in 'metrics_phase()' (such as one that starts in one request hook
+# and ends in another).
+def metrics_begin(phase):
+    begun = getattr(metrics_local, "begun", None)
+    if begun != None:
+        begun[phase] = time.perf_counter()
+
+# Takes in a phase started with 'metrics_begin()' and adds the time since it
+# began to the current request's phases.
+def metrics_end(phase):
+    begun = getattr(metrics_local, "begun", None)
+    start = None if begun == None else begun.pop(phase, None)
+    if start != None:
+        metrics_add(phase, time.perf_counter() - start)
+
+# Takes in the request metrics, the request's endpoint, and the status code of
+# its response, and records the current request's phases (along with its
+# total time). The request stops being timed, so calling this again for the
+# same request does nothing.
+def metrics_finish(metrics, endpoint, status):
+    phases = getattr(metrics_local, "phases", None)
+    if phases == None:
+        return
+    phases["total"] = time.perf_counter() - metrics_local.start
+    metrics_local.phases = None
+    metrics_local.begun = None
+    metrics.observe_request(endpoint, status, phases)
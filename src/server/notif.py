@@ -10,9 +10,13 @@ config = None
 webhook_url = "https://maker.ifttt.com/trigger/%s/json/with/key/%s"
 
 # Initializes the notification code, given the server's SMTP username and
-# passsword.
+# passsword. If the config gives its own webhook URL (such as a local stub used
+# for testing), notifications are sent there instead of to IFTTT.
 def notif_init(conf):
     global webhook_url
+    if conf.notif_webhook_url != "":
+        webhook_url = conf.notif_webhook_url
+        return
     webhook_url = webhook_url % (conf.notif_webhook_event, conf.ifttt_webhook_key)
 
 # Function to send a string message to an email address.